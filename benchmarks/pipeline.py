@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Throughput and latency benchmarks of the acquisition pipeline.
+
+Run with ``python benchmarks/pipeline.py`` once the package is installed.
+Synthetic firmware lines are pushed through each stage, and through the
+whole threaded pipeline into an in-process stand-in for the AMQP broker,
+to report events per second, serial-to-publish latencies and peak memory.
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import json
+import resource
+import threading
+import time
+
+from cosmicpi_daq.detector import Detector, Sensors
+from cosmicpi_daq.event import Event
+from cosmicpi_daq.event_publisher import EventPublisher
+from cosmicpi_daq.ring_buffer import RingBuffer
+from cosmicpi_daq.serializers import SERIALIZERS, get_serializer
+from cosmicpi_daq.simulator import (DEFAULT_MIX, LineGenerator,
+                                    SimulatedUsbHandler, parse_mix)
+from cosmicpi_daq.usb_handler import UsbReader
+
+
+class LocalChannel(object):
+    """Channel of the local broker, recording what is published."""
+
+    def __init__(self):
+        self.received = []
+        self.is_open = True
+
+    def exchange_declare(self, **kwargs):
+        pass
+
+    def confirm_delivery(self):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        count = (properties.headers or {}).get('batch_size', 1)
+        self.received.append((time.time(), count, len(body)))
+
+
+class LocalConnection(object):
+    """In-process stand-in for a blocking AMQP connection."""
+
+    def __init__(self):
+        self.is_open = True
+        self._channel = LocalChannel()
+
+    def channel(self):
+        return self._channel
+
+    def process_data_events(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+class LocalPublisher(EventPublisher):
+    """Event publisher connected to the local broker."""
+
+    def open_connection(self):
+        return LocalConnection()
+
+    @property
+    def published(self):
+        return sum(count for _, count, _ in self.channel.received)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def bench_parse(lines):
+    sensors = Sensors()
+    started = time.time()
+    for line in lines:
+        sensors.update(line)
+    return dict(lines_per_second=len(lines) / (time.time() - started))
+
+
+def bench_serialize(lines, serializer):
+    sensors = Sensors()
+    events = []
+    for line in lines:
+        sensors.update(line)
+        events.append(Event('bench', sensors))
+    started = time.time()
+    size = sum(len(serializer.dumps(event)) for event in events)
+    return dict(
+        events_per_second=len(events) / (time.time() - started),
+        bytes_per_event=size / float(len(events)),
+    )
+
+
+def bench_pipeline(lines, serializer, batch_size, capacity):
+    usb_handler = SimulatedUsbHandler(lines)
+    buffer = RingBuffer(capacity, overflow='block')
+    publisher = LocalPublisher('amqp://local', batch_size=batch_size,
+                               serializer=serializer)
+    detector = Detector(usb_handler, publisher, False, buffer=buffer,
+                        serializer=serializer, detector_id='bench')
+    reader = UsbReader(usb_handler, buffer)
+
+    threads = [threading.Thread(target=target)
+               for target in (reader, detector)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    while publisher.published + len(publisher.batch) < len(lines):
+        time.sleep(0.01)
+    publisher.flush()
+    elapsed = time.time() - started
+    reader.stop()
+    detector.stop()
+    for thread in threads:
+        thread.join()
+
+    received = []
+    for receive_time, count, _ in publisher.channel.received:
+        received.extend([receive_time] * count)
+    latencies = [
+        (published - read) * 1000.0
+        for read, published in zip(usb_handler.read_times, received)
+    ]
+    return dict(
+        events_per_second=len(lines) / elapsed,
+        latency_p50_ms=percentile(latencies, 0.5),
+        latency_p99_ms=percentile(latencies, 0.99),
+        messages=len(publisher.channel.received),
+        buffer_high_water_mark=buffer.high_water_mark,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--lines', type=int, default=20000,
+                        help='number of synthetic lines')
+    parser.add_argument('--mix', type=parse_mix,
+                        default=DEFAULT_MIX,
+                        help='traffic mix, e.g. cosmic=0.5,weather=0.5')
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--buffer-capacity', type=int, default=1024)
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args()
+
+    lines = LineGenerator(args.mix).lines(args.lines)
+    results = dict(parse=bench_parse(lines))
+    for name in sorted(SERIALIZERS):
+        serializer = get_serializer(name)
+        results['serialize_' + name] = bench_serialize(lines, serializer)
+        results['pipeline_' + name] = bench_pipeline(
+            lines, serializer, args.batch_size, args.buffer_capacity)
+    results['peak_rss_mb'] = peak_rss_mb()
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+
+    for stage, values in sorted(results.items()):
+        if isinstance(values, dict):
+            print('{0}:'.format(stage))
+            for key, value in sorted(values.items()):
+                print('    {0:<24} {1:>14.2f}'.format(key, value))
+        else:
+            print('{0:<28} {1:>14.2f}'.format(stage, values))
+
+
+if __name__ == '__main__':
+    main()
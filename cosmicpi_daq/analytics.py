@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Cosmic rates and their correlation with the environment.
+
+The functions operate on NumPy arrays, e.g. columns read from the event
+store, and require NumPy. :class:`RollingRate` keeps cheap rolling summaries
+of a live detector and does not.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import math
+import threading
+import time
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+
+def binned_rates(timestamps_ns, bin_seconds, start_ns=None, end_ns=None):
+    """Count hits in bins of ``bin_seconds``.
+
+    Return the start of each bin in nanoseconds, the number of hits and the
+    rate in hertz.
+    """
+    timestamps_ns = np.asarray(timestamps_ns, dtype='int64')
+    bin_ns = int(bin_seconds * 1e9)
+    if start_ns is None:
+        start_ns = int(timestamps_ns.min()) if len(timestamps_ns) else 0
+    if end_ns is None:
+        end_ns = int(timestamps_ns.max()) + 1 if len(timestamps_ns) else 0
+    bins = max(0, -(-(end_ns - start_ns) // bin_ns))
+
+    inside = (timestamps_ns >= start_ns) & (timestamps_ns < end_ns)
+    counts = np.bincount((timestamps_ns[inside] - start_ns) // bin_ns,
+                         minlength=bins)
+    starts = start_ns + np.arange(bins, dtype='int64') * bin_ns
+    return starts, counts, counts / bin_seconds
+
+
+def binned_means(timestamps_ns, values, bin_seconds, start_ns, bins):
+    """Return the mean of ``values`` in each bin, NaN for empty bins."""
+    timestamps_ns = np.asarray(timestamps_ns, dtype='int64')
+    values = np.asarray(values, dtype='float64')
+    bin_ns = int(bin_seconds * 1e9)
+    index = (timestamps_ns - start_ns) // bin_ns
+    inside = (index >= 0) & (index < bins)
+    sums = np.bincount(index[inside], weights=values[inside], minlength=bins)
+    counts = np.bincount(index[inside], minlength=bins)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+
+def moving_average(values, window):
+    """Return the moving average of ``values`` over ``window`` samples.
+
+    The result is ``window - 1`` samples shorter than ``values``.
+    """
+    values = np.asarray(values, dtype='float64')
+    if window < 1 or window > len(values):
+        return np.empty(0)
+    sums = np.cumsum(np.concatenate(([0.0], values)))
+    return (sums[window:] - sums[:-window]) / window
+
+
+def fit_environment(counts, pressure, temperature=None,
+                    reference_pressure=None, reference_temperature=None):
+    """Fit the barometric (and temperature) coefficient of binned rates.
+
+    The counts of equal length bins are modelled as
+    ``N = N0 * exp(beta * (P - P0) + alpha * (T - T0))`` and fitted by
+    least squares on ``log(N)``, weighting each bin by its count as
+    Poisson statistics suggest. ``P0`` and ``T0`` default to the mean
+    pressure and temperature. Bins without hits or without readings are
+    ignored.
+
+    Return a dictionary with ``beta`` in 1/hPa, ``alpha`` in 1/degree (if
+    a temperature is given), their standard errors and ``n0``. Raise
+    ValueError if the fit is not possible.
+    """
+    counts = np.asarray(counts, dtype='float64')
+    columns = [np.asarray(pressure, dtype='float64')]
+    if temperature is not None:
+        columns.append(np.asarray(temperature, dtype='float64'))
+
+    valid = counts > 0
+    for column in columns:
+        valid &= np.isfinite(column)
+    if valid.sum() <= len(columns) + 1:
+        raise ValueError('not enough bins to fit')
+    counts = counts[valid]
+    columns = [column[valid] for column in columns]
+
+    references = [reference_pressure, reference_temperature]
+    for index, column in enumerate(columns):
+        if references[index] is None:
+            references[index] = float(column.mean())
+        columns[index] = column - references[index]
+
+    weights = np.sqrt(counts)
+    design = np.column_stack([np.ones_like(counts)] + columns)
+    try:
+        solution, _, _, _ = np.linalg.lstsq(
+            design * weights[:, None], np.log(counts) * weights, rcond=None)
+        residuals = np.log(counts) - design.dot(solution)
+        dof = len(counts) - design.shape[1]
+        scale = (weights ** 2 * residuals ** 2).sum() / dof
+        covariance = np.linalg.inv(
+            (design * (weights ** 2)[:, None]).T.dot(design)) * scale
+    except np.linalg.LinAlgError as e:
+        raise ValueError(str(e))
+    errors = np.sqrt(np.diag(covariance))
+
+    result = dict(
+        n0=float(math.exp(solution[0])),
+        beta=float(solution[1]),
+        beta_error=float(errors[1]),
+        reference_pressure=references[0],
+    )
+    if temperature is not None:
+        result.update(
+            alpha=float(solution[2]),
+            alpha_error=float(errors[2]),
+            reference_temperature=references[1],
+        )
+    return result
+
+
+class RollingRate(object):
+    """Rolling hit rate and environment of a live detector.
+
+    Time is split in bins of ``bin_seconds`` and the last ``bins`` complete
+    bins are kept, so each event only costs a few additions and the summary
+    is computed over a bounded number of bins. Readings still at zero are
+    taken as not received yet and left out of the means.
+    """
+
+    def __init__(self, bin_seconds=60, bins=60, clock=time.time):
+        self.bin_seconds = bin_seconds
+        self.clock = clock
+        self.history = deque(maxlen=bins)
+        self.lock = threading.Lock()
+        self.current = self._new_bin(self.clock())
+
+    def _new_bin(self, now):
+        start = now - now % self.bin_seconds
+        # Start, hits, pressure sum and count, temperature sum and count.
+        return [start, 0, 0.0, 0, 0.0, 0]
+
+    def _roll(self, now):
+        while now >= self.current[0] + self.bin_seconds:
+            self.history.append(self.current)
+            self.current = self._new_bin(self.current[0] + self.bin_seconds)
+
+    def add(self, event):
+        """Account for an event."""
+        with self.lock:
+            self._roll(self.clock())
+            current = self.current
+            if event.event is not None:
+                current[1] += 1
+            if event.barometer.pressure:
+                current[2] += event.barometer.pressure
+                current[3] += 1
+            if event.temperature.temperature or event.temperature.humidity:
+                current[4] += event.temperature.temperature
+                current[5] += 1
+
+    def summary(self):
+        """Return the rate and mean environment over the complete bins."""
+        with self.lock:
+            self._roll(self.clock())
+            history = list(self.history)
+        duration = len(history) * self.bin_seconds
+        hits = sum(item[1] for item in history)
+        pressures = sum(item[3] for item in history)
+        temperatures = sum(item[5] for item in history)
+        return dict(
+            duration=duration,
+            hits=hits,
+            rate=hits / duration if duration else None,
+            rate_error=math.sqrt(hits) / duration if duration else None,
+            pressure=sum(item[2] for item in history) / pressures
+            if pressures else None,
+            temperature=sum(item[4] for item in history) / temperatures
+            if temperatures else None,
+        )
@@ -20,35 +20,67 @@
 
 """CosmicPi command line interface."""
 
+import json
 import logging
 import socket
 import sys
-import time
 
 from blessings import Terminal
 from cliff.app import App
 from cliff.command import Command
 from cliff.commandmanager import CommandManager
 
+from .command_server import encode_frame, recv_frame
 from .version import __version__
 
 
 class SocketCommand(object):
+    """Send commands to the acquisition process over its local socket.
 
-    @staticmethod
-    def send_and_receive(command):
-        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    The connection is kept open and reused by later commands.
+    """
+
+    socket_path = "/tmp/cosmicpi.sock"
+    sock = None
 
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         try:
-            sock.connect("/tmp/cosmicpi.sock")
+            sock.connect(self.socket_path)
         except:
             print("Fatal: Couldn't connect, is the process running?")
             sys.exit(1)
-
-        sock.send(command)
-        response = sock.recv(1024)
-        sock.close()
-        return response
+        return sock
+
+    def send_and_receive(self, command):
+        """Return the response of the acquisition process to a command."""
+        for _ in range(2):
+            if self.sock is None:
+                self.sock = self.connect()
+            try:
+                self.sock.sendall(encode_frame(command))
+                return recv_frame(self.sock)
+            except (EOFError, socket.error):
+                # Idle connections are closed by the process, reconnect.
+                self.sock.close()
+                self.sock = None
+        print("Fatal: connection to the process lost")
+        sys.exit(1)
+
+    def subscribe(self, types):
+        """Yield the messages pushed by the acquisition process."""
+        self.sock = self.connect()
+        try:
+            self.sock.sendall(encode_frame(' '.join(['subscribe'] + types)))
+            response = recv_frame(self.sock)
+            if not response.startswith('Subscribed'):
+                print("Fatal: " + response.strip())
+                sys.exit(1)
+            while True:
+                yield json.loads(recv_frame(self.sock))
+        except (EOFError, socket.error):
+            print("Fatal: connection to the process lost")
+            sys.exit(1)
 
 
 class UsbToggle(Command, SocketCommand):
@@ -58,6 +90,20 @@ class UsbToggle(Command, SocketCommand):
         self.app.stdout.write(self.send_and_receive('u') + '\n')
 
 
+class Detectors(Command, SocketCommand):
+    """List the detectors handled by the acquisition process."""
+
+    def take_action(self, args):
+        self.app.stdout.write(self.send_and_receive('detectors'))
+
+
+class Metrics(Command, SocketCommand):
+    """Show the metrics of the acquisition process."""
+
+    def take_action(self, args):
+        self.app.stdout.write(self.send_and_receive('metrics'))
+
+
 class Arduino(Command, SocketCommand):
     """Send commands to the Arduino firmware."""
 
@@ -128,17 +174,17 @@ class Status(Command, SocketCommand):
     def take_action(self, args):
         if args.monitor:
             term = Terminal()
-
-            while True:
-                try:
-                    status = self.get_status()
-                    self.app.stdout.write(status)
-                    self.app.stdout.write(term.move_y(
-                        term.height - len(status.split('\n'))))
-                    time.sleep(1)
-                except KeyboardInterrupt:
-                    self.app.stdout.write(term.move_y(term.height) + '\n')
-                    return
+            detectors = {}
+            try:
+                # The process pushes the values that changed, redraw then.
+                for message in self.subscribe(['monitor']):
+                    for detector_id, changes in message['detectors'].items():
+                        detectors.setdefault(detector_id, {}).update(changes)
+                    status = format_monitor(detectors)
+                    self.app.stdout.write(term.clear + status)
+                    self.app.stdout.flush()
+            except KeyboardInterrupt:
+                self.app.stdout.write(term.move_y(term.height) + '\n')
         else:
             self.app.stdout.write(self.get_status() + '\n')
 
@@ -146,6 +192,35 @@ class Status(Command, SocketCommand):
         return self.send_and_receive('s')
 
 
+class Subscribe(Command, SocketCommand):
+    """Print the readings and status changes of the acquisition process as
+    they happen, one JSON object per line."""
+
+    def get_parser(self, prog_name):
+        parser = super(Subscribe, self).get_parser(prog_name)
+        parser.add_argument('types', nargs='*',
+                            help='message types to receive: a sensor group, '
+                                 'event or monitor (default: all)')
+        return parser
+
+    def take_action(self, args):
+        try:
+            for message in self.subscribe(args.types):
+                self.app.stdout.write(json.dumps(message) + '\n')
+                self.app.stdout.flush()
+        except KeyboardInterrupt:
+            pass
+
+
+def format_monitor(detectors):
+    """Return the monitor status of every detector as text."""
+    return ''.join(
+        '{0}\n{1}'.format(detector_id, ''.join(
+            '  {0:.<14}: {1}\n'.format(key, value)
+            for key, value in sorted(detectors[detector_id].items())))
+        for detector_id in sorted(detectors))
+
+
 class Cli(App):
     """Command Line Interface."""
 
@@ -162,6 +237,9 @@ class Cli(App):
         commands = {
             'status': Status,
             'usb_toggle': UsbToggle,
+            'detectors': Detectors,
+            'metrics': Metrics,
+            'subscribe': Subscribe,
             'arduino': Arduino
         }
         for k, v in commands.iteritems():
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Detection of coincident hits across several detectors."""
+
+from __future__ import absolute_import, print_function
+
+import heapq
+import json
+import threading
+
+from .timing import timestamp_ns
+
+
+def event_timestamp(event):
+    """Return the nanosecond timestamp of a decoded event dictionary.
+
+    The GPS timestamp stamped by the detector is used if there is one,
+    older events are stamped from their timing readings.
+    """
+    if event.get('gps'):
+        return event['timestamp_ns']
+    timing = event['timing']
+    return timestamp_ns(
+        timing['time_string'],
+        (event.get('event') or {}).get('ticks', 0),
+        timing['counter_frequency'],
+    )
+
+
+class CoincidenceFinder(object):
+    """Group hits of different detectors that are close in time.
+
+    Hits may arrive slightly out of order, e.g. from several live boards:
+    they are kept in a time-sorted heap and only released once no earlier
+    hit can arrive any more, i.e. when they are older than the latest hit by
+    more than ``max_delay_ns``. Released hits are grouped while they fall
+    within ``window_ns`` of the first hit of the group, and a group is
+    reported if it contains at least ``min_detectors`` distinct detectors.
+    """
+
+    def __init__(self, window_ns, min_detectors=2, max_delay_ns=0):
+        self.window = window_ns
+        self.min_detectors = min_detectors
+        self.max_delay = max_delay_ns
+        self.heap = []
+        self.latest = None
+        self.counter = 0
+        self.group = []
+        self.hits = 0
+        self.groups = 0
+
+    def add(self, timestamp, detector_id, event=None):
+        """Add a hit and return the list of groups it completed."""
+        self.hits += 1
+        self.counter += 1
+        heapq.heappush(
+            self.heap, (timestamp, self.counter, detector_id, event))
+        if self.latest is None or timestamp > self.latest:
+            self.latest = timestamp
+
+        completed = []
+        watermark = self.latest - self.max_delay
+        while self.heap and self.heap[0][0] <= watermark:
+            self._release(heapq.heappop(self.heap), completed)
+        return completed
+
+    def _release(self, hit, completed):
+        if self.group and hit[0] - self.group[0][0] > self.window:
+            self._close(completed)
+        self.group.append(hit)
+
+    def _close(self, completed):
+        group, self.group = self.group, []
+        detectors = set(hit[2] for hit in group)
+        if len(detectors) >= self.min_detectors:
+            self.groups += 1
+            completed.append(dict(
+                start=group[0][0],
+                end=group[-1][0],
+                detectors=sorted(detectors),
+                hits=[dict(timestamp=hit[0], detector_id=hit[2],
+                           event=hit[3]) for hit in group],
+            ))
+
+    def flush(self):
+        """Release every pending hit and return the remaining groups."""
+        completed = []
+        while self.heap:
+            self._release(heapq.heappop(self.heap), completed)
+        if self.group:
+            self._close(completed)
+        return completed
+
+
+class CoincidenceStage(object):
+    """Thread-safe coincidence finder fed by live detectors."""
+
+    def __init__(self, finder, on_group):
+        self.finder = finder
+        self.on_group = on_group
+        self.lock = threading.Lock()
+        self.untimed = 0
+
+    def add(self, event):
+        """Add the hit of an Event, if it has one.
+
+        Hits are ignored until the GPS time is known.
+        """
+        if event.event is None:
+            return
+        if not event.gps:
+            self.untimed += 1
+            return
+        with self.lock:
+            groups = self.finder.add(event.timestamp_ns, event.detector_id)
+        for group in groups:
+            self.on_group(group)
+
+
+def read_events(path):
+    """Yield the decoded events of a JSON lines file.
+
+    Each line holds an event or a batch of events, as published with the
+    JSON serializer.
+    """
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            if isinstance(data, list):
+                for event in data:
+                    yield event
+            else:
+                yield data
+
+
+def _timestamped_hits(index, stream):
+    for number, event in enumerate(stream):
+        if event.get('event'):
+            yield event_timestamp(event), index, number, event
+
+
+def find_coincidences(streams, window_ns, min_detectors=2, max_delay_ns=0):
+    """Yield the coincidence groups of several event streams.
+
+    Each stream should be ordered in time, up to ``max_delay_ns``.
+    """
+    finder = CoincidenceFinder(
+        window_ns, min_detectors=min_detectors, max_delay_ns=max_delay_ns)
+    hits = heapq.merge(*[
+        _timestamped_hits(index, stream)
+        for index, stream in enumerate(streams)
+    ])
+    for timestamp, _, _, event in hits:
+        for group in finder.add(timestamp, event['detector_id'], event):
+            yield group
+    for group in finder.flush():
+        yield group
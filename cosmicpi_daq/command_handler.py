@@ -22,150 +22,216 @@
 
 from __future__ import absolute_import, print_function
 
-import os
-import socket
-
+from .command_server import CommandServer
 from .logging import logger as log
+from .metrics import REGISTRY
 
 
 class CommandHandler(object):
     """Command handler."""
 
-    def __init__(self, detector, usb_handler, command_socket):
-        self.detector = detector
-        self.usb_handler = usb_handler
+    def __init__(self, detector, usb_handler, command_socket, manager=None,
+                 subscriptions=None):
+        self._detector = detector
+        self._usb_handler = usb_handler
         self.command_socket = command_socket
+        self.manager = manager
+        self.subscriptions = subscriptions
+        if subscriptions is not None and subscriptions.status is None:
+            subscriptions.status = self.monitor_status
         self.stopping = False
+        self.server = None
+        self.commands = REGISTRY.counter(
+            'cosmicpi_commands_total', 'Commands received on the socket.')
+        self.errors = REGISTRY.counter(
+            'cosmicpi_command_errors_total', 'Commands that failed.')
+
+    @property
+    def detector(self):
+        """Return the detector that commands apply to.
+
+        When several detectors are managed, this is the first one.
+        """
+        if self.manager is not None:
+            pipeline = self.manager.primary
+            return pipeline.detector if pipeline else None
+        return self._detector
+
+    @property
+    def usb_handler(self):
+        """Return the USB handler that commands apply to."""
+        if self.manager is not None:
+            pipeline = self.manager.primary
+            return pipeline.usb_handler if pipeline else None
+        return self._usb_handler
+
+    def detectors(self):
+        """Return every detector."""
+        if self.manager is not None:
+            return self.manager.detectors()
+        return [self._detector]
+
+    def monitor_status(self):
+        """Return the status of every detector by detector ID."""
+        return dict((detector.detector_id, detector.status())
+                    for detector in self.detectors())
 
     def stop(self):
         self.stopping = True
-        self.sock.shutdown(socket.SHUT_RD)
+        if self.server is not None:
+            self.server.stop()
 
     def __call__(self):
-        """Listen on socket and interpret commands."""
-        self.sock = sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        """Serve commands on the local socket until stopped."""
+        self.server = CommandServer(self.command_socket, self.handle_command,
+                                    subscriptions=self.subscriptions)
+        self.server.start()
+        if not self.stopping:
+            self.server.serve()
+
+    def handle_command(self, cmd):
+        """Interpret a command and return the response."""
+        log.info("Received command: %s" % cmd)
+        self.commands.inc()
 
         try:
-            os.remove(self.command_socket)
-        except OSError:
-            pass
-
-        sock.bind(self.command_socket)
-        sock.listen(1)
-        log.info('Listening for commands on local socket')
-
-        while not self.stopping:
-            conn, addr = sock.accept()
-            cmd = conn.recv(1024)
-            if not cmd:
-                break
-
-            log.info("Received command: %s" % cmd)
-
-            try:
-                if cmd == 'd':
-                    if self.options.debug:
-                        self.options.debug = False
-                    else:
-                        self.options.debug = True
-                    response = "Debug:%s\n" % self.options.debug
-
-                elif cmd == 'v':
-                    if self.options.monitoring['vibration']:
-                        self.options.monitoring['vibration'] = False
-                    else:
-                        self.options.monitoring['vibration'] = True
-                    response = "Vibration:%s\n" % self.options.monitoring[
-                        'vibration']
-
-                elif cmd == 'w':
-                    if self.options.monitoring['weather']:
-                        self.options.monitoring['weather'] = False
-                    else:
-                        self.options.monitoring['weather'] = True
-                    response = "WeatherStation:%s\n" % self.options.monitoring[
-                        'weather']
-                elif cmd == 's':
-                    tim = self.detector.sensors.timing
-                    sts = self.detector.sensors.status
-                    loc = self.detector.sensors.location
-                    acl = self.detector.sensors.accelerometer
-                    mag = self.detector.sensors.magnetometer
-                    bmp = self.detector.sensors.barometer
-                    htu = self.detector.sensors.temperature
-                    vib = self.detector.sensors.vibration
-
-                    response = (
-                        "ARDUINO STATUS\n"
-                        "Status........: uptime:%s counter_frequency:%s"
-                        " queue_size:%s missed_events:%s\n"
-                        "HardwareStatus: temp_status:%s baro_status:%s"
-                        " accel_status:%s mag_status:%s gps_status:%s\n"
-                        "Location......: latitude:%s longitude:%s"
-                        " altitude:%s\n"
-                        "Accelerometer.: x:%s y:%s z:%s\n"
-                        "Magnetometer..: x:%s y:%s z:%s\n"
-                        "Barometer.....: temperature:%s pressure:%s"
-                        " altitude:%s\n"
-                        "Humidity......: temperature:%s humidity:%s\n"
-                        "Vibration.....: direction:%s count:%s\n"
-                        "MONITOR STATUS\n"
-                        "usb_handler device....: %s\n"
-                        "Remote........: Ip:%s Port:%s UdpFlag:%s\n"
-                        "Vibration.....: Sent:%d Flag:%s\n"
-                        "WeatherStation: Flag:%s\n"
-                        "Events........: Sent:%d LogFlag:%s\n"
-                    ) % (
-                        tim["uptime"], tim["counter_frequency"],
-                        sts["queue_size"], sts["missed_events"],
-                        sts["temp_status"], sts["baro_status"],
-                        sts["accel_status"], sts["mag_status"],
-                        sts["gps_status"],
-                        loc["latitude"], loc["longitude"], loc["altitude"],
-                        acl["x"], acl["y"], acl["z"],
-                        mag["x"], mag["y"], mag["z"],
-                        bmp["temperature"], bmp["pressure"], bmp["altitude"],
-                        htu["temperature"], htu["humidity"],
-                        vib["direction"], vib["count"],
-                        self.options.usb_handler['device'],
-                        self.options.broker['host'],
-                        self.options.broker['port'],
-                        self.options.broker['enabled'],
-                        self.detector.vbrts,
-                        self.options.monitoring['vibration'],
-                        self.options.monitoring['weather'],
-                        self.detector.events, self.options.logging['enabled'],
-                    )
-                elif cmd == 'u':
-                    if self.usb_handler.enabled:
-                        self.usb_handler.disable()
-                    else:
-                        self.usb_handler.enable()
-                    response = 'usb_handler: {0}'.format(
-                        'enabled' if self.usb_handler.enabled else 'disabled'
-                    )
-
-                elif cmd == 'n':
-                    self.broker = not self.broker
-                    response = 'Send:{0}\n'.format(self.broker)
-
-                elif cmd == 'l':
-                    self.logging = not self.logging
-                    response = 'Log:{0}\n'.format(self.logging)
-
-                elif cmd.startswith('arduino'):
-                    response = str(cmd)
-                    self.usb_handler.write(cmd.upper())
-
+            if cmd == 'd':
+                if self.options.debug:
+                    self.options.debug = False
                 else:
-                    response = ''
+                    self.options.debug = True
+                response = "Debug:%s\n" % self.options.debug
 
-                conn.send(response)
-            except Exception:
-                log.warn('Error processing client command: "{0}"'.format(cmd))
-                conn.send(msg)
+            elif cmd == 'v':
+                if self.options.monitoring['vibration']:
+                    self.options.monitoring['vibration'] = False
+                else:
+                    self.options.monitoring['vibration'] = True
+                response = "Vibration:%s\n" % self.options.monitoring[
+                    'vibration']
 
-        try:
-            os.remove(self.command_socket)
-        except OSError:
-            pass
+            elif cmd == 'w':
+                if self.options.monitoring['weather']:
+                    self.options.monitoring['weather'] = False
+                else:
+                    self.options.monitoring['weather'] = True
+                response = "WeatherStation:%s\n" % self.options.monitoring[
+                    'weather']
+            elif cmd == 's':
+                tim = self.detector.sensors.timing
+                sts = self.detector.sensors.status
+                loc = self.detector.sensors.location
+                acl = self.detector.sensors.accelerometer
+                mag = self.detector.sensors.magnetometer
+                bmp = self.detector.sensors.barometer
+                htu = self.detector.sensors.temperature
+                vib = self.detector.sensors.vibration
+                parser = self.detector.sensors.parser
+
+                response = (
+                    "ARDUINO STATUS\n"
+                    "Status........: uptime:%s counter_frequency:%s"
+                    " queue_size:%s missed_events:%s\n"
+                    "HardwareStatus: temp_status:%s baro_status:%s"
+                    " accel_status:%s mag_status:%s gps_status:%s\n"
+                    "Location......: latitude:%s longitude:%s"
+                    " altitude:%s\n"
+                    "Accelerometer.: x:%s y:%s z:%s\n"
+                    "Magnetometer..: x:%s y:%s z:%s\n"
+                    "Barometer.....: temperature:%s pressure:%s"
+                    " altitude:%s\n"
+                    "Humidity......: temperature:%s humidity:%s\n"
+                    "Vibration.....: direction:%s count:%s\n"
+                    "MONITOR STATUS\n"
+                    "usb_handler device....: %s\n"
+                    "Broker........: connected:%s\n"
+                    "Events........: Sent:%d Spooled:%d\n"
+                    "Parser........: lines:%d malformed:%d\n"
+                    "%s"
+                ) % (
+                    tim.uptime, tim.counter_frequency,
+                    sts.queue_size, sts.missed_events,
+                    sts.temp_status, sts.baro_status,
+                    sts.accel_status, sts.mag_status,
+                    sts.gps_status,
+                    loc.latitude, loc.longitude, loc.altitude,
+                    acl.x, acl.y, acl.z,
+                    mag.x, mag.y, mag.z,
+                    bmp.temperature, bmp.pressure, bmp.altitude,
+                    htu.temperature, htu.humidity,
+                    vib.direction, vib.count,
+                    self.usb_handler.usbdev,
+                    bool(self.detector.publisher and
+                         self.detector.publisher.connected),
+                    self.detector.published.value,
+                    self.detector.spooled.value,
+                    parser.lines, parser.malformed,
+                    ''.join('Sink..........: {0}\n'.format(sink.status())
+                            for sink in self.detector.sinks),
+                )
+
+            elif cmd == 'metrics':
+                response = REGISTRY.render()
+
+            elif cmd == 'u':
+                if self.usb_handler.enabled:
+                    self.usb_handler.disable()
+                else:
+                    self.usb_handler.enable()
+                response = 'usb_handler: {0}'.format(
+                    'enabled' if self.usb_handler.enabled else 'disabled'
+                )
+
+            elif cmd == 'n':
+                self.broker = not self.broker
+                response = 'Send:{0}\n'.format(self.broker)
+
+            elif cmd == 'l':
+                self.logging = not self.logging
+                response = 'Log:{0}\n'.format(self.logging)
+
+            elif cmd == 'detectors':
+                if self.manager is None:
+                    stats = [dict(
+                        device=self.usb_handler.usbdev,
+                        detector_id=self.detector.detector_id,
+                        parser=self.detector.sensors.parser.stats(),
+                    )]
+                else:
+                    stats = self.manager.stats()
+                response = ''.join(
+                    '{0[device]}: {0[detector_id]} {0[parser]}\n'.format(item)
+                    for item in stats
+                )
+
+            elif cmd == 'rates':
+                response = ''.join(
+                    format_rates(detector.detector_id,
+                                 detector.rates.summary())
+                    for detector in self.detectors()
+                    if detector.rates is not None)
+
+            elif cmd.startswith('arduino'):
+                response = str(cmd)
+                self.usb_handler.write(cmd.upper())
+
+            else:
+                response = ''
+
+        except Exception:
+            self.errors.inc()
+            log.warn('Error processing client command: "{0}"'.format(cmd))
+            response = 'Error processing command: {0}\n'.format(cmd)
+
+        return response
+
+
+def format_rates(detector_id, summary):
+    """Return a line describing the rolling rate summary of a detector."""
+    if not summary['duration']:
+        return '{0}: no complete bin yet\n'.format(detector_id)
+    return (
+        '{0}: rate:{1[rate]:.4f}+-{1[rate_error]:.4f} Hz hits:{1[hits]} '
+        'duration:{1[duration]}s pressure:{1[pressure]} '
+        'temperature:{1[temperature]}\n'
+    ).format(detector_id, summary)
@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Local socket server for the commands of the acquisition process.
+
+Clients send requests and receive responses as frames: a 4 byte big endian
+length followed by that many bytes of UTF-8 text. A connection may carry
+any number of requests, answered in order, and responses of any size.
+
+For compatibility with older clients, a connection whose first byte is not
+zero, which a frame header cannot start with, holds a single unframed
+command; its unframed response is followed by the end of the connection.
+
+A ``subscribe`` request turns a framed connection into a stream: after the
+response, messages are pushed to the client as frames holding JSON objects,
+see :mod:`~cosmicpi_daq.subscriptions`.
+"""
+
+from __future__ import absolute_import, print_function
+
+import errno
+import os
+import socket
+import struct
+
+try:
+    import selectors
+except ImportError:  # Python 2
+    import selectors2 as selectors
+
+from .logging import logger as log
+from .metrics import REGISTRY, monotonic
+
+#: Frame header: the length of the frame.
+HEADER = struct.Struct('>I')
+
+#: Largest request accepted, in bytes.
+MAX_REQUEST = 64 * 1024
+
+
+def encode_frame(text):
+    """Return a text as a frame."""
+    data = text.encode('utf-8')
+    return HEADER.pack(len(data)) + data
+
+
+def recv_exactly(sock, size):
+    """Read ``size`` bytes from a blocking socket."""
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            raise EOFError('connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_frame(sock):
+    """Read a frame from a blocking socket and return its text."""
+    size, = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    return recv_exactly(sock, size).decode('utf-8')
+
+
+class RequestReader(object):
+    """Split the data received from a client into commands."""
+
+    def __init__(self):
+        self.inbox = bytearray()
+        #: Whether the client sends a single unframed command, known once
+        #: the first data arrived.
+        self.legacy = None
+
+    def feed(self, data):
+        """Return the commands completed by ``data``.
+
+        Raise ValueError if a request is too large.
+        """
+        if self.legacy is None:
+            self.legacy = data[:1] != b'\0'
+        if self.legacy:
+            # Unframed commands fit in a single read.
+            return [data.decode('utf-8', 'replace')]
+
+        inbox = self.inbox
+        inbox.extend(data)
+        commands = []
+        while len(inbox) >= HEADER.size:
+            size, = HEADER.unpack_from(inbox)
+            if size > MAX_REQUEST:
+                raise ValueError('request of {0} bytes'.format(size))
+            if len(inbox) < HEADER.size + size:
+                break
+            commands.append(inbox[HEADER.size:HEADER.size + size].decode(
+                'utf-8', 'replace'))
+            del inbox[:HEADER.size + size]
+        return commands
+
+    def encode(self, response):
+        """Return a response as it is sent to the client."""
+        if self.legacy:
+            return response.encode('utf-8')
+        return encode_frame(response)
+
+
+class Connection(object):
+    """State of a client connection."""
+
+    __slots__ = ('sock', 'requests', 'outbox', 'closing', 'last_request',
+                 'last_write', 'events', 'subscriber')
+
+    def __init__(self, sock, now):
+        self.sock = sock
+        self.requests = RequestReader()
+        self.outbox = bytearray()
+        self.closing = False
+        self.last_request = now
+        self.last_write = now
+        self.events = selectors.EVENT_READ
+        self.subscriber = None
+
+
+class CommandServer(object):
+    """Serve many clients of a Unix socket from a single thread.
+
+    Sockets are non-blocking and multiplexed with a selector, so a client
+    that is slow to send its request or to read its response does not hold
+    up the others. ``handler`` is called with each command and returns the
+    response text.
+
+    Clients are disconnected once they have been idle, with no request
+    pending, for ``idle_timeout`` seconds, and when a response has made no
+    progress for ``send_timeout`` seconds. Subscribers are never idle, but
+    they are disconnected when ``subscriptions`` drops them.
+    """
+
+    def __init__(self, path, handler, idle_timeout=60, send_timeout=10,
+                 clock=monotonic, subscriptions=None):
+        self.path = path
+        self.handler = handler
+        self.subscriptions = subscriptions
+        self.idle_timeout = idle_timeout
+        self.send_timeout = send_timeout
+        self.clock = clock
+        self.selector = selectors.DefaultSelector()
+        self.connections = {}
+        self.stopping = False
+        self.listener = None
+        self.timeouts = REGISTRY.counter(
+            'cosmicpi_command_timeouts_total',
+            'Command clients disconnected for inactivity.')
+        REGISTRY.callback(
+            'cosmicpi_command_clients', 'Connected command clients.',
+            lambda: len(self.connections))
+
+    def start(self):
+        """Listen on the socket."""
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        self.listener.listen(64)
+        self.listener.setblocking(False)
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.waker, self.wake_up = socket.socketpair()
+        self.waker.setblocking(False)
+        self.wake_up.setblocking(False)
+        self.selector.register(self.waker, selectors.EVENT_READ)
+        log.info('Listening for commands on local socket')
+
+    def wake(self):
+        """Interrupt a wait of :meth:`serve`, from any thread."""
+        try:
+            self.wake_up.send(b'\0')
+        except socket.error:
+            pass
+
+    def stop(self):
+        """Make :meth:`serve` return, from any thread."""
+        self.stopping = True
+        self.wake()
+
+    def serve(self, poll_interval=1.0):
+        """Serve clients until stopped, then close every socket."""
+        try:
+            while not self.stopping:
+                for key, mask in self.selector.select(poll_interval):
+                    if key.fileobj is self.listener:
+                        self.accept()
+                    elif key.fileobj is self.waker:
+                        self.drain_waker()
+                    else:
+                        connection = key.data
+                        if mask & selectors.EVENT_READ:
+                            self.read(connection)
+                        if mask & selectors.EVENT_WRITE and \
+                                connection.sock in self.connections:
+                            self.write(connection)
+                self.stream()
+                self.expire()
+        finally:
+            self.close()
+
+    def accept(self):
+        try:
+            sock, _ = self.listener.accept()
+        except socket.error:
+            return
+        sock.setblocking(False)
+        connection = Connection(sock, self.clock())
+        self.connections[sock] = connection
+        self.selector.register(sock, connection.events, connection)
+
+    def drain_waker(self):
+        try:
+            while self.waker.recv(4096):
+                pass
+        except socket.error:
+            pass
+
+    def read(self, connection):
+        try:
+            data = connection.sock.recv(65536)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = b''
+        if not data:
+            # Pending responses are still sent to half closed connections.
+            connection.closing = True
+            self.write(connection)
+            return
+
+        try:
+            commands = connection.requests.feed(data)
+        except ValueError as e:
+            log.warning('Command client disconnected: %s', e)
+            self.disconnect(connection)
+            return
+        for command in commands:
+            connection.last_request = self.clock()
+            connection.outbox.extend(connection.requests.encode(
+                self.respond(connection, command)))
+        if connection.requests.legacy:
+            connection.closing = True
+        self.write(connection)
+
+    def respond(self, connection, command):
+        """Return the response to a command."""
+        if self.subscriptions is None:
+            return self.handler(command)
+        try:
+            types = self.subscriptions.parse(command)
+        except ValueError as e:
+            return 'Error: {0}\n'.format(e)
+        if types is None:
+            return self.handler(command)
+        if connection.requests.legacy or connection.subscriber is not None:
+            return 'Error: cannot subscribe on this connection\n'
+        connection.subscriber = self.subscriptions.subscribe(
+            types, self.wake)
+        return 'Subscribed to {0}\n'.format(' '.join(types))
+
+    def stream(self):
+        """Send the messages queued for the subscribers."""
+        if self.subscriptions is None:
+            return
+        self.subscriptions.tick()
+        for connection in list(self.connections.values()):
+            subscriber = connection.subscriber
+            if subscriber is None:
+                continue
+            if subscriber.dropped:
+                self.disconnect(connection)
+            elif subscriber.frames and not connection.outbox:
+                self.write(connection)
+
+    def write(self, connection):
+        """Send as much of the pending output as the socket accepts."""
+        outbox = connection.outbox
+        if not outbox and connection.subscriber is not None and \
+                connection.subscriber.frames:
+            outbox.extend(connection.subscriber.pop_all())
+            connection.last_write = self.clock()
+        if outbox:
+            try:
+                sent = connection.sock.send(outbox)
+            except socket.error as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK,
+                                   errno.EINTR):
+                    self.disconnect(connection)
+                    return
+                sent = 0
+            if sent:
+                del outbox[:sent]
+                connection.last_write = self.clock()
+        if not outbox and connection.closing:
+            self.disconnect(connection)
+            return
+
+        events = 0 if connection.closing else selectors.EVENT_READ
+        if outbox:
+            events |= selectors.EVENT_WRITE
+        if events != connection.events:
+            connection.events = events
+            self.selector.modify(connection.sock, events, connection)
+
+    def expire(self):
+        """Disconnect idle and stalled clients."""
+        now = self.clock()
+        for connection in list(self.connections.values()):
+            if connection.outbox:
+                expired = now - connection.last_write > self.send_timeout
+            elif connection.subscriber is not None:
+                expired = False
+            else:
+                expired = now - max(connection.last_request,
+                                    connection.last_write) > \
+                    self.idle_timeout
+            if expired:
+                self.timeouts.inc()
+                self.disconnect(connection)
+
+    def disconnect(self, connection):
+        if connection.subscriber is not None:
+            self.subscriptions.unsubscribe(connection.subscriber)
+        self.connections.pop(connection.sock, None)
+        try:
+            self.selector.unregister(connection.sock)
+        except (KeyError, ValueError):
+            pass
+        connection.sock.close()
+
+    def close(self):
+        """Close every connection and the listening socket."""
+        for connection in list(self.connections.values()):
+            self.disconnect(connection)
+        if self.listener is not None:
+            self.selector.unregister(self.listener)
+            self.listener.close()
+            self.selector.unregister(self.waker)
+            self.waker.close()
+            self.wake_up.close()
+            self.listener = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        self.selector.close()
@@ -43,7 +43,13 @@ def get_default_config():
             port=5162,
             username="guest",
             password="guest",
-            enabled=True
+            enabled=True,
+            batch_size=1,
+            flush_interval_ms=1000,
+            serializer='json',
+            keyframe_interval=100,
+            connections=1,
+            reconnect_max_delay=60
         ),
         monitoring=dict(
             cosmics=True,
@@ -55,12 +61,41 @@ def get_default_config():
                 os.path.realpath(__file__)) + "/logging.conf",
             enabled=True
         ),
+        spool=dict(
+            directory='/var/tmp/cosmicpi-daq/spool',
+            max_size_mb=64,
+            fsync_interval_ms=1000
+        ),
         usb=dict(
-            device='/dev/ttyACM0'
+            devices=['/dev/ttyACM0'],
+            baudrate=9600
+        ),
+        buffer=dict(
+            capacity=1024,
+            overflow='drop-oldest',
+            spill_file='/var/tmp/cosmicpi-daq.spill'
         ),
         commands=dict(
-            socket="/var/run/cosmicpi.sock"
+            socket="/var/run/cosmicpi.sock",
+            subscriber_queue_size=1000
+        ),
+        metrics=dict(
+            port=0
+        ),
+        store=dict(
+            directory=None
+        ),
+        sinks=dict(
+            uris=[],
+            queue_size=1024
+        ),
+        telemetry=dict(
+            filter=False,
+            heartbeat=60,
+            window=10,
+            deadbands={}
         ),
+        engine='threads',
         debug=False
     )
 
@@ -22,117 +22,357 @@
 
 from __future__ import absolute_import
 
-import json
 import threading
 
 import netifaces
 
 from .event import Event
-from .logging import logger as log
+from .logging import event_logger, logger as log
+from .metrics import REGISTRY
+from .parser import LineParser
+from .schema import RECORDS, SENSORS
+from .serializers import JsonSerializer
+from .timing import BoardClock
 
 
 class Sensors(object):
+    """Latest readings of every sensor group.
 
-    def __init__(self):
-        self.temperature = {"temperature": "0.0", "humidity": "0.0"}
-        self.barometer = {
-            "temperature": "0.0",
-            "pressure": "0.0",
-            "altitude": "0.0"}
-        self.vibration = {"direction": "0", "count": "0"}
-        self.magnetometer = {"x": "0.0", "y": "0.0", "z": "0.0"}
-        self.accelerometer = {"x": "0.0", "y": "0.0", "z": "0.0"}
-        self.location = {
-            "latitude": "0.0",
-            "longitude": "0.0",
-            "altitude": "0.0"}
-        self.timing = {
-            "uptime": "0",
-            "counter_frequency": "0",
-            "time_string": "0"}
-        self.status = {
-            "queue_size": "0",
-            "missed_events": "0",
-            "buffer_error": "0",
-            "temp_status": "0",
-            "baro_status": "0",
-            "accel_status": "0",
-            "mag_status": "0",
-            "gps_status": "0"}
+    Each group holds an immutable record which is replaced, never modified,
+    when a new reading arrives. ``event`` holds the cosmic hit described by
+    the last line, or None if that line was not an event.
+    """
 
-    def update(self, line):
-        line = line.replace('\n', '')
-        line = line.replace('\'', '"')
+    __slots__ = tuple(SENSORS) + ('event', 'parser')
 
-        try:
-            sensor = json.loads(line)
-        except:
-            return  # Didn't understand, throw it away
+    def __init__(self):
+        for group, record in RECORDS.items():
+            setattr(self, group, record())
+        self.event = None
+        self.parser = LineParser(self)
 
-        self.__dict__.update(sensor)
-        return sensor
+    def update(self, line):
+        """Update the readings from a line and return the group name."""
+        return self.parser.parse(line)
 
 
 class Detector(object):
 
-    def __init__(self, usb_handler, publisher, debug, events=None):
+    #: Maximum number of spooled events replayed per loop iteration.
+    replay_chunk = 1000
+
+    def __init__(self, usb_handler, publisher, debug, events=None,
+                 buffer=None, spool=None, serializer=None, detector_id=None,
+                 coincidence=None, profiler=None, sinks=(), store=None,
+                 rates=None, telemetry=None, subscriptions=None):
         self.events = set(events or ('vibration', 'temperature', 'event'))
         self.usb_handler = usb_handler
+        self.buffer = buffer
         self.publisher = publisher
+        self.spool = spool
+        self.serializer = serializer or JsonSerializer()
+        self.coincidence = coincidence
+        self.sinks = list(sinks)
+        self.store = store
+        self.rates = rates
+        self.telemetry = telemetry
+        self.subscriptions = subscriptions
         self.debug = debug
 
         self.sensors = Sensors()
+        self.clock = BoardClock()
 
-        self.detector_id = self.get_detector_id()
+        self.detector_id = detector_id or self.get_detector_id()
+        self.register_metrics()
+
+        self.parse = self.sensors.update
+        self.serialize = self.serializer.dumps
+        if profiler is not None:
+            self.profile(profiler)
 
         self.stopping = False
 
+    def register_metrics(self):
+        """Create the metrics of this detector."""
+        labels = dict(detector=self.detector_id)
+        parser = self.sensors.parser
+        sensors = self.sensors
+        self.events_total = REGISTRY.counter(
+            'cosmicpi_events_total',
+            'Sensor readings and hits decoded.', **labels)
+        self.published = REGISTRY.counter(
+            'cosmicpi_events_published_total',
+            'Events handed to the publisher.', **labels)
+        self.spooled = REGISTRY.counter(
+            'cosmicpi_events_spooled_total',
+            'Events written to the spool.', **labels)
+        self.line_errors = REGISTRY.counter(
+            'cosmicpi_line_errors_total',
+            'Lines whose processing failed unexpectedly.', **labels)
+        REGISTRY.callback(
+            'cosmicpi_parse_failures_total', 'Lines that could not be parsed.',
+            lambda: parser.malformed, type='counter', **labels)
+        REGISTRY.callback(
+            'cosmicpi_arduino_missed_events',
+            'Events the Arduino reports as missed.',
+            lambda: sensors.status.missed_events, **labels)
+        REGISTRY.callback(
+            'cosmicpi_arduino_queue_size',
+            'Events queued on the Arduino.',
+            lambda: sensors.status.queue_size, **labels)
+        clock = self.clock
+        REGISTRY.callback(
+            'cosmicpi_clock_synchronised',
+            'Whether events are stamped from the GPS.',
+            lambda: int(clock.synchronised), **labels)
+        REGISTRY.callback(
+            'cosmicpi_clock_frequency_hertz',
+            'Estimated frequency of the board counter.',
+            lambda: clock.frequency, **labels)
+        REGISTRY.callback(
+            'cosmicpi_clock_jitter_seconds',
+            'Standard deviation of the counter over a PPS second.',
+            lambda: clock.jitter_ns / 1e9, **labels)
+        REGISTRY.callback(
+            'cosmicpi_clock_host_offset_seconds',
+            'Host clock minus GPS time when the last PPS was received.',
+            lambda: clock.offset, **labels)
+        REGISTRY.callback(
+            'cosmicpi_clock_missed_pulses_total',
+            'PPS pulses without timing reading.',
+            lambda: clock.missed_pulses, type='counter', **labels)
+        REGISTRY.callback(
+            'cosmicpi_clock_rejected_total',
+            'Counter frequency measurements rejected as outliers.',
+            lambda: clock.rejected, type='counter', **labels)
+        if self.buffer is not None:
+            buffer = self.buffer
+            REGISTRY.callback(
+                'cosmicpi_buffer_depth', 'Serial lines waiting in the buffer.',
+                lambda: len(buffer), **labels)
+            REGISTRY.callback(
+                'cosmicpi_buffer_dropped_total',
+                'Serial lines dropped by the buffer.',
+                lambda: buffer.dropped, type='counter', **labels)
+        if self.spool is not None:
+            spool = self.spool
+            REGISTRY.callback(
+                'cosmicpi_spool_depth', 'Events waiting in the spool.',
+                lambda: len(spool), **labels)
+            REGISTRY.callback(
+                'cosmicpi_spool_dropped_total',
+                'Events discarded from a full spool.',
+                lambda: spool.dropped, type='counter', **labels)
+        if self.rates is not None:
+            rates = self.rates
+            REGISTRY.callback(
+                'cosmicpi_hit_rate_hertz', 'Rolling rate of cosmic hits.',
+                lambda: rates.summary()['rate'] or 0, **labels)
+        if self.telemetry is not None:
+            telemetry = self.telemetry
+            REGISTRY.callback(
+                'cosmicpi_telemetry_suppressed_total',
+                'Unchanged sensor readings not published.',
+                lambda: telemetry.suppressed, type='counter', **labels)
+            REGISTRY.callback(
+                'cosmicpi_telemetry_aggregated_total',
+                'Sensor readings published as part of a window.',
+                lambda: telemetry.aggregated_readings, type='counter',
+                **labels)
+
+    def profile(self, profiler):
+        """Time each stage of the processing of a line with ``profiler``.
+
+        The stages are replaced by timed versions on this instance only, so
+        a detector that is not profiled runs exactly the same code as before.
+        """
+        labels = dict(detector=self.detector_id)
+        self.handle_line = profiler.wrap(
+            'line', self.handle_line, root=True, **labels)
+        for stage, attribute in (('parse', 'parse'),
+                                 ('event', 'make_event'),
+                                 ('log', 'log_event'),
+                                 ('serialize', 'serialize'),
+                                 ('publish', 'publish')):
+            setattr(self, attribute, profiler.wrap(
+                stage, getattr(self, attribute), **labels))
+
     @property
     def event(self):
         """Return new Event instance with current data."""
-        return Event(self.detector_id, self.sensors)
+        return self.make_event()
+
+    def make_event(self):
+        """Return a new Event holding the current readings."""
+        timestamp, gps = self.clock.stamp(self.sensors)
+        return Event(self.detector_id, self.sensors, timestamp, gps)
 
     def __call__(self):
         """Handle incoming events."""
         while not self.stopping:
-            line = self.usb_handler.readline()
-            self.publisher.connection.process_data_events()
+            line = self.readline()
+            self.service_publisher()
+            if line:
+                self.handle_line(line)
+
+    def handle_line(self, line):
+        """Process a line and publish the event it produced, if any.
 
-            sensor = self.sensors.update(line)
-            if not sensor:
-                continue
+        Failures are logged and the line is skipped, so that a single bad
+        line cannot stop the acquisition.
+        """
+        try:
+            data = self.process_line(line)
+            if data is not None:
+                self.publish(data)
+        except Exception:
+            self.line_errors.inc()
+            log.exception('Failed to process line: %r', line)
 
-            event = self.event
-            log.info('Event: {0}'.format(event))
+    def process_line(self, line):
+        """Parse a line and return the encoded event it produced, if any."""
+        sensor = self.parse(line)
+        if not sensor:
+            return None
 
-            # Check if we should handle the event.
-            # if set(event.keys()) & self.events:
-            self.handle_event(evt)
+        self.events_total.inc()
+        event = self.make_event()
+        self.log_event(event)
+        if self.coincidence is not None:
+            self.coincidence.add(event)
+        if self.store is not None:
+            self.store.append(event)
+        if self.rates is not None:
+            self.rates.add(event)
+        if self.subscriptions is not None:
+            self.subscriptions.publish(sensor, event)
+        if self.telemetry is not None:
+            event = self.telemetry.filter(sensor, event)
+            if event is None:
+                return None
 
-            if self.debug:
-                log.debug(sensor)
+        # Check if we should handle the event.
+        # if set(event.keys()) & self.events:
+        data = self.serialize(event)
+
+        if self.debug:
+            log.debug(sensor)
+            log.debug(data)
+        return data
+
+    def status(self):
+        """Return the acquisition status as a dictionary."""
+        status = self.sensors.status
+        summary = self.rates.summary() if self.rates is not None else None
+        return dict(
+            usb=bool(getattr(self.usb_handler, 'is_open', True)),
+            broker=bool(self.publisher and self.publisher.connected),
+            gps=self.clock.synchronised,
+            published=self.published.value,
+            spooled=self.spooled.value,
+            lines=self.sensors.parser.lines,
+            malformed=self.sensors.parser.malformed,
+            queue_size=status.queue_size,
+            missed_events=status.missed_events,
+            rate=summary['rate'] if summary and summary['duration']
+            else None,
+        )
+
+    def log_event(self, event):
+        """Log a decoded event."""
+        event_logger.info('Event: %s', event)
+
+    def readline(self):
+        """Return the next line from the buffer or the USB handler.
+
+        Reading from the buffer times out regularly so that pending batches
+        are flushed even when no data arrives.
+        """
+        if self.buffer is not None:
+            return self.buffer.get(timeout=1)
+        return self.usb_handler.readline()
 
     def stop(self):
         log.info("Stopping detector thread")
         self.stopping = True
 
     def handle_event(self, event):
-        data = event.to_json()
-        if self.publisher:
-            self.publisher.send_event_pkt(data)
+        data = self.serialize(event)
+        self.publish(data)
         if self.debug:
             log.debug(data)
 
+    def publish(self, data):
+        """Publish an event, spooling it if the broker is unavailable.
+
+        Once something has been spooled, new events are spooled as well until
+        the backlog has been replayed so that ordering is preserved. An event
+        that fails to publish is kept by the publisher, which is then
+        disconnected to be reconnected by :meth:`service_publisher`.
+
+        The event is also queued for every additional sink.
+        """
+        for sink in self.sinks:
+            sink.put(data)
+
+        if not self.publisher:
+            return
+
+        if self.spool is not None and \
+                (len(self.spool) or not self.publisher.connected):
+            self.spool.append(data)
+            self.spooled.inc()
+            return
+
+        try:
+            self.publisher.send_event_pkt(data)
+            self.published.inc()
+        except Exception as e:
+            log.warning("Error publishing event: %s" % e)
+            self.publisher.disconnect()
+
+    def service_publisher(self):
+        """Keep the broker connection alive and replay spooled events."""
+        if not self.publisher or not self.publisher.service():
+            return
+
+        try:
+            self.replay_spool()
+        except Exception as e:
+            log.warning("Error publishing event: %s" % e)
+            self.publisher.disconnect()
+
+    def replay_spool(self):
+        """Publish a chunk of spooled events in order.
+
+        Events are removed from the spool before being sent, as the publisher
+        keeps those it fails to send.
+        """
+        if self.spool is None:
+            return
+
+        for _ in range(min(len(self.spool), self.replay_chunk)):
+            self.publisher.send_event_pkt(self.spool.pop())
+            self.published.inc()
+
     def get_detector_id(self):
         """Retrieve the unique identifier of this detector.
 
-        Currently the MAC address of the first known network interface is used.
+        Unless given explicitly, the identifier of the host is used.
         """
-        known_interfaces = ['eth0', 'wlan0', 'en1']
+        return get_host_id()
+
+
+def get_host_id():
+    """Retrieve the unique identifier of this host.
+
+    Currently the MAC address of the first known network interface is used.
+    """
+    known_interfaces = ['eth0', 'wlan0', 'en1']
 
-        for interface in known_interfaces:
-            if interface in netifaces.interfaces():
-                return netifaces.ifaddresses(
-                    interface)[netifaces.AF_LINK][0]['addr']
+    for interface in known_interfaces:
+        if interface in netifaces.interfaces():
+            return netifaces.ifaddresses(
+                interface)[netifaces.AF_LINK][0]['addr']
 
-        raise Exception("No detector ID could be determined")
+    raise Exception("No detector ID could be determined")
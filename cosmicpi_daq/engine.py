@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Acquisition engine running on a single asyncio event loop.
+
+This is an alternative to the default threaded engine: serial input, event
+publishing, the command socket and periodic status reports all run as tasks
+of one event loop. It requires Python 3.
+"""
+
+from __future__ import absolute_import, print_function
+
+import asyncio
+import os
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+from .command_server import RequestReader
+from .logging import logger as log
+from .metrics import REGISTRY
+
+
+class AsyncEngine(object):
+    """Run a detector, its USB handler and a command handler on one loop.
+
+    Serial data is read through a non-blocking file descriptor reader.
+    Encoded events go through a bounded queue to a single publisher task;
+    as the AMQP client is blocking, that task hands each publish to one
+    worker thread so the loop is never stalled by the broker. When the queue
+    is full the oldest event is dropped.
+    """
+
+    def __init__(self, usb_handler, detector, command_handler,
+                 queue_size=1024, status_interval=60, command_idle_timeout=60,
+                 command_send_timeout=10):
+        self.usb_handler = usb_handler
+        self.detector = detector
+        self.command_handler = command_handler
+        self.queue_size = queue_size
+        self.status_interval = status_interval
+        self.command_idle_timeout = command_idle_timeout
+        self.command_send_timeout = command_send_timeout
+        self.pending = bytearray()
+        self.dropped = 0
+
+    def run(self):
+        """Run the engine until SIGINT or SIGTERM is received."""
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.main())
+        finally:
+            loop.close()
+
+    async def main(self):
+        loop = asyncio.get_event_loop()
+        self.queue = asyncio.Queue(self.queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        labels = dict(detector=self.detector.detector_id)
+        REGISTRY.callback(
+            'cosmicpi_buffer_depth', 'Serial lines waiting in the buffer.',
+            self.queue.qsize, **labels)
+        REGISTRY.callback(
+            'cosmicpi_buffer_dropped_total',
+            'Serial lines dropped by the buffer.',
+            lambda: self.dropped, type='counter', **labels)
+
+        stopping = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopping.set)
+
+        server = await self.start_command_server()
+        tasks = [
+            loop.create_task(self.read_serial()),
+            loop.create_task(self.publish_events()),
+            loop.create_task(self.report_status()),
+        ]
+        log.info('Asyncio engine started')
+
+        try:
+            await stopping.wait()
+        finally:
+            log.info('Stopping asyncio engine')
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            server.close()
+            await server.wait_closed()
+            try:
+                os.remove(self.command_handler.command_socket)
+            except OSError:
+                pass
+            await self.drain_queue()
+            self.executor.shutdown(wait=True)
+
+    async def read_serial(self):
+        """Read from the serial port, reopening it when it goes away."""
+        loop = asyncio.get_event_loop()
+        while True:
+            if not self.usb_handler.enabled:
+                await asyncio.sleep(1)
+                continue
+
+            if not self.usb_handler.reconnect(wait=False):
+                await asyncio.sleep(self.usb_handler.poll_interval)
+                continue
+
+            closed = loop.create_future()
+            fd = self.usb_handler.fileno()
+            loop.add_reader(fd, self.on_readable, closed)
+            try:
+                await closed
+            finally:
+                loop.remove_reader(fd)
+            self.usb_handler.lost()
+            self.pending = bytearray()
+
+    def on_readable(self, closed):
+        try:
+            data = self.usb_handler.read_available()
+        except Exception as e:
+            log.warning("Error reading from serial port: %s" % e)
+            data = None
+        if not data:
+            if not closed.done():
+                closed.set_result(None)
+            return
+
+        self.pending.extend(data)
+        start = 0
+        while True:
+            end = self.pending.find(b'\n', start)
+            if end < 0:
+                break
+            self.handle_line(bytes(self.pending[start:end + 1]))
+            start = end + 1
+        del self.pending[:start]
+
+    def handle_line(self, line):
+        try:
+            data = self.detector.process_line(line)
+        except Exception:
+            self.detector.line_errors.inc()
+            log.exception('Failed to process line: %r', line)
+            return
+        if data is None:
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(data)
+
+    async def publish_events(self):
+        """Publish queued events and keep the broker connection alive."""
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                data = await asyncio.wait_for(self.queue.get(), 1)
+            except asyncio.TimeoutError:
+                data = None
+            await loop.run_in_executor(
+                self.executor, self.detector.service_publisher)
+            if data is not None:
+                await loop.run_in_executor(
+                    self.executor, self.detector.publish, data)
+
+    async def drain_queue(self):
+        loop = asyncio.get_event_loop()
+        while not self.queue.empty():
+            await loop.run_in_executor(
+                self.executor, self.detector.publish, self.queue.get_nowait())
+
+    async def start_command_server(self):
+        path = self.command_handler.command_socket
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        server = await asyncio.start_unix_server(
+            self.handle_client, path=path)
+        log.info('Listening for commands on local socket')
+        return server
+
+    async def handle_client(self, reader, writer):
+        """Answer the requests of a command client.
+
+        The protocol and timeouts are those of
+        :class:`~cosmicpi_daq.command_server.CommandServer`.
+        """
+        requests = RequestReader()
+        try:
+            while True:
+                data = await asyncio.wait_for(
+                    reader.read(65536), self.command_idle_timeout)
+                if not data:
+                    break
+                for command in requests.feed(data):
+                    response, types = self.respond(command, requests)
+                    writer.write(requests.encode(response))
+                    await asyncio.wait_for(
+                        writer.drain(), self.command_send_timeout)
+                    if types is not None:
+                        await self.stream(reader, writer, types)
+                        return
+                if requests.legacy:
+                    break
+        except asyncio.TimeoutError:
+            log.debug('Command client timed out')
+        except (ValueError, ConnectionError) as e:
+            log.warning('Command client disconnected: %s', e)
+        finally:
+            writer.close()
+
+    def respond(self, command, requests):
+        """Return the response to a command and the message types it
+        subscribes to, if it is a ``subscribe`` command."""
+        subscriptions = self.command_handler.subscriptions
+        if subscriptions is None:
+            return self.command_handler.handle_command(command), None
+        try:
+            types = subscriptions.parse(command)
+        except ValueError as e:
+            return 'Error: {0}\n'.format(e), None
+        if types is None:
+            return self.command_handler.handle_command(command), None
+        if requests.legacy:
+            return 'Error: cannot subscribe on this connection\n', None
+        return 'Subscribed to {0}\n'.format(' '.join(types)), types
+
+    async def stream(self, reader, writer, types):
+        """Push the messages of a subscription until the client leaves or
+        is dropped."""
+        loop = asyncio.get_event_loop()
+        ready = asyncio.Event()
+        subscriptions = self.command_handler.subscriptions
+        subscriber = subscriptions.subscribe(
+            types, lambda: loop.call_soon_threadsafe(ready.set))
+        closed = asyncio.ensure_future(reader.read())
+        try:
+            while not subscriber.dropped and not closed.done():
+                try:
+                    await asyncio.wait_for(
+                        ready.wait(), subscriptions.status_interval)
+                except asyncio.TimeoutError:
+                    pass
+                ready.clear()
+                subscriptions.tick()
+                data = subscriber.pop_all()
+                if data:
+                    writer.write(data)
+                    await asyncio.wait_for(
+                        writer.drain(), self.command_send_timeout)
+        finally:
+            closed.cancel()
+            subscriptions.unsubscribe(subscriber)
+
+    async def report_status(self):
+        """Periodically log the engine counters."""
+        while True:
+            await asyncio.sleep(self.status_interval)
+            log.info('Engine status: queued:{0} dropped:{1} parser:{2}'.format(
+                self.queue.qsize(), self.dropped,
+                self.detector.sensors.parser.stats()))
@@ -23,16 +23,46 @@
 import json
 import time
 
+from .schema import SENSORS
+from .timing import format_date
+
 
 class Event(object):
-    """Wrapper around a cosmic event."""
+    """Wrapper around a cosmic event.
+
+    An event is an immutable snapshot of the sensor records. Records are
+    never modified once created, so consecutive events share every record
+    that did not change in between. ``aggregates`` holds the statistics of
+    the groups summarised over a window, if any.
+
+    ``timestamp_ns`` is the UTC time of the event in nanoseconds, from the
+    GPS if ``gps`` is true, otherwise from the host clock.
+    """
+
+    __slots__ = ('detector_id', 'timestamp_ns', 'gps', 'event',
+                 'aggregates') + tuple(SENSORS)
 
-    def __init__(self, detector_id, sensors):
+    def __init__(self, detector_id, sensors, timestamp_ns=None, gps=False):
         """Combine sensor data with information about a detector."""
         self.detector_id = detector_id
-        self.date = {"date": time.asctime(time.gmtime(time.time()))}
-        self.event = None
-        self.__dict__.update(sensors.__dict__)
+        if timestamp_ns is None:
+            timestamp_ns = int(time.time() * 1e9)
+        self.timestamp_ns = timestamp_ns
+        self.gps = gps
+        self.event = sensors.event
+        self.aggregates = None
+        for group in SENSORS:
+            setattr(self, group, getattr(sensors, group))
+
+    @property
+    def date(self):
+        """Return the date of the event in ``asctime`` format."""
+        return {"date": format_date(self.timestamp_ns)}
+
+    @property
+    def sequence(self):
+        """Return the sequence number of the cosmic hit, if any."""
+        return self.event.sequence if self.event is not None else None
 
     def __str__(self):
         """Return a string representation."""
@@ -45,16 +75,29 @@ class Event(object):
         Location......: {0.location}
         Vibration.....: {0.vibration}
         Accelerometer.: {0.accelerometer}
-        Magnetometer..: {0.megnetometer}
+        Magnetometer..: {0.magnetometer}
         Timing........: {0.timing}
         Status........: {0.status}
         Event.........: {0.event}
         """.format(self)
 
+    def to_dict(self):
+        """Return the event as nested dictionaries."""
+        data = dict(
+            (group, dict(getattr(self, group)._asdict())) for group in SENSORS)
+        data['detector_id'] = self.detector_id
+        data['date'] = self.date
+        data['timestamp_ns'] = self.timestamp_ns
+        data['gps'] = self.gps
+        data['event'] = dict(self.event._asdict()) if self.event else None
+        if self.aggregates:
+            data['aggregates'] = self.aggregates
+        return data
+
     def to_json(self, pretty=False):
         """Convert event to a JSON representation."""
         if pretty:
-            return json.dumps(self.__dict__, sort_keys=True,
+            return json.dumps(self.to_dict(), sort_keys=True,
                               indent=4, separators=(',', ': '))
         else:
-            return json.dumps(self.__dict__)
+            return json.dumps(self.to_dict())
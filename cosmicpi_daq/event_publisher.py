@@ -20,32 +20,344 @@
 
 """Publish event via AMQP."""
 
-import json
+import random
+import threading
+import time
+from collections import deque
 
 import pika
 
+from .logging import logger as log
+from .metrics import REGISTRY, monotonic
+from .serializers import JsonSerializer
+
+
+#: Outage duration histogram buckets, in seconds.
+OUTAGE_BUCKETS = (1, 5, 10, 30, 60, 300, 900, 3600, 4 * 3600, 24 * 3600)
+
+
+class Backoff(object):
+    """Exponentially growing delays between attempts, with random jitter.
+
+    The n-th delay is ``initial * factor ** n`` capped at ``maximum``, then
+    reduced by a random fraction of up to ``jitter`` so that many clients
+    losing the same broker do not all retry at once.
+    """
+
+    def __init__(self, initial=1.0, maximum=60.0, factor=2.0, jitter=0.5):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.attempts = 0
+
+    def next(self):
+        """Return the delay before the next attempt."""
+        delay = min(self.maximum, self.initial * self.factor ** self.attempts)
+        self.attempts += 1
+        return delay * (1 - self.jitter * random.random())
+
+    def reset(self):
+        self.attempts = 0
+
 
 class EventPublisher(object):
-    """Publish events."""
+    """Publish events.
+
+    Events are published already encoded by ``serializer``, whose content
+    type is declared on every message. By default every event is published
+    as its own message. When ``batch_size`` is greater than one, events are
+    accumulated and published as a single message (see the serializer's
+    ``dumps_batch``) once the batch is full or ``flush_interval_ms`` has
+    elapsed since its first event. Batches are sent on a channel in
+    confirm mode, so the broker acknowledges each batch with a single round
+    trip instead of one per event.
+
+    A publisher can be shared by several detectors: all operations on the
+    connection are serialised by a lock.
+
+    A lost connection or channel is reopened by :meth:`service`, with delays
+    between failed attempts given by ``backoff``. Events that could not be
+    published are kept, up to ``backlog_size`` of them, and sent first once
+    reconnected; beyond that the oldest are discarded and counted in
+    ``backlog_dropped``.
 
-    def __init__(self, broker):
+    Metrics are labelled with ``connection_id``, or with ``labels`` if
+    given, which must tell the publisher apart from the others.
+    """
+
+    def __init__(self, broker, batch_size=1, flush_interval_ms=1000,
+                 connect=True, serializer=None, backoff=None,
+                 backlog_size=1000, connection_id=0, labels=None):
         """Create new connection and channel."""
-        self.connection = pika.BlockingConnection(
-            pika.URLParameters(broker)
-        )
-        self.channel = self.connection.channel()
-        self.channel.exchange_declare(exchange='events', type='fanout')
+        self.broker = broker
+        self.serializer = serializer or JsonSerializer()
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.batch = []
+        self.batch_started = None
+        self.backlog = deque(maxlen=backlog_size)
+        self.backlog_dropped = 0
+        self.connection = None
+        self.channel = None
+        self.lock = threading.RLock()
+        self.backoff = backoff or Backoff()
+        self.next_attempt = 0
+        self.outage_started = None
+
+        labels = labels or dict(connection=connection_id)
+        self.messages = REGISTRY.counter(
+            'cosmicpi_publisher_messages_total', 'AMQP messages published.',
+            **labels)
+        self.latency = REGISTRY.histogram(
+            'cosmicpi_publisher_latency_seconds',
+            'Time taken to publish a message, including the confirmation.',
+            **labels)
+        self.connects = REGISTRY.counter(
+            'cosmicpi_publisher_connects_total',
+            'Connections opened to the broker.', **labels)
+        self.connect_failures = REGISTRY.counter(
+            'cosmicpi_publisher_connect_failures_total',
+            'Failed attempts to connect to the broker.', **labels)
+        self.disconnects = REGISTRY.counter(
+            'cosmicpi_publisher_disconnects_total',
+            'Connections dropped after an error.', **labels)
+        self.reconnects = REGISTRY.counter(
+            'cosmicpi_publisher_reconnects_total',
+            'Connections reopened after an outage.', **labels)
+        self.outages = REGISTRY.histogram(
+            'cosmicpi_publisher_outage_seconds',
+            'Time between losing and regaining the broker connection.',
+            buckets=OUTAGE_BUCKETS, **labels)
+        REGISTRY.callback(
+            'cosmicpi_publisher_connected', '1 if connected to the broker.',
+            lambda: int(self.connected), **labels)
+        REGISTRY.callback(
+            'cosmicpi_publisher_batch_depth', 'Events waiting in the batch.',
+            lambda: len(self.batch), **labels)
+        REGISTRY.callback(
+            'cosmicpi_publisher_backlog_depth',
+            'Events waiting to be published again.',
+            lambda: len(self.backlog), **labels)
+        REGISTRY.callback(
+            'cosmicpi_publisher_backlog_dropped_total',
+            'Events discarded from a full backlog.',
+            lambda: self.backlog_dropped, type='counter', **labels)
+
+        if connect:
+            self.connect()
+
+    def connect(self):
+        """Open the AMQP connection and declare the events exchange."""
+        with self.lock:
+            if self.connected:
+                return
+            self.connection = self.open_connection()
+            self.channel = self.connection.channel()
+            self.channel.exchange_declare(exchange='events', type='fanout')
+            if self.batching:
+                self.channel.confirm_delivery()
+            self.connects.inc()
+
+    def open_connection(self):
+        """Return a new connection to the broker."""
+        return pika.BlockingConnection(pika.URLParameters(self.broker))
+
+    def reconnect(self):
+        """Connect unless the backoff delay has not elapsed yet.
+
+        Return True if connected.
+        """
+        with self.lock:
+            if self.connected:
+                return True
+            now = monotonic()
+            if now < self.next_attempt:
+                return False
+
+            try:
+                self.connect()
+            except Exception as e:
+                self.connect_failures.inc()
+                self.next_attempt = now + self.backoff.next()
+                if self.outage_started is None:
+                    self.outage_started = now
+                log.warning("Couldn't connect to broker: %r" % e)
+                return False
+
+            self.backoff.reset()
+            if self.outage_started is not None:
+                outage = monotonic() - self.outage_started
+                self.outage_started = None
+                self.reconnects.inc()
+                self.outages.observe(outage)
+                log.info('Reconnected to broker after {0:.1f}s'.format(
+                    outage))
+            return True
+
+    def disconnect(self):
+        """Drop the current connection, e.g. after a publishing error."""
+        with self.lock:
+            if self.connection is None:
+                return
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+            self.channel = None
+            self.disconnects.inc()
+            if self.outage_started is None:
+                self.outage_started = monotonic()
+
+    @property
+    def connected(self):
+        """Return True if the AMQP connection and channel are open."""
+        return self.connection is not None and self.connection.is_open and \
+            self.channel.is_open
+
+    @property
+    def batching(self):
+        """Return True if events are published in batches."""
+        return self.batch_size > 1
 
     def send_event_pkt(self, pkt):
-        """Publish an event."""
-        properties = pika.BasicProperties(content_type='application/json')
-        self.channel.basic_publish(
+        """Publish an encoded event, or queue it if batching is enabled.
+
+        If publishing fails, the event is kept to be sent again and the
+        error is raised.
+        """
+        with self.lock:
+            if not self.batching:
+                if len(self.backlog) == self.backlog.maxlen:
+                    if not self.backlog_dropped:
+                        log.warning('Publisher backlog full, dropping the '
+                                    'oldest events')
+                    self.backlog_dropped += 1
+                self.backlog.append(pkt)
+                self.flush_backlog()
+                return
+
+            if not self.batch:
+                self.batch_started = time.time()
+            self.batch.append(pkt)
+
+            if len(self.batch) >= self.batch_size or self.batch_expired():
+                self.flush()
+
+    def batch_expired(self):
+        """Return True if the pending batch is older than the interval."""
+        return bool(self.batch) and \
+            time.time() - self.batch_started >= self.flush_interval
+
+    def flush(self):
+        """Publish all pending events as one confirmed message.
+
+        If the broker rejects the batch, the events are put back in front of
+        the pending batch so that they are retried on the next flush.
+        """
+        with self.lock:
+            if not self.batch:
+                return
+
+            batch, self.batch = self.batch, []
+            try:
+                self.publish(self.serializer.dumps_batch(batch),
+                             headers={'batch_size': len(batch)})
+            except Exception:
+                self.batch = batch + self.batch
+                raise
+
+    def flush_backlog(self):
+        """Publish the events kept after an error, oldest first."""
+        with self.lock:
+            while self.backlog:
+                self.publish(self.backlog[0])
+                self.backlog.popleft()
+
+    def publish(self, body, headers=None):
+        """Publish a message body to the events exchange.
+
+        Raise IOError if the broker does not confirm the message: on a
+        channel in confirm mode, ``basic_publish`` returns False when the
+        message is nacked or returned.
+        """
+        properties = pika.BasicProperties(
+            content_type=self.serializer.content_type, headers=headers)
+        started = monotonic()
+        confirmed = self.channel.basic_publish(
             exchange='events',
             routing_key='',
-            body=json.dumps(pkt),
+            body=body,
             properties=properties,
         )
+        if confirmed is False:
+            raise IOError('message rejected by the broker')
+        self.latency.observe(monotonic() - started)
+        self.messages.inc()
+
+    def process_data_events(self):
+        """Flush an expired batch and service the AMQP connection."""
+        with self.lock:
+            self.flush_backlog()
+            if self.batch_expired():
+                self.flush()
+            self.connection.process_data_events()
+
+    def service(self):
+        """Reconnect if needed and service the connection.
+
+        Return True if the connection is usable.
+        """
+        with self.lock:
+            if not self.reconnect():
+                return False
+            try:
+                self.process_data_events()
+            except Exception as e:
+                log.warning('Lost connection to broker: %s' % e)
+                self.disconnect()
+                return False
+            return True
+
+    def close(self):
+        """Flush pending events and close AMQP connection."""
+        with self.lock:
+            if not self.connected:
+                return
+            try:
+                self.flush()
+            finally:
+                self.connection.close()
+
+
+class PublisherPool(object):
+    """Share a few broker connections between many producers.
+
+    ``factory`` is called with a connection ID and must return a new
+    :class:`EventPublisher`. Each call to :meth:`get` returns the next of
+    ``size`` publishers in turn, so that producers on different threads do
+    not all contend for the same connection lock.
+    """
+
+    def __init__(self, factory, size=1):
+        self.factory = factory
+        self.size = max(1, size)
+        self.publishers = []
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        """Return the publisher for a new producer."""
+        with self.lock:
+            index = self.count % self.size
+            self.count += 1
+            if index == len(self.publishers):
+                self.publishers.append(self.factory(index))
+            return self.publishers[index]
 
     def close(self):
-        """Close AMQP connection."""
-        self.connection.close()
+        """Close every publisher."""
+        with self.lock:
+            for publisher in self.publishers:
+                publisher.close()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Logging handlers and filters that keep logging off the hot path.
+
+Messages should be logged with arguments rather than formatted beforehand,
+e.g. ``log.info('Event: %s', event)``: the message is then only formatted if
+the record is emitted, and with :class:`AsyncHandler` that happens on a
+background thread. Arguments must therefore not be modified after being
+logged, which holds for events as they are immutable.
+"""
+
+from __future__ import absolute_import, print_function
+
+import logging
+import sys
+import threading
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+from .logging import event_logger, logger
+from .metrics import REGISTRY, monotonic
+
+#: Format of console messages, as in ``logging.conf``.
+CONSOLE_FORMAT = \
+    '[%(asctime)s] %(levelname)8s [%(filename)-25s %(lineno)4s] %(message)s'
+
+
+class AsyncHandler(logging.Handler):
+    """Hand records to another handler on a background thread.
+
+    Records are queued unformatted. When more than ``capacity`` records are
+    waiting, new records are dropped and counted in ``dropped`` rather than
+    blocking the caller.
+    """
+
+    #: Seconds to wait for pending records when closing.
+    close_timeout = 5
+
+    def __init__(self, handler, capacity=10000):
+        logging.Handler.__init__(self)
+        self.handler = handler
+        self.queue = queue.Queue(capacity)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, name='log-writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        """Emit queued records until closed."""
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            self.handler.handle(record)
+
+    def close(self):
+        """Emit the pending records and close the wrapped handler."""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(self.close_timeout)
+        self.handler.close()
+        logging.Handler.close(self)
+
+
+class EventLogFilter(logging.Filter):
+    """Sample and rate-limit records.
+
+    Only one record out of ``sample_every`` is considered, and of those at
+    most ``rate`` per second pass, with bursts of up to ``burst`` records. A
+    ``rate`` of 0 disables the rate limit. Rejected records are counted in
+    ``suppressed``.
+    """
+
+    def __init__(self, rate=10.0, burst=None, sample_every=1):
+        logging.Filter.__init__(self)
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.sample_every = max(1, sample_every)
+        self.tokens = self.burst
+        self.last = monotonic()
+        self.seen = 0
+        self.suppressed = 0
+
+    def filter(self, record):
+        self.seen += 1
+        if self.seen % self.sample_every:
+            self.suppressed += 1
+            return False
+
+        if self.rate:
+            now = monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens < 1:
+                self.suppressed += 1
+                return False
+            self.tokens -= 1
+        return True
+
+
+def setup_logging(level=logging.INFO, async_=True, event_rate=10.0,
+                  event_sample=1):
+    """Log to the console and return the handler.
+
+    Per-event records are sampled and rate-limited by an
+    :class:`EventLogFilter`. With ``async_``, records are written by an
+    :class:`AsyncHandler`.
+    """
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+    if async_:
+        handler = AsyncHandler(handler)
+        REGISTRY.callback(
+            'cosmicpi_log_dropped_total',
+            'Log records dropped because the writer fell behind.',
+            lambda: handler.dropped, type='counter')
+
+    log_filter = EventLogFilter(event_rate, sample_every=event_sample)
+    event_logger.addFilter(log_filter)
+    REGISTRY.callback(
+        'cosmicpi_log_events_suppressed_total',
+        'Event log records suppressed by sampling or rate limiting.',
+        lambda: log_filter.suppressed, type='counter')
+
+    logging.getLogger().addHandler(handler)
+    # Connection errors are already reported by the publisher.
+    logging.getLogger('pika').setLevel(logging.CRITICAL)
+    logger.setLevel(level)
+    return handler
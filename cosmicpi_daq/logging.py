@@ -25,3 +25,6 @@ from __future__ import absolute_import, print_function
 import logging
 
 logger = logging.getLogger('cosmicpi.daq')
+
+#: Logger of every decoded event, so that it can be gated on its own.
+event_logger = logging.getLogger('cosmicpi.daq.events')
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Acquisition from several serial devices in one process."""
+
+from __future__ import absolute_import, print_function
+
+import glob
+import os
+import threading
+from collections import OrderedDict
+
+from .detector import get_host_id
+from .logging import logger as log
+from .metrics import REGISTRY
+from .usb_handler import UsbReader, list_usb_ports
+
+
+class Pipeline(object):
+    """Reader and detector threads of a single serial device."""
+
+    #: Seconds to wait for each thread when stopping.
+    join_timeout = 5
+
+    def __init__(self, device, usb_handler, detector, buffer):
+        self.device = device
+        self.usb_handler = usb_handler
+        self.detector = detector
+        self.buffer = buffer
+        self.reader = UsbReader(usb_handler, buffer)
+        self.threads = []
+
+    def start(self):
+        """Start the reader and detector threads."""
+        name = os.path.basename(self.device)
+        self.threads = [
+            threading.Thread(target=self.reader, name=name + '-reader'),
+            threading.Thread(target=self.detector, name=name + '-detector'),
+        ]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        """Stop the threads and release the device."""
+        self.reader.stop()
+        self.detector.stop()
+        self.usb_handler.close()
+        for thread in self.threads:
+            thread.join(self.join_timeout)
+        log.info('{0}: buffer stats {1}'.format(
+            self.device, self.buffer.stats()))
+        if self.buffer.spill is not None:
+            self.buffer.spill.close()
+        if self.detector.spool is not None:
+            self.detector.spool.close()
+        if self.detector.store is not None:
+            self.detector.store.close()
+        REGISTRY.remove(device=self.device)
+        REGISTRY.remove(detector=self.detector.detector_id)
+
+    @property
+    def finished(self):
+        """Return True once a replayed input has been fully processed."""
+        return getattr(self.usb_handler, 'finished', False) and \
+            not len(self.buffer)
+
+    def stats(self):
+        """Return the counters of this pipeline."""
+        spool = self.detector.spool
+        return dict(
+            device=self.device,
+            detector_id=self.detector.detector_id,
+            buffer=self.buffer.stats(),
+            parser=self.detector.sensors.parser.stats(),
+            spooled=len(spool) if spool is not None else 0,
+        )
+
+
+class DetectorManager(object):
+    """Run one pipeline per serial device.
+
+    ``devices`` is a list of device paths or glob patterns such as
+    ``/dev/ttyACM*``. Patterns are rescanned every ``scan_interval``
+    seconds: pipelines are started for devices that appear and stopped for
+    devices that disappear. Plain paths are always kept, since their
+    readers reopen the device when it comes back.
+
+    ``factory`` is called with a device path and a detector ID and must
+    return a :class:`Pipeline`. With a single plain device the detector ID
+    is the host ID, otherwise the USB serial number of the board, as given
+    by ``ports``, or else the device name, is appended to it so that a
+    board keeps its ID when it comes back under another name.
+    """
+
+    def __init__(self, devices, factory, scan_interval=5,
+                 ports=list_usb_ports):
+        self.patterns = list(devices)
+        self.factory = factory
+        self.scan_interval = scan_interval
+        self.ports = ports
+        self.pipelines = OrderedDict()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.host_id = get_host_id()
+
+    @property
+    def multiple(self):
+        """Return True if more than one device may be handled."""
+        return len(self.patterns) > 1 or any(
+            glob.has_magic(pattern) for pattern in self.patterns)
+
+    @property
+    def primary(self):
+        """Return the first running pipeline, if any."""
+        with self.lock:
+            for pipeline in self.pipelines.values():
+                return pipeline
+
+    def detector_id(self, device):
+        """Return the detector ID to use for a device."""
+        if not self.multiple:
+            return self.host_id
+        try:
+            serial_number = self.ports().get(os.path.realpath(device))
+        except Exception:
+            serial_number = None
+        return '{0}-{1}'.format(
+            self.host_id, serial_number or os.path.basename(device))
+
+    def find_devices(self):
+        """Return the devices currently matching the configuration."""
+        devices = []
+        for pattern in self.patterns:
+            if glob.has_magic(pattern):
+                matches = sorted(glob.glob(pattern))
+            else:
+                matches = [pattern]
+            devices.extend(
+                device for device in matches if device not in devices)
+        return devices
+
+    def scan(self, strict=False):
+        """Start and stop pipelines to match the present devices.
+
+        A pipeline that cannot be created is logged and retried at the next
+        scan, unless ``strict`` is set: then the error is raised.
+        """
+        devices = self.find_devices()
+        with self.lock:
+            for device in list(self.pipelines):
+                if device not in devices:
+                    log.info('Device {0} removed'.format(device))
+                    self.pipelines.pop(device).stop()
+
+            for device in devices:
+                if device not in self.pipelines and not self.stopped.is_set():
+                    log.info('Device {0} added'.format(device))
+                    try:
+                        pipeline = self.factory(
+                            device, self.detector_id(device))
+                    except Exception:
+                        if strict:
+                            raise
+                        log.exception(
+                            'Cannot start device {0}, will retry'.format(
+                                device))
+                        continue
+                    pipeline.start()
+                    self.pipelines[device] = pipeline
+
+    @property
+    def finished(self):
+        """Return True once every replayed input has been processed."""
+        with self.lock:
+            return bool(self.pipelines) and all(
+                pipeline.finished for pipeline in self.pipelines.values())
+
+    def __call__(self):
+        """Rescan the devices until stopped."""
+        while not self.stopped.is_set():
+            self.scan()
+            self.stopped.wait(self.scan_interval)
+
+    def stop(self):
+        """Stop every pipeline."""
+        self.stopped.set()
+        with self.lock:
+            while self.pipelines:
+                self.pipelines.popitem(last=False)[1].stop()
+
+    def detectors(self):
+        """Return the detectors of the running pipelines."""
+        with self.lock:
+            return [pipeline.detector for pipeline in self.pipelines.values()]
+
+    def stats(self):
+        """Return the counters of every pipeline."""
+        with self.lock:
+            return [pipeline.stats() for pipeline in self.pipelines.values()]
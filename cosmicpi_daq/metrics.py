@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Lightweight metrics in the Prometheus text format."""
+
+from __future__ import absolute_import, print_function
+
+import bisect
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from .logging import logger as log
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+#: Default histogram buckets, in seconds.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(labels, extra=()):
+    items = sorted(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(
+        '{0}="{1}"'.format(key, str(value).replace('"', '\\"'))
+        for key, value in items) + '}'
+
+
+class Counter(object):
+    """Monotonically increasing value.
+
+    Updates take no lock: each counter is expected to be updated by a single
+    thread, which keeps instrumentation cheap on the hot path.
+    """
+
+    __slots__ = ('value',)
+    type = 'counter'
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield name, format_labels(labels), self.value
+
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+
+    __slots__ = ()
+    type = 'gauge'
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class Callback(object):
+    """Metric whose value is read from a function when collected."""
+
+    __slots__ = ('function', 'type')
+
+    def __init__(self, function, type='gauge'):
+        self.function = function
+        self.type = type
+
+    def samples(self, name, labels):
+        yield name, format_labels(labels), self.function()
+
+
+class Histogram(object):
+    """Distribution of observed values in cumulative buckets."""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+    type = 'histogram'
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield name + '_bucket', format_labels(
+                labels, [('le', bound)]), cumulative
+        yield name + '_sum', format_labels(labels), self.sum
+        yield name + '_count', format_labels(labels), self.count
+
+
+class Registry(object):
+    """Collection of named, labelled metrics."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.help = {}
+        self.lock = threading.Lock()
+
+    def _get(self, name, help, labels, factory):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.help.setdefault(name, help)
+            family = self.metrics.setdefault(name, {})
+            metric = family.get(key)
+            if metric is None:
+                metric = family[key] = factory()
+            return metric
+
+    def counter(self, name, help, **labels):
+        """Return the counter with the given name and labels."""
+        return self._get(name, help, labels, Counter)
+
+    def gauge(self, name, help, **labels):
+        """Return the gauge with the given name and labels."""
+        return self._get(name, help, labels, Gauge)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, **labels):
+        """Return the histogram with the given name and labels."""
+        return self._get(name, help, labels, lambda: Histogram(buckets))
+
+    def callback(self, name, help, function, type='gauge', **labels):
+        """Register a metric read from ``function`` at collection time."""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.help.setdefault(name, help)
+            self.metrics.setdefault(name, {})[key] = Callback(function, type)
+
+    def remove(self, **labels):
+        """Remove every metric carrying all the given labels."""
+        wanted = set(labels.items())
+        with self.lock:
+            for family in self.metrics.values():
+                for key in list(family):
+                    if wanted <= set(key):
+                        del family[key]
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        with self.lock:
+            families = [(name, list(family.items()))
+                        for name, family in sorted(self.metrics.items())]
+        lines = []
+        for name, family in families:
+            if not family:
+                continue
+            lines.append('# HELP {0} {1}'.format(name, self.help[name]))
+            lines.append('# TYPE {0} {1}'.format(name, family[0][1].type))
+            for key, metric in family:
+                for sample, labels, value in metric.samples(name, key):
+                    lines.append('{0}{1} {2}'.format(sample, labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+#: Registry used by the acquisition daemon.
+REGISTRY = Registry()
+
+
+class MetricsServer(object):
+    """Serve a registry over HTTP on a background thread."""
+
+    def __init__(self, port, host='127.0.0.1', registry=REGISTRY):
+        registry_ = registry
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = registry_.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header(
+                    'Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = HTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        log.info('Serving metrics on port {0}'.format(self.port))
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Parser for the line protocol of the Arduino firmware."""
+
+from __future__ import absolute_import, print_function
+
+import re
+
+from .logging import logger as log
+from .schema import EVENT, RECORDS, SENSORS, EventRecord, convert
+
+GROUP = re.compile(br"""\s*\{\s*['"](\w+)['"]\s*:\s*\{""")
+FIELD = re.compile(
+    br"""\s*['"](\w+)['"]\s*:\s*(?:['"]([^'"]*)['"]|([^,}\s]+))\s*([,}])""")
+END = re.compile(br"\s*\}\s*$")
+
+
+class LineParser(object):
+    """Parse firmware lines straight into sensor slots.
+
+    Lines look like ``{'group': {'field': 'value', ...}}``. They are parsed
+    from the raw bytes read off the serial port, without any intermediate
+    string or dictionary: each value is converted to the type declared in
+    :mod:`~cosmicpi_daq.schema` and stored in its slot of a new record,
+    which replaces the group's record in ``sensors``. Lines that cannot be
+    parsed, hold a value out of the range of its field or name an unknown
+    group are counted in ``malformed``; unknown fields of a known group are
+    ignored and counted in ``unknown_fields``.
+    """
+
+    def __init__(self, sensors):
+        self.sensors = sensors
+        self.groups = {}
+        groups = [(group, fields, RECORDS[group])
+                  for group, fields in SENSORS.items()]
+        groups.append(('event', EVENT, EventRecord))
+        for group, fields, record in groups:
+            self.groups[group.encode('ascii')] = (group, record, dict(
+                (name.encode('ascii'), (index, code))
+                for index, (name, code) in enumerate(fields)
+            ))
+        self.lines = 0
+        self.malformed = 0
+        self.unknown_fields = 0
+
+    def parse(self, line):
+        """Update the sensor slots from a line.
+
+        Return the name of the updated group, or None if the line was
+        rejected.
+        """
+        if not isinstance(line, bytes):
+            line = line.encode('utf-8')
+        self.lines += 1
+
+        match = GROUP.match(line)
+        if match is None or match.group(1) not in self.groups:
+            return self._reject(line)
+        group, record, fields = self.groups[match.group(1)]
+
+        if group == 'event':
+            values = list(record())
+        else:
+            values = list(getattr(self.sensors, group))
+        pos = match.end()
+        end = None
+        while end != b'}':
+            match = FIELD.match(line, pos)
+            if match is None:
+                return self._reject(line)
+            key, quoted, bare, end = match.groups()
+            pos = match.end()
+
+            field = fields.get(key)
+            if field is None:
+                self.unknown_fields += 1
+                continue
+            index, code = field
+            raw = quoted if quoted is not None else bare
+            try:
+                values[index] = convert(
+                    code, raw.decode('ascii') if code == 's' else raw)
+            except ValueError:
+                return self._reject(line)
+
+        if not END.match(line, pos):
+            return self._reject(line)
+
+        if group == 'event':
+            self.sensors.event = record._make(values)
+        else:
+            self.sensors.event = None
+            setattr(self.sensors, group, record._make(values))
+        return group
+
+    def _reject(self, line):
+        self.malformed += 1
+        log.debug('Malformed line: %r', line)
+        return None
+
+    def stats(self):
+        """Return the parser counters."""
+        return dict(
+            lines=self.lines,
+            malformed=self.malformed,
+            unknown_fields=self.unknown_fields,
+        )
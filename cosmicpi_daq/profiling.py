@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Per-stage latency profiling of the acquisition hot path."""
+
+from __future__ import absolute_import, print_function
+
+import functools
+import json
+import os
+import threading
+import time
+
+from .logging import logger as log
+from .metrics import REGISTRY
+
+try:
+    perf_counter_ns = time.perf_counter_ns
+except AttributeError:
+    _clock = getattr(time, 'perf_counter', time.time)
+
+    def perf_counter_ns():
+        """Return the time of a performance counter in nanoseconds."""
+        return int(_clock() * 1e9)
+
+#: Stage histogram buckets, in seconds, from 1 microsecond to 1 second.
+STAGE_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4,
+                 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25,
+                 0.5, 1.0)
+
+
+class TraceWriter(object):
+    """Write spans to a file in the Chrome trace event format.
+
+    The file is a JSON array of complete ("X") events which can be loaded in
+    ``chrome://tracing`` or Perfetto. Events are appended as they come, so
+    a file cut short by a crash can still be loaded.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.file.write('[\n')
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.threads = set()
+
+    def write(self, spans):
+        """Write the spans of one trace: (name, start_ns, end_ns) tuples."""
+        thread = threading.current_thread()
+        with self.lock:
+            if thread.ident not in self.threads:
+                self.threads.add(thread.ident)
+                self.emit(dict(name='thread_name', ph='M', pid=self.pid,
+                               tid=thread.ident, args=dict(name=thread.name)))
+            for name, start, end in spans:
+                self.emit(dict(
+                    name=name, ph='X', pid=self.pid, tid=thread.ident,
+                    ts=start / 1000.0, dur=(end - start) / 1000.0,
+                ))
+
+    def emit(self, event):
+        if self.file.tell() > 2:
+            self.file.write(',\n')
+        self.file.write(json.dumps(event))
+
+    def close(self):
+        with self.lock:
+            self.file.write('\n]\n')
+            self.file.close()
+
+
+class Profiler(object):
+    """Time the stages of the processing of each line.
+
+    Stages are timed by wrapping the functions that implement them with
+    :meth:`wrap`, so that nothing is added to the hot path unless profiling
+    is enabled. Durations go to the ``cosmicpi_stage_seconds`` histogram.
+
+    A root stage delimits a trace: the stages called while it runs are
+    nested in it. With a ``trace_path``, one trace out of ``sample_every``
+    is written to that file in the Chrome trace format.
+    """
+
+    def __init__(self, trace_path=None, sample_every=100):
+        self.writer = TraceWriter(trace_path) if trace_path else None
+        self.sample_every = max(1, sample_every)
+        self.local = threading.local()
+        self.histograms = {}
+
+    def histogram(self, name, labels):
+        key = (name,) + tuple(sorted(labels.items()))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = REGISTRY.histogram(
+                'cosmicpi_stage_seconds', 'Time spent in each stage.',
+                buckets=STAGE_BUCKETS, stage=name, **labels)
+        return histogram
+
+    def wrap(self, name, function, root=False, **labels):
+        """Return ``function`` timed as the stage ``name``."""
+        histogram = self.histogram(name, labels)
+        local = self.local
+
+        @functools.wraps(function)
+        def stage(*args, **kwargs):
+            spans = getattr(local, 'spans', None)
+            if root:
+                spans = local.spans = []
+            start = perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                end = perf_counter_ns()
+                histogram.observe((end - start) / 1e9)
+                if spans is not None:
+                    spans.append((name, start, end))
+                if root:
+                    local.spans = None
+                    self.commit(spans)
+
+        return stage
+
+    def commit(self, spans):
+        """Sample a finished trace."""
+        if self.writer is None:
+            return
+        count = getattr(self.local, 'count', 0) + 1
+        self.local.count = count
+        if count % self.sample_every == 0:
+            self.writer.write(spans)
+
+    def summary(self):
+        """Return the mean duration of each stage in microseconds."""
+        totals = {}
+        for key, histogram in self.histograms.items():
+            total, count = totals.get(key[0], (0.0, 0))
+            totals[key[0]] = (total + histogram.sum, count + histogram.count)
+        return dict((name, total / count * 1e6)
+                    for name, (total, count) in totals.items() if count)
+
+    def close(self):
+        """Log a summary and close the trace file."""
+        for name, mean in sorted(self.summary().items()):
+            log.info('Profile: {0} mean {1:.1f} us'.format(name, mean))
+        if self.writer is not None:
+            self.writer.close()
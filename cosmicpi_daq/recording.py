@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Recording and replay of raw serial streams."""
+
+from __future__ import absolute_import, print_function
+
+import gzip
+import os
+import struct
+import time
+
+from .logging import logger as log
+from .metrics import monotonic
+
+MAGIC = b'CPIREC1\n'
+RECORD = struct.Struct('>QI')
+
+
+class Recorder(object):
+    """Write lines with their receive time to a compressed file.
+
+    Records are made of the nanoseconds elapsed since the recording started,
+    the line length and the raw line, in a gzip stream. An existing
+    recording is appended to, as a new gzip member, and its records carry
+    on from the last recorded time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        elapsed = 0
+        if os.path.exists(path) and os.path.getsize(path):
+            for elapsed, _ in read_recording(path):
+                pass
+            self.file = gzip.open(path, 'ab')
+        else:
+            self.file = gzip.open(path, 'wb')
+            self.file.write(MAGIC)
+        self.started = monotonic() - elapsed / 1e9
+
+    def write(self, line):
+        elapsed = int((monotonic() - self.started) * 1e9)
+        self.file.write(RECORD.pack(elapsed, len(line)))
+        self.file.write(line)
+
+    def close(self):
+        self.file.close()
+
+
+def read_recording(path):
+    """Yield the (nanoseconds, line) records of a recording."""
+    with gzip.open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{0} is not a serial recording'.format(path))
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            elapsed, size = RECORD.unpack(header)
+            yield elapsed, f.read(size)
+
+
+class RecordingUsbHandler(object):
+    """Wrap a USB handler and record every line it reads."""
+
+    def __init__(self, usb_handler, path):
+        self.usb_handler = usb_handler
+        self.recorder = Recorder(path)
+
+    def __getattr__(self, name):
+        return getattr(self.usb_handler, name)
+
+    def readline(self):
+        line = self.usb_handler.readline()
+        if line and self.recorder is not None:
+            self.recorder.write(line)
+        return line
+
+    def close(self):
+        self.usb_handler.close()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+
+class ReplayUsbHandler(object):
+    """USB handler playing back a recording.
+
+    Lines are returned at the recorded pace divided by ``speed``, so 1 is
+    real time, 10 is ten times faster and 0 is as fast as possible. Once
+    the recording is exhausted, ``finished`` is set and empty lines are
+    returned.
+    """
+
+    def __init__(self, path, speed=1.0):
+        self.usbdev = path
+        self.speed = speed
+        self.records = read_recording(path)
+        self.is_open = True
+        self.enabled = True
+        self.finished = False
+        self.lines = 0
+        self.started = None
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def write(self, arg):
+        log.info("Replay: ignoring write to {0}: {1}".format(
+            self.usbdev, arg))
+
+    def readline(self):
+        if self.finished or not self.enabled:
+            time.sleep(1)
+            return b''
+
+        try:
+            elapsed, line = next(self.records)
+        except StopIteration:
+            self.finished = True
+            duration = monotonic() - (self.started or monotonic())
+            log.info('Replay of {0} finished: {1} lines in {2:.3f}s '
+                     '({3:.0f} lines/s)'.format(
+                         self.usbdev, self.lines, duration,
+                         self.lines / duration if duration else 0))
+            return b''
+
+        if self.started is None:
+            self.started = monotonic() - elapsed / 1e9 / (self.speed or 1)
+        if self.speed:
+            delay = self.started + elapsed / 1e9 / self.speed - monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self.lines += 1
+        return line
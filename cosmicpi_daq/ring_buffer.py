@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Bounded buffer between the serial reader and the event publisher."""
+
+from __future__ import absolute_import, print_function
+
+import os
+import struct
+import threading
+
+OVERFLOW_POLICIES = ('drop-oldest', 'block', 'spill')
+
+
+class SpillFile(object):
+    """File backed FIFO used when the ring buffer overflows.
+
+    Records are stored as a 4 byte big endian length followed by the raw
+    bytes. The file is truncated once every record has been read back.
+    """
+
+    header = struct.Struct('>I')
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = open(path, 'w+b')
+        self.read_offset = 0
+        self.write_offset = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, item):
+        self.fd.seek(self.write_offset)
+        self.fd.write(self.header.pack(len(item)))
+        self.fd.write(item)
+        self.write_offset = self.fd.tell()
+        self.count += 1
+
+    def pop(self):
+        if not self.count:
+            raise IndexError('pop from empty spill file')
+        self.fd.flush()
+        self.fd.seek(self.read_offset)
+        size, = self.header.unpack(self.fd.read(self.header.size))
+        item = self.fd.read(size)
+        self.read_offset = self.fd.tell()
+        self.count -= 1
+        if not self.count:
+            self.fd.truncate(0)
+            self.read_offset = self.write_offset = 0
+        return item
+
+    def close(self):
+        self.fd.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class RingBuffer(object):
+    """Bounded FIFO over a pre-allocated list of slots.
+
+    A single producer puts items and a single consumer gets them. When the
+    buffer is full the ``overflow`` policy decides what happens:
+
+    * ``drop-oldest``: the oldest buffered item is discarded.
+    * ``block``: the producer waits until the consumer frees a slot.
+    * ``spill``: the item is appended to ``spill`` (e.g. a
+      :class:`SpillFile`). Once spilling has started, new items keep going
+      to the spill until it is drained so that ordering is preserved.
+    """
+
+    def __init__(self, capacity, overflow='drop-oldest', spill=None):
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('unknown overflow policy "{0}"'.format(overflow))
+        if overflow == 'spill' and spill is None:
+            raise ValueError('spill overflow policy requires a spill')
+
+        self.capacity = capacity
+        self.overflow = overflow
+        self.spill = spill
+        self.slots = [None] * capacity
+        self.head = 0
+        self.size = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+        self.high_water_mark = 0
+        self.dropped = 0
+        self.spilled = 0
+
+    def __len__(self):
+        return self.size + (len(self.spill) if self.spill else 0)
+
+    def put(self, item, timeout=None):
+        """Add an item, applying the overflow policy if the buffer is full.
+
+        Return False if the item could not be stored.
+        """
+        with self.cond:
+            if self.closed:
+                return False
+
+            if self.spill and len(self.spill):
+                return self._spill(item)
+
+            while self.size == self.capacity:
+                if self.overflow == 'drop-oldest':
+                    self.slots[self.head] = None
+                    self.head = (self.head + 1) % self.capacity
+                    self.size -= 1
+                    self.dropped += 1
+                elif self.overflow == 'spill':
+                    return self._spill(item)
+                else:
+                    self.cond.wait(timeout)
+                    if self.closed or self.size == self.capacity:
+                        self.dropped += 1
+                        return False
+
+            self.slots[(self.head + self.size) % self.capacity] = item
+            self.size += 1
+            if self.size > self.high_water_mark:
+                self.high_water_mark = self.size
+            self.cond.notify_all()
+            return True
+
+    def _spill(self, item):
+        self.spill.append(item)
+        self.spilled += 1
+        self.cond.notify_all()
+        return True
+
+    def get(self, timeout=None):
+        """Remove and return the oldest item.
+
+        Return None if nothing arrives within ``timeout`` seconds or the
+        buffer has been closed.
+        """
+        with self.cond:
+            if not len(self) and not self.closed:
+                self.cond.wait(timeout)
+
+            if self.size:
+                item = self.slots[self.head]
+                self.slots[self.head] = None
+                self.head = (self.head + 1) % self.capacity
+                self.size -= 1
+                self.cond.notify_all()
+                return item
+
+            if self.spill and len(self.spill):
+                return self.spill.pop()
+
+            return None
+
+    def close(self):
+        """Wake up any waiting producer or consumer."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def stats(self):
+        """Return the buffer counters."""
+        return dict(
+            size=len(self),
+            capacity=self.capacity,
+            high_water_mark=self.high_water_mark,
+            dropped=self.dropped,
+            spilled=self.spilled,
+        )
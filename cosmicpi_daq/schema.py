@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Description of the sensor data sent by the Arduino firmware.
+
+This must be kept synchronised with the firmware, otherwise the data it sends
+will not be understood.
+"""
+
+from __future__ import absolute_import, print_function
+
+import struct
+from collections import OrderedDict, namedtuple
+
+#: Sensor groups and their fields, in wire order. Each field is described by
+#: its name and a :mod:`struct` format code, ``s`` being a string.
+SENSORS = OrderedDict([
+    ('temperature', (
+        ('temperature', 'f'),
+        ('humidity', 'f'),
+    )),
+    ('barometer', (
+        ('temperature', 'f'),
+        ('pressure', 'f'),
+        ('altitude', 'f'),
+    )),
+    ('vibration', (
+        ('direction', 'i'),
+        ('count', 'I'),
+    )),
+    ('magnetometer', (
+        ('x', 'f'),
+        ('y', 'f'),
+        ('z', 'f'),
+    )),
+    ('accelerometer', (
+        ('x', 'f'),
+        ('y', 'f'),
+        ('z', 'f'),
+    )),
+    ('location', (
+        ('latitude', 'd'),
+        ('longitude', 'd'),
+        ('altitude', 'f'),
+    )),
+    ('timing', (
+        ('uptime', 'Q'),
+        ('counter_frequency', 'Q'),
+        ('time_string', 's'),
+    )),
+    ('status', (
+        ('queue_size', 'I'),
+        ('missed_events', 'I'),
+        ('buffer_error', 'I'),
+        ('temp_status', 'I'),
+        ('baro_status', 'I'),
+        ('accel_status', 'I'),
+        ('mag_status', 'I'),
+        ('gps_status', 'I'),
+    )),
+])
+
+#: Fields of cosmic event lines. Unlike the sensor groups these describe a
+#: single hit rather than a persistent state.
+EVENT = (
+    ('sequence', 'I'),
+    ('ticks', 'Q'),
+)
+
+
+def field_type(code):
+    """Return the Python type of values with the given format code."""
+    if code in 'fd':
+        return float
+    if code == 's':
+        return str
+    return int
+
+
+#: Largest finite single precision float.
+FLOAT_MAX = struct.unpack('>f', b'\x7f\x7f\xff\xff')[0]
+
+
+def int_range(code):
+    """Return the smallest and largest values of an integer format code."""
+    bits = 8 * struct.calcsize('>' + code)
+    if code.isupper():
+        return 0, 2 ** bits - 1
+    return -2 ** (bits - 1), 2 ** (bits - 1) - 1
+
+
+def convert(code, value):
+    """Convert a raw value to the type of the given format code.
+
+    Raise ValueError if the value cannot be converted or is out of the range
+    of the format code.
+    """
+    if code == 's':
+        return value if isinstance(value, str) else str(value)
+    if code in 'fd':
+        value = float(value)
+        if code == 'f' and FLOAT_MAX < abs(value) < float('inf'):
+            raise ValueError('{0} out of range'.format(value))
+        return value
+    try:
+        value = int(value)
+    except ValueError:
+        try:
+            value = int(float(value))
+        except OverflowError:
+            raise ValueError('{0} out of range'.format(value))
+    minimum, maximum = int_range(code)
+    if not minimum <= value <= maximum:
+        raise ValueError('{0} out of range'.format(value))
+    return value
+
+
+def make_record(name, fields):
+    """Return an immutable record type for a group of fields.
+
+    Records are named tuples, so they are compact, slotted and can be shared
+    safely between events. Missing fields default to zero or empty values.
+    """
+    record = namedtuple(name.capitalize(), [field for field, _ in fields])
+    record.__new__.__defaults__ = tuple(
+        field_type(code)() for _, code in fields)
+    return record
+
+
+#: Record type of every sensor group.
+RECORDS = OrderedDict(
+    (group, make_record(group, fields)) for group, fields in SENSORS.items())
+
+#: Record type of cosmic event lines.
+EventRecord = make_record('event', EVENT)
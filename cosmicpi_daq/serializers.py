@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Event serialization formats."""
+
+from __future__ import absolute_import, print_function
+
+import json
+import struct
+import time
+from itertools import chain
+from operator import itemgetter
+
+from .schema import SENSORS
+from .timing import format_date
+
+
+class JsonSerializer(object):
+    """Encode events as JSON objects."""
+
+    name = 'json'
+    content_type = 'application/json'
+
+    def dumps(self, event):
+        """Return the encoded event."""
+        return event.to_json().encode('utf-8')
+
+    def loads(self, payload):
+        """Return the event dictionary encoded in a payload."""
+        return json.loads(payload.decode('utf-8'))
+
+    def dumps_batch(self, payloads):
+        """Combine encoded events into a JSON array."""
+        return b'[' + b','.join(payloads) + b']'
+
+    def loads_batch(self, body):
+        """Return the list of event dictionaries in a batch."""
+        return json.loads(body.decode('utf-8'))
+
+
+class BinarySerializer(object):
+    """Encode events in a compact, fixed-schema binary format.
+
+    A payload is made of:
+
+    * the schema version (unsigned byte);
+    * the detector ID, as a length-prefixed UTF-8 string;
+    * the timestamp in nanoseconds (unsigned long long) and whether it is
+      from the GPS (unsigned byte);
+    * every numeric field of :data:`~cosmicpi_daq.schema.SENSORS`, packed
+      big endian in schema order;
+    * every string field, length-prefixed, in schema order;
+    * the cosmic hit record and window aggregates, if any, as a
+      length-prefixed JSON object.
+
+    Version 1 payloads, which carry the date string instead of the
+    timestamp, can still be decoded.
+    """
+
+    name = 'binary'
+    content_type = 'application/x-cosmicpi-event'
+    version = 2
+
+    header = struct.Struct('>B')
+    timestamp = struct.Struct('>QB')
+    short_string = struct.Struct('>B')
+    long_string = struct.Struct('>H')
+    length = struct.Struct('>I')
+
+    def __init__(self):
+        self.groups = tuple(SENSORS)
+        self.numeric_fields = []
+        self.string_fields = []
+        numeric_index = []
+        string_index = []
+        index = 0
+        for group, fields in SENSORS.items():
+            for name, code in fields:
+                if code == 's':
+                    self.string_fields.append((group, name, code))
+                    string_index.append(index)
+                else:
+                    self.numeric_fields.append((group, name, code))
+                    numeric_index.append(index)
+                index += 1
+        self.numeric = struct.Struct(
+            '>' + ''.join(code for _, _, code in self.numeric_fields))
+        self.numeric_values = itemgetter(*numeric_index)
+        self.string_values = itemgetter(*string_index)
+
+    def _pack_string(self, value, prefix):
+        data = value.encode('utf-8')
+        return prefix.pack(len(data)) + data
+
+    def _unpack_string(self, payload, offset, prefix):
+        size, = prefix.unpack_from(payload, offset)
+        offset += prefix.size
+        return payload[offset:offset + size].decode('utf-8'), offset + size
+
+    def dumps(self, event):
+        """Return the encoded event."""
+        values = tuple(chain.from_iterable(
+            getattr(event, group) for group in self.groups))
+        strings = self.string_values(values)
+        if not isinstance(strings, tuple):
+            strings = (strings,)
+
+        parts = [
+            self.header.pack(self.version),
+            self._pack_string(event.detector_id, self.short_string),
+            self.timestamp.pack(event.timestamp_ns, event.gps),
+            self.numeric.pack(*self.numeric_values(values)),
+        ]
+        parts.extend(
+            self._pack_string(value, self.short_string) for value in strings)
+        extras = {}
+        if event.event is not None:
+            extras['event'] = dict(event.event._asdict())
+        if event.aggregates:
+            extras['aggregates'] = event.aggregates
+        parts.append(self._pack_string(
+            json.dumps(extras) if extras else '', self.long_string))
+        return b''.join(parts)
+
+    def loads(self, payload):
+        """Return the event dictionary encoded in a payload."""
+        version, = self.header.unpack_from(payload)
+        if version not in (1, self.version):
+            raise ValueError(
+                'unsupported event schema version {0}'.format(version))
+
+        offset = self.header.size
+        event = dict((group, {}) for group in SENSORS)
+        event['detector_id'], offset = self._unpack_string(
+            payload, offset, self.short_string)
+        if version == 1:
+            date, offset = self._unpack_string(
+                payload, offset, self.short_string)
+        else:
+            timestamp, gps = self.timestamp.unpack_from(payload, offset)
+            offset += self.timestamp.size
+            event['timestamp_ns'] = timestamp
+            event['gps'] = bool(gps)
+            date = format_date(timestamp)
+        event['date'] = {'date': date}
+
+        values = self.numeric.unpack_from(payload, offset)
+        offset += self.numeric.size
+        for (group, name, _), value in zip(self.numeric_fields, values):
+            event[group][name] = value
+
+        for group, name, _ in self.string_fields:
+            event[group][name], offset = self._unpack_string(
+                payload, offset, self.short_string)
+
+        extras, offset = self._unpack_string(
+            payload, offset, self.long_string)
+        if extras:
+            event.update(json.loads(extras))
+        return event
+
+    def dumps_batch(self, payloads):
+        """Combine encoded events into length-prefixed frames."""
+        return b''.join(
+            self.length.pack(len(payload)) + payload for payload in payloads)
+
+    def loads_batch(self, body):
+        """Return the list of event dictionaries in a batch."""
+        events = []
+        offset = 0
+        while offset < len(body):
+            size, = self.length.unpack_from(body, offset)
+            offset += self.length.size
+            events.append(self.loads(body[offset:offset + size]))
+            offset += size
+        return events
+
+
+class DeltaSerializer(JsonSerializer):
+    """Encode only the sensor fields that changed since the previous event.
+
+    Every message is a JSON object with the detector ID, a sequence number
+    counting the messages of the detector, the timestamp, the cosmic hit and
+    window aggregates, if any, and ``changes``: the fields of every sensor
+    group that differ from the previous message of the detector. A
+    keyframe, flagged as such, holds every field instead; one is sent first
+    and then every ``keyframe_interval`` messages or ``keyframe_seconds``,
+    whichever comes first, so that receivers recover from lost messages.
+
+    Messages must be decoded in order, see :class:`DeltaDecoder`.
+    """
+
+    name = 'delta'
+    content_type = 'application/x-cosmicpi-delta+json'
+
+    def __init__(self, keyframe_interval=100, keyframe_seconds=60.0):
+        self.keyframe_interval = keyframe_interval
+        self.keyframe_seconds = keyframe_seconds
+        self.groups = tuple(SENSORS)
+        self.fields = dict(
+            (group, [name for name, _ in fields])
+            for group, fields in SENSORS.items())
+        #: Sequence number, time of the last keyframe and records of the
+        #: last message of every detector.
+        self.streams = {}
+        self.decoder = DeltaDecoder()
+
+    def dumps(self, event):
+        """Return the encoded event."""
+        stream = self.streams.get(event.detector_id)
+        now = time.time()
+        if stream is None:
+            sequence, keyframe = 0, True
+        else:
+            sequence = stream[0] + 1
+            keyframe = sequence % self.keyframe_interval == 0 or \
+                now - stream[1] >= self.keyframe_seconds
+
+        records = tuple(getattr(event, group) for group in self.groups)
+        changes = {}
+        for index, (group, record) in enumerate(zip(self.groups, records)):
+            fields = self.fields[group]
+            if keyframe:
+                changes[group] = dict(zip(fields, record))
+                continue
+            last = stream[2][index]
+            # Records are shared between events until a group changes.
+            if record is last:
+                continue
+            changed = dict(
+                (name, value)
+                for name, value, previous in zip(fields, record, last)
+                if value != previous)
+            if changed:
+                changes[group] = changed
+        self.streams[event.detector_id] = (
+            sequence, now if keyframe else stream[1], records)
+
+        message = dict(
+            detector_id=event.detector_id,
+            sequence=sequence,
+            timestamp_ns=event.timestamp_ns,
+            gps=event.gps,
+            changes=changes,
+        )
+        if keyframe:
+            message['keyframe'] = True
+        if event.event is not None:
+            message['event'] = dict(event.event._asdict())
+        if event.aggregates:
+            message['aggregates'] = event.aggregates
+        return json.dumps(message, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, payload):
+        """Return the full event dictionary reconstructed from a payload.
+
+        Raise ValueError if the previous messages of the detector are
+        missing.
+        """
+        return self._decode(json.loads(payload.decode('utf-8')))
+
+    def loads_batch(self, body):
+        """Return the list of full event dictionaries in a batch."""
+        return [self._decode(message)
+                for message in json.loads(body.decode('utf-8'))]
+
+    def _decode(self, message):
+        event = self.decoder.decode(message)
+        if event is None:
+            raise ValueError(
+                'cannot decode message {0} of {1} without a keyframe'.format(
+                    message['sequence'], message['detector_id']))
+        return event
+
+
+class DeltaDecoder(object):
+    """Reconstruct full events from the messages of :class:`DeltaSerializer`.
+
+    The state of every detector is rebuilt from its keyframes and the
+    changes that follow them. Messages after a gap in the sequence numbers
+    cannot be applied until the next keyframe; they are counted in ``gaps``
+    and messages older than the state in ``duplicates``.
+    """
+
+    def __init__(self):
+        self.states = {}
+        self.gaps = 0
+        self.duplicates = 0
+
+    def decode(self, message):
+        """Return the full event dictionary of a message, or None if it
+        cannot be reconstructed."""
+        detector_id = message['detector_id']
+        sequence = message['sequence']
+        state = self.states.get(detector_id)
+
+        if message.get('keyframe'):
+            state = self.states[detector_id] = dict(sequence=sequence)
+        elif state is None or state['sequence'] is None:
+            self.gaps += 1
+            return None
+        elif sequence <= state['sequence']:
+            self.duplicates += 1
+            return None
+        elif sequence != state['sequence'] + 1:
+            self.gaps += 1
+            state['sequence'] = None
+            return None
+
+        state['sequence'] = sequence
+        event = dict(
+            detector_id=detector_id,
+            date={'date': format_date(message['timestamp_ns'])},
+            timestamp_ns=message['timestamp_ns'],
+            gps=message['gps'],
+            event=message.get('event'),
+        )
+        for group in SENSORS:
+            values = state.setdefault(group, {})
+            values.update(message['changes'].get(group, ()))
+            event[group] = dict(values)
+        if message.get('aggregates'):
+            event['aggregates'] = message['aggregates']
+        return event
+
+
+SERIALIZERS = dict(
+    (serializer.name, serializer)
+    for serializer in (JsonSerializer, BinarySerializer, DeltaSerializer)
+)
+
+
+def get_serializer(name, **options):
+    """Return a serializer instance by name.
+
+    Options are passed to the serializer class.
+    """
+    try:
+        serializer = SERIALIZERS[name]
+    except KeyError:
+        raise ValueError('unknown serializer "{0}"'.format(name))
+    return serializer(**options)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Synthetic Arduino serial data for tests and benchmarks."""
+
+from __future__ import absolute_import, print_function
+
+import gzip
+import os
+import pty
+import random
+import time
+import tty
+
+from .recording import MAGIC, RECORD
+from .schema import EVENT, SENSORS
+
+#: Sensor groups emitted for each kind of line in a traffic mix.
+KINDS = dict(
+    cosmic=('event',),
+    weather=('temperature', 'barometer'),
+    vibration=('vibration', 'accelerometer', 'magnetometer'),
+    status=('status', 'timing', 'location'),
+)
+
+#: Default traffic mix, as relative weights of each kind.
+DEFAULT_MIX = dict(cosmic=0.5, weather=0.2, vibration=0.2, status=0.1)
+
+
+def parse_mix(text):
+    """Parse a mix such as ``cosmic=0.5,weather=0.5``."""
+    mix = {}
+    for item in text.split(','):
+        kind, _, weight = item.partition('=')
+        if kind not in KINDS:
+            raise ValueError('unknown line kind "{0}"'.format(kind))
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+class LineGenerator(object):
+    """Generate firmware lines for a traffic mix."""
+
+    def __init__(self, mix=None, seed=0):
+        mix = mix or DEFAULT_MIX
+        self.kinds = sorted(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.random = random.Random(seed)
+        self.sequence = 0
+        self.fields = dict(SENSORS, event=EVENT)
+
+    def value(self, name, code):
+        if name == 'time_string':
+            return "'{0}'".format(int(time.time()))
+        if name == 'counter_frequency':
+            return '42000000'
+        if name == 'sequence':
+            self.sequence += 1
+            return str(self.sequence)
+        if name == 'ticks':
+            return str(self.random.randrange(42000000))
+        if code in 'fd':
+            return "'{0:.2f}'".format(self.random.uniform(-100, 1000))
+        return "'{0}'".format(self.random.randrange(100))
+
+    def line(self):
+        """Return one line, as bytes."""
+        kind = self._choice()
+        group = self.random.choice(KINDS[kind])
+        fields = ', '.join(
+            "'{0}': {1}".format(name, self.value(name, code))
+            for name, code in self.fields[group])
+        return "{{'{0}': {{{1}}}}}\n".format(group, fields).encode('ascii')
+
+    def _choice(self):
+        point = self.random.uniform(0, sum(self.weights))
+        for kind, weight in zip(self.kinds, self.weights):
+            point -= weight
+            if point <= 0:
+                return kind
+        return self.kinds[-1]
+
+    def lines(self, count):
+        """Return a list of ``count`` lines."""
+        return [self.line() for _ in range(count)]
+
+
+class SimulatedUsbHandler(object):
+    """USB handler returning pre-generated lines.
+
+    The time each line is read is kept in ``read_times`` so that latencies
+    can be measured downstream.
+    """
+
+    def __init__(self, lines):
+        self.usbdev = 'simulator'
+        self.lines = iter(lines)
+        self.read_times = []
+        self.is_open = True
+        self.enabled = True
+        self.finished = False
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def write(self, arg):
+        pass
+
+    def readline(self):
+        try:
+            line = next(self.lines)
+        except StopIteration:
+            self.finished = True
+            time.sleep(0.1)
+            return b''
+        self.read_times.append(time.time())
+        return line
+
+
+def write_recording(path, lines, rate):
+    """Write lines to a serial recording at ``rate`` lines per second."""
+    with gzip.open(path, 'wb') as f:
+        f.write(MAGIC)
+        for index, line in enumerate(lines):
+            f.write(RECORD.pack(int(index * 1e9 / rate), len(line)))
+            f.write(line)
+
+
+class VirtualPorts(object):
+    """Pseudo terminals standing in for USB serial boards.
+
+    Each board is a pseudo terminal reached through a symbolic link in
+    ``directory``, so that it can be unplugged, which closes the terminal
+    and removes the link, and plugged in again, possibly under another
+    name. The instance is a drop-in replacement for
+    :func:`~cosmicpi_daq.usb_handler.list_usb_ports`.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.boards = {}
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def plug(self, name, serial_number):
+        """Connect a board under ``name`` and return its path."""
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+        os.symlink(os.ttyname(slave), self.path(name))
+        self.boards[name] = (master, slave, serial_number)
+        return self.path(name)
+
+    def unplug(self, name):
+        """Disconnect a board."""
+        master, slave, _ = self.boards.pop(name)
+        os.remove(self.path(name))
+        os.close(master)
+        os.close(slave)
+
+    def write(self, name, data):
+        """Send data from a board."""
+        os.write(self.boards[name][0], data)
+
+    def close(self):
+        """Disconnect every board."""
+        for name in list(self.boards):
+            self.unplug(name)
+
+    def __call__(self):
+        return dict(
+            (os.path.realpath(self.path(name)), serial_number)
+            for name, (_, _, serial_number) in self.boards.items())
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Outputs that encoded events are fanned out to.
+
+A sink writes encoded events to one destination. Each sink runs behind a
+:class:`QueuedSink`, with its own bounded queue and thread, so that a slow or
+unreachable destination only loses its own events instead of stalling the
+detectors or the other sinks.
+"""
+
+from __future__ import absolute_import, print_function
+
+import errno
+import gzip
+import os
+import socket
+import struct
+import threading
+import time
+
+try:
+    from urllib.parse import urlparse
+except ImportError:  # Python 2
+    from urlparse import urlparse
+
+from .logging import logger as log
+from .metrics import REGISTRY
+from .ring_buffer import RingBuffer
+
+#: Length prefix of events on stream outputs.
+FRAME = struct.Struct('>I')
+
+
+class Sink(object):
+    """Destination of encoded events."""
+
+    #: Name of the sink in logs and metrics.
+    name = 'sink'
+
+    def send(self, data):
+        """Write one encoded event."""
+        raise NotImplementedError
+
+    def idle(self):
+        """Do periodic work while no event arrives."""
+
+    def status(self):
+        """Return a short description of the sink state."""
+        return ''
+
+    def close(self):
+        """Release the resources of the sink."""
+
+
+class FileSink(Sink):
+    """Write events to gzip compressed files rotated every period.
+
+    A new file named after its creation time and a sequence number is
+    started every ``rotate_interval`` seconds, or once ``max_bytes`` of
+    events have been written to it. JSON events are written one per line,
+    other encodings are prefixed with their length as a 4 byte big endian
+    integer.
+    """
+
+    name = 'file'
+
+    def __init__(self, directory, serializer, rotate_interval=3600,
+                 max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.json = serializer.content_type.endswith('json')
+        self.extension = '.jsonl.gz' if self.json else '.bin.gz'
+        self.rotate_interval = rotate_interval
+        self.max_bytes = max_bytes
+        self.file = None
+        self.path = None
+        self.sequence = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def open(self):
+        self.opened = time.time()
+        self.written = 0
+        name = 'events-{0}-{1:04d}{2}'.format(
+            time.strftime('%Y%m%d-%H%M%S', time.gmtime(self.opened)),
+            self.sequence, self.extension)
+        self.path = os.path.join(self.directory, name)
+        self.sequence += 1
+        self.file = gzip.open(self.path, 'ab')
+
+    def send(self, data):
+        if self.file is None:
+            self.open()
+        if self.json:
+            self.file.write(data + b'\n')
+        else:
+            self.file.write(FRAME.pack(len(data)) + data)
+        self.written += len(data)
+        if self.written >= self.max_bytes:
+            self.close()
+
+    def idle(self):
+        if self.file is not None and \
+                time.time() - self.opened >= self.rotate_interval:
+            self.close()
+
+    def status(self):
+        return 'path:{0}'.format(self.path)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class UdpSink(Sink):
+    """Send every event as one UDP datagram."""
+
+    name = 'udp'
+
+    def __init__(self, host, port):
+        self.address = (host, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, data):
+        self.sock.sendto(data, self.address)
+
+    def status(self):
+        return 'ip:{0} port:{1}'.format(*self.address)
+
+    def close(self):
+        self.sock.close()
+
+
+class UnixSocketSink(Sink):
+    """Stream events to the clients of a local Unix socket.
+
+    Events are prefixed with their length as a 4 byte big endian integer.
+    New clients only receive events sent after they connected. A client
+    that does not read an event within ``timeout`` seconds is disconnected.
+    """
+
+    name = 'unix'
+
+    def __init__(self, path, timeout=1.0):
+        self.path = path
+        self.timeout = timeout
+        self.clients = []
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen(5)
+        self.sock.setblocking(False)
+
+    def accept(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except socket.error as e:
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                return
+            client.settimeout(self.timeout)
+            self.clients.append(client)
+
+    def send(self, data):
+        self.accept()
+        frame = FRAME.pack(len(data)) + data
+        for client in list(self.clients):
+            try:
+                client.sendall(frame)
+            except (socket.error, socket.timeout):
+                log.warning('{0}: dropping slow or closed client'.format(
+                    self.path))
+                self.clients.remove(client)
+                client.close()
+
+    def idle(self):
+        self.accept()
+
+    def status(self):
+        return 'path:{0} clients:{1}'.format(self.path, len(self.clients))
+
+    def close(self):
+        for client in self.clients:
+            client.close()
+        self.clients = []
+        self.sock.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class AmqpSink(Sink):
+    """Publish events to another broker through an event publisher."""
+
+    name = 'amqp'
+
+    def __init__(self, publisher):
+        self.publisher = publisher
+
+    def send(self, data):
+        if not self.publisher.service():
+            raise IOError('not connected to broker')
+        self.publisher.send_event_pkt(data)
+
+    def idle(self):
+        self.publisher.service()
+
+    def status(self):
+        return 'connected:{0}'.format(self.publisher.connected)
+
+    def close(self):
+        self.publisher.close()
+
+
+class QueuedSink(object):
+    """Feed a sink from a bounded queue on a dedicated thread.
+
+    When the queue is full the oldest event is dropped. Events that the
+    sink fails to write are counted and discarded.
+    """
+
+    def __init__(self, sink, capacity=1024, label=None):
+        self.sink = sink
+        self.label = label or sink.name
+        self.buffer = RingBuffer(capacity)
+        self.stopping = False
+        self.thread = threading.Thread(
+            target=self.run, name='sink-' + self.label)
+        self.thread.daemon = True
+
+        buffer = self.buffer
+        labels = dict(sink=self.label)
+        self.sent = REGISTRY.counter(
+            'cosmicpi_sink_events_total', 'Events written by a sink.',
+            **labels)
+        self.errors = REGISTRY.counter(
+            'cosmicpi_sink_errors_total', 'Events a sink failed to write.',
+            **labels)
+        REGISTRY.callback(
+            'cosmicpi_sink_queue_depth', 'Events waiting for a sink.',
+            lambda: len(buffer), **labels)
+        REGISTRY.callback(
+            'cosmicpi_sink_dropped_total',
+            'Events dropped because a sink fell behind.',
+            lambda: buffer.dropped, type='counter', **labels)
+
+    def start(self):
+        self.thread.start()
+
+    def put(self, data):
+        """Queue an event for the sink."""
+        self.buffer.put(data)
+
+    def run(self):
+        """Write queued events until stopped and drained."""
+        while not self.stopping or len(self.buffer):
+            data = self.buffer.get(timeout=1)
+            try:
+                if data is None:
+                    self.sink.idle()
+                    continue
+                self.sink.send(data)
+                self.sent.inc()
+            except Exception as e:
+                if data is not None:
+                    self.errors.inc()
+                log.warning('Sink {0}: {1}'.format(self.label, e))
+
+    def stop(self, timeout=5):
+        """Write the queued events and close the sink."""
+        self.stopping = True
+        self.buffer.close()
+        self.thread.join(timeout)
+        self.sink.close()
+
+    def status(self):
+        """Return the counters and state of the sink."""
+        return '{0}: sent:{1} dropped:{2} errors:{3} {4}'.format(
+            self.label, self.sent.value, self.buffer.dropped,
+            self.errors.value, self.sink.status()).rstrip()
+
+
+def create_sink(uri, serializer, publisher_factory=None):
+    """Return the sink described by a URI.
+
+    Supported URIs are ``file:///directory``, ``udp://host:port``,
+    ``unix:///path/to/socket`` and ``amqp://...``, the latter requiring a
+    ``publisher_factory`` called with the URI.
+    """
+    url = urlparse(uri)
+    if url.scheme in ('file', 'unix') and (url.netloc or not url.path):
+        raise ValueError(
+            '{0} sink requires an absolute path, e.g. {0}:///path'.format(
+                url.scheme))
+    if url.scheme == 'file':
+        return FileSink(url.path, serializer)
+    if url.scheme == 'udp':
+        if not url.hostname or not url.port:
+            raise ValueError('UDP sink requires a host and a port')
+        return UdpSink(url.hostname, url.port)
+    if url.scheme == 'unix':
+        return UnixSocketSink(url.path)
+    if url.scheme in ('amqp', 'amqps') and publisher_factory is not None:
+        return AmqpSink(publisher_factory(uri))
+    raise ValueError('unsupported sink "{0}"'.format(uri))
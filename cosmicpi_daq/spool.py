@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Durable on-disk spool for events that could not be published."""
+
+from __future__ import absolute_import, print_function
+
+import glob
+import mmap
+import os
+import struct
+import time
+from collections import deque
+
+from .logging import logger as log
+
+
+class Segment(object):
+    """Pre-allocated, memory-mapped spool segment file.
+
+    The file starts with a header holding the read and write offsets,
+    followed by records made of a 4 byte big endian length and a payload.
+    """
+
+    header = struct.Struct('>QQ')
+    record = struct.Struct('>I')
+
+    def __init__(self, path, size):
+        self.path = path
+        exists = os.path.exists(path)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if not exists:
+            os.ftruncate(self.fd, size)
+        self.size = os.fstat(self.fd).st_size
+        self.map = mmap.mmap(self.fd, self.size)
+        if exists:
+            self.read_offset, self.write_offset = self.header.unpack_from(
+                self.map)
+        else:
+            self.reset()
+        self.dirty = False
+
+    def __len__(self):
+        count = 0
+        offset = self.read_offset
+        while offset < self.write_offset:
+            size, = self.record.unpack_from(self.map, offset)
+            offset += self.record.size + size
+            count += 1
+        return count
+
+    @property
+    def empty(self):
+        return self.read_offset >= self.write_offset
+
+    def fits(self, payload):
+        return self.write_offset + self.record.size + len(payload) <= \
+            self.size
+
+    def reset(self):
+        self.read_offset = self.write_offset = self.header.size
+        self.save_header()
+
+    def save_header(self):
+        self.header.pack_into(
+            self.map, 0, self.read_offset, self.write_offset)
+        self.dirty = True
+
+    def append(self, payload):
+        offset = self.write_offset
+        self.record.pack_into(self.map, offset, len(payload))
+        offset += self.record.size
+        self.map[offset:offset + len(payload)] = payload
+        self.write_offset = offset + len(payload)
+        self.save_header()
+
+    def peek(self):
+        size, = self.record.unpack_from(self.map, self.read_offset)
+        start = self.read_offset + self.record.size
+        return self.map[start:start + size], start + size
+
+    def sync(self):
+        if self.dirty:
+            self.map.flush()
+            self.dirty = False
+
+    def close(self):
+        self.sync()
+        self.map.close()
+        os.close(self.fd)
+
+    def remove(self):
+        self.map.close()
+        os.close(self.fd)
+        os.remove(self.path)
+
+
+class Spool(object):
+    """Append-only FIFO of event payloads stored in rotating segments.
+
+    Payloads are appended to the newest segment and read back in order from
+    the oldest one; a segment file is deleted once it has been fully read.
+    To spare SD cards, changes are only flushed to disk every
+    ``fsync_records`` appends or ``fsync_interval_ms`` milliseconds. When the
+    spool would grow beyond ``max_size`` bytes the oldest segment is
+    discarded and its records are counted in ``dropped``.
+    """
+
+    def __init__(self, directory, segment_size=1024 * 1024,
+                 max_size=64 * 1024 * 1024, fsync_interval_ms=1000,
+                 fsync_records=100):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_segments = max(1, max_size // segment_size)
+        self.fsync_interval = fsync_interval_ms / 1000.0
+        self.fsync_records = fsync_records
+        self.dropped = 0
+        self.unsynced = 0
+        self.last_sync = time.time()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        paths = sorted(glob.glob(os.path.join(directory, 'segment-*.spool')))
+        self.segments = [Segment(path, segment_size) for path in paths]
+        if not self.segments:
+            self.segments.append(self._new_segment(0))
+        self.count = sum(len(segment) for segment in self.segments)
+        if self.count:
+            log.info('Spool: {0} events pending in {1}'.format(
+                self.count, directory))
+
+    def __len__(self):
+        return self.count
+
+    def _new_segment(self, number):
+        path = os.path.join(
+            self.directory, 'segment-{0:010d}.spool'.format(number))
+        return Segment(path, self.segment_size)
+
+    def _segment_number(self, segment):
+        return int(os.path.basename(segment.path)[8:18])
+
+    def append(self, payload):
+        """Append a payload to the spool."""
+        segment = self.segments[-1]
+        if not segment.fits(payload):
+            if segment.empty:
+                segment.reset()
+            if not segment.fits(payload):
+                if len(payload) + Segment.header.size + \
+                        Segment.record.size > self.segment_size:
+                    raise ValueError('payload larger than a spool segment')
+                segment.sync()
+                segment = self._new_segment(
+                    self._segment_number(segment) + 1)
+                self.segments.append(segment)
+                if len(self.segments) > self.max_segments:
+                    self._drop_oldest()
+
+        segment.append(payload)
+        self.count += 1
+        self.unsynced += 1
+        self.maybe_sync()
+
+    def _drop_oldest(self):
+        segment = self.segments.pop(0)
+        dropped = len(segment)
+        self.count -= dropped
+        self.dropped += dropped
+        segment.remove()
+        log.warning('Spool full, dropped {0} events'.format(dropped))
+
+    def peek(self):
+        """Return the oldest payload without removing it, or None."""
+        if not self.count:
+            return None
+        return self.segments[0].peek()[0]
+
+    def pop(self):
+        """Remove and return the oldest payload."""
+        if not self.count:
+            raise IndexError('pop from empty spool')
+        segment = self.segments[0]
+        payload, segment.read_offset = segment.peek()
+        segment.save_header()
+        self.count -= 1
+
+        if segment.empty:
+            if len(self.segments) > 1:
+                self.segments.pop(0).remove()
+            else:
+                segment.reset()
+        self.maybe_sync()
+        return payload
+
+    def maybe_sync(self):
+        """Flush to disk if the fsync policy says so."""
+        if self.unsynced >= self.fsync_records or \
+                time.time() - self.last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        """Flush all pending changes to disk."""
+        for segment in self.segments:
+            segment.sync()
+        self.unsynced = 0
+        self.last_sync = time.time()
+
+    def close(self):
+        """Flush and close all segments."""
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+
+
+class MemorySpool(object):
+    """In-memory FIFO with the interface of :class:`Spool`.
+
+    It keeps events through a broker outage when no spool directory is
+    configured, but not across restarts. Beyond ``capacity`` payloads the
+    oldest are discarded and counted in ``dropped``.
+    """
+
+    def __init__(self, capacity=10000):
+        self.queue = deque()
+        self.capacity = capacity
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def append(self, payload):
+        """Append a payload to the spool."""
+        if len(self.queue) >= self.capacity:
+            if not self.dropped:
+                log.warning('Memory spool full, dropping the oldest events')
+            self.queue.popleft()
+            self.dropped += 1
+        self.queue.append(payload)
+
+    def peek(self):
+        """Return the oldest payload without removing it, or None."""
+        return self.queue[0] if self.queue else None
+
+    def pop(self):
+        """Remove and return the oldest payload."""
+        if not self.queue:
+            raise IndexError('pop from empty spool')
+        return self.queue.popleft()
+
+    def maybe_sync(self):
+        pass
+
+    def sync(self):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Columnar local store of events, indexed by time.
+
+Events are kept under ``directory/<detector_id>/<YYYYmmddHH>/`` in chunks:
+NumPy ``.npz`` files holding one array per column, sorted by timestamp. Each
+hourly directory has an ``index.json`` listing its chunks with their time
+range, so that a time range query only loads the chunks that overlap it,
+and only the columns it needs.
+
+Requires NumPy.
+"""
+
+from __future__ import absolute_import, print_function
+
+import calendar
+import json
+import operator
+import os
+import re
+import time
+from itertools import chain
+from operator import itemgetter
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from .schema import SENSORS
+
+#: NumPy types of the schema format codes.
+DTYPES = dict(f='float32', d='float64', i='int32', I='uint32', Q='uint64')
+
+#: Columns stored for every event, in row order. ``gps`` tells whether the
+#: timestamp comes from the GPS or, without a fix, from the host clock.
+COLUMNS = [
+    ('timestamp_ns', 'int64'),
+    ('gps', 'bool'),
+    ('hit', 'bool'),
+    ('sequence', 'uint32'),
+    ('ticks', 'uint64'),
+] + [
+    ('{0}.{1}'.format(group, name), DTYPES[code])
+    for group, fields in SENSORS.items()
+    for name, code in fields if code != 's'
+]
+
+HOUR_FORMAT = '%Y%m%d%H'
+HOUR_NS = 3600 * 1000000000
+
+CONDITION = re.compile(r'^\s*([\w.]+)\s*(>=|<=|==|!=|>|<)\s*(\S+)\s*$')
+OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+
+def require_numpy():
+    if np is None:
+        raise RuntimeError('the event store requires NumPy')
+
+
+class EventStore(object):
+    """Append the events of one detector to the store.
+
+    Rows are accumulated in memory and written as a chunk once there are
+    ``chunk_rows`` of them, or the oldest is ``flush_interval`` seconds old.
+    Once rows of a later hour are written, the chunks of the previous hour
+    are merged into one, so that queries over long periods open few files.
+    """
+
+    def __init__(self, directory, detector_id, chunk_rows=4096,
+                 flush_interval=60):
+        require_numpy()
+        self.directory = os.path.join(directory, detector_id)
+        self.chunk_rows = chunk_rows
+        self.flush_interval = flush_interval
+        self.rows = []
+        self.first_row = None
+        self.hour = None
+
+        numeric = []
+        index = 0
+        for group, fields in SENSORS.items():
+            for name, code in fields:
+                if code != 's':
+                    numeric.append(index)
+                index += 1
+        self.numeric_values = itemgetter(*numeric)
+
+    def append(self, event):
+        """Add an event to the store."""
+        hit = event.event
+        self.rows.append((
+            event.timestamp_ns, event.gps, hit is not None,
+            hit.sequence if hit is not None else 0,
+            hit.ticks if hit is not None else 0,
+        ) + self.numeric_values(tuple(chain.from_iterable(
+            getattr(event, group) for group in SENSORS))))
+
+        if self.first_row is None:
+            self.first_row = time.time()
+        if len(self.rows) >= self.chunk_rows or \
+                time.time() - self.first_row >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write the pending rows, one chunk per hour they span."""
+        if not self.rows:
+            return
+        columns = dict(
+            (name, np.array(values, dtype=dtype))
+            for (name, dtype), values in zip(COLUMNS, zip(*self.rows)))
+        self.rows = []
+        self.first_row = None
+
+        order = np.argsort(columns['timestamp_ns'], kind='mergesort')
+        for name in columns:
+            columns[name] = columns[name][order]
+        timestamps = columns['timestamp_ns']
+        hours = timestamps // HOUR_NS
+        for hour in np.unique(hours):
+            start, end = np.searchsorted(hours, [hour, hour + 1])
+            self.write_chunk(int(hour), dict(
+                (name, values[start:end]) for name, values in columns.items()))
+
+    def hour_directory(self, hour):
+        return os.path.join(self.directory, time.strftime(
+            HOUR_FORMAT, time.gmtime(hour * 3600)))
+
+    def write_chunk(self, hour, columns):
+        if self.hour is not None and hour > self.hour:
+            compact(self.hour_directory(self.hour))
+        if self.hour is None or hour > self.hour:
+            self.hour = hour
+
+        directory = self.hour_directory(hour)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        index = read_index(directory)
+        index.append(save_chunk(directory, next_chunk(index), columns))
+        write_index(directory, index)
+
+    def close(self):
+        """Write the pending rows."""
+        self.flush()
+
+
+def next_chunk(index):
+    """Return the number of the next chunk of an hourly directory."""
+    return max([int(entry['chunk'][6:12]) + 1 for entry in index] or [0])
+
+
+def save_chunk(directory, number, columns):
+    """Save a chunk and return its index entry."""
+    name = 'chunk-{0:06d}.npz'.format(number)
+    np.savez(os.path.join(directory, name), **columns)
+    timestamps = columns['timestamp_ns']
+    return dict(chunk=name, rows=len(timestamps),
+                start=int(timestamps[0]), end=int(timestamps[-1]))
+
+
+def write_index(directory, index):
+    """Atomically replace the chunk index of an hourly directory."""
+    path = os.path.join(directory, 'index.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.rename(path + '.tmp', path)
+
+
+def compact(directory):
+    """Merge the chunks of an hourly directory into a single one."""
+    index = read_index(directory)
+    if len(index) < 2:
+        return
+    chunks = [np.load(os.path.join(directory, entry['chunk']))
+              for entry in index]
+    try:
+        columns = dict(
+            (name, np.concatenate([chunk[name] for chunk in chunks]))
+            for name, _ in COLUMNS)
+    finally:
+        for chunk in chunks:
+            chunk.close()
+    order = np.argsort(columns['timestamp_ns'], kind='mergesort')
+    for name in columns:
+        columns[name] = columns[name][order]
+
+    # The merged chunk gets a new number so that the old chunks stay valid
+    # until the new index replaces theirs.
+    merged = save_chunk(directory, next_chunk(index), columns)
+    write_index(directory, [merged])
+    for entry in index:
+        os.remove(os.path.join(directory, entry['chunk']))
+
+
+def read_index(directory):
+    """Return the chunk index of an hourly directory."""
+    try:
+        with open(os.path.join(directory, 'index.json')) as f:
+            return json.load(f)
+    except IOError:
+        return []
+
+
+def parse_condition(condition):
+    """Return the column, operator and value of a condition like ``a>1``."""
+    match = CONDITION.match(condition)
+    if match is None:
+        raise ValueError('invalid condition "{0}"'.format(condition))
+    column, compare, value = match.groups()
+    if column not in dict(COLUMNS):
+        raise ValueError('unknown column "{0}"'.format(column))
+    return column, OPERATORS[compare], float(value)
+
+
+def hour_range(start_ns, end_ns):
+    """Return the first and last hours overlapping a time range."""
+    return (start_ns // HOUR_NS if start_ns is not None else None,
+            end_ns // HOUR_NS if end_ns is not None else None)
+
+
+def query(directory, start_ns=None, end_ns=None, where=(), columns=None,
+          hits_only=False):
+    """Yield the rows matching a query, one chunk at a time.
+
+    Rows are selected by timestamp, from ``start_ns`` included to ``end_ns``
+    excluded, and by the conditions in ``where`` such as
+    ``barometer.pressure>1000``. Each item is the detector ID and a
+    dictionary of arrays holding the requested ``columns`` (all by default)
+    of the matching rows of a chunk.
+    """
+    require_numpy()
+    conditions = [parse_condition(condition) for condition in where]
+    if hits_only:
+        conditions.append(('hit', operator.eq, True))
+    columns = list(columns or [name for name, _ in COLUMNS])
+    first_hour, last_hour = hour_range(start_ns, end_ns)
+
+    for detector_id in sorted(os.listdir(directory)):
+        detector_dir = os.path.join(directory, detector_id)
+        if not os.path.isdir(detector_dir):
+            continue
+        for hour_name in sorted(os.listdir(detector_dir)):
+            try:
+                hour = calendar.timegm(
+                    time.strptime(hour_name, HOUR_FORMAT)) // 3600
+            except ValueError:
+                continue
+            if (first_hour is not None and hour < first_hour) or \
+                    (last_hour is not None and hour > last_hour):
+                continue
+            hour_dir = os.path.join(detector_dir, hour_name)
+            for entry in read_index(hour_dir):
+                if (start_ns is not None and entry['end'] < start_ns) or \
+                        (end_ns is not None and entry['start'] >= end_ns):
+                    continue
+                selected = select(os.path.join(hour_dir, entry['chunk']),
+                                  start_ns, end_ns, conditions, columns)
+                if selected is not None:
+                    yield detector_id, selected
+
+
+def select(path, start_ns, end_ns, conditions, columns):
+    """Return the selected columns of the matching rows of a chunk."""
+    with np.load(path) as chunk:
+        timestamps = chunk['timestamp_ns']
+        start, end = 0, len(timestamps)
+        if start_ns is not None:
+            start = np.searchsorted(timestamps, start_ns)
+        if end_ns is not None:
+            end = np.searchsorted(timestamps, end_ns)
+        if start >= end:
+            return None
+
+        mask = None
+        for column, compare, value in conditions:
+            matches = compare(chunk[column][start:end], value)
+            mask = matches if mask is None else mask & matches
+        if mask is not None and not mask.any():
+            return None
+
+        selected = {}
+        for column in columns:
+            values = chunk[column][start:end]
+            selected[column] = values[mask] if mask is not None else values
+        return selected
+
+
+def query_columns(directory, columns, **kwargs):
+    """Return the matching rows of every detector as one array per column.
+
+    Return None if no row matches.
+    """
+    chunks = [selected for _, selected in query(
+        directory, columns=columns, **kwargs)]
+    if not chunks:
+        return None
+    return dict((column, np.concatenate([chunk[column] for chunk in chunks]))
+                for column in columns)
+
+
+def count(directory, **kwargs):
+    """Return the number of rows matching a query."""
+    kwargs.setdefault('columns', ['timestamp_ns'])
+    return sum(len(next(iter(selected.values())))
+               for _, selected in query(directory, **kwargs))
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Live streams of readings and status pushed to local subscribers."""
+
+from __future__ import absolute_import, print_function
+
+import json
+import threading
+from collections import deque
+
+from .command_server import encode_frame
+from .logging import logger as log
+from .metrics import REGISTRY, monotonic
+from .schema import SENSORS
+
+#: Message types a client can subscribe to: the readings of every sensor
+#: group, cosmic hits and changes of the acquisition status.
+TYPES = tuple(SENSORS) + ('event', 'monitor')
+
+
+class Subscriber(object):
+    """Messages waiting to be sent to a client.
+
+    ``notify`` is called, possibly from another thread, when messages are
+    queued. A subscriber that lets more than ``capacity`` messages pile up
+    is dropped: it receives nothing more and must be disconnected.
+    """
+
+    def __init__(self, types, capacity, notify):
+        self.types = frozenset(types)
+        self.capacity = capacity
+        self.notify = notify
+        self.frames = deque()
+        self.dropped = False
+        self.status = {}
+
+    def push(self, frame):
+        """Queue a frame, return False if the subscriber was dropped."""
+        if self.dropped:
+            return False
+        if len(self.frames) >= self.capacity:
+            self.dropped = True
+            self.frames.clear()
+            return False
+        self.frames.append(frame)
+        return True
+
+    def pop_all(self):
+        """Return and forget the queued frames."""
+        frames = []
+        while self.frames:
+            frames.append(self.frames.popleft())
+        return b''.join(frames)
+
+
+def parse_subscribe(command):
+    """Return the message types requested by a ``subscribe`` command, or
+    None if the command is not one.
+
+    Without arguments every type is requested. Raise ValueError for unknown
+    types.
+    """
+    words = command.split()
+    if not words or words[0] != 'subscribe':
+        return None
+    types = words[1:] or list(TYPES)
+    unknown = set(types) - set(TYPES)
+    if unknown:
+        raise ValueError('unknown types: {0}'.format(
+            ', '.join(sorted(unknown))))
+    return types
+
+
+class Subscriptions(object):
+    """Fan messages out to the subscribers.
+
+    Detectors call :meth:`publish` with every reading; it is encoded once,
+    and only if someone subscribed to its type. ``status`` is a callable
+    returning the acquisition status of every detector, as a dictionary of
+    dictionaries by detector ID; :meth:`tick` sends each ``monitor``
+    subscriber the values that changed since its previous update, at most
+    every ``status_interval`` seconds.
+    """
+
+    def __init__(self, capacity=1000, status=None, status_interval=1.0,
+                 clock=monotonic):
+        self.capacity = capacity
+        self.status = status
+        self.status_interval = status_interval
+        self.clock = clock
+        self.subscribers = []
+        self.wanted = frozenset()
+        self.lock = threading.Lock()
+        self.last_status = None
+        self.messages = REGISTRY.counter(
+            'cosmicpi_subscription_messages_total',
+            'Messages pushed to subscribers.')
+        self.drops = REGISTRY.counter(
+            'cosmicpi_subscribers_dropped_total',
+            'Subscribers dropped for not keeping up.')
+        REGISTRY.callback(
+            'cosmicpi_subscribers', 'Clients subscribed to live streams.',
+            lambda: len(self.subscribers))
+
+    parse = staticmethod(parse_subscribe)
+
+    def subscribe(self, types, notify):
+        """Return a new subscriber to the given message types."""
+        subscriber = Subscriber(types, self.capacity, notify)
+        with self.lock:
+            self.subscribers.append(subscriber)
+            self._update()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+                self._update()
+
+    def _update(self):
+        self.wanted = frozenset().union(
+            *[subscriber.types for subscriber in self.subscribers])
+
+    def publish(self, group, event):
+        """Push the reading of a group that produced ``event``."""
+        if group not in self.wanted:
+            return
+        message = dict(
+            type=group,
+            detector_id=event.detector_id,
+            timestamp_ns=event.timestamp_ns,
+            gps=event.gps,
+        )
+        if group == 'event':
+            message['event'] = dict(event.event._asdict())
+        else:
+            message[group] = dict(getattr(event, group)._asdict())
+        self._push(group, encode_frame(json.dumps(message)))
+
+    def _push(self, group, frame):
+        with self.lock:
+            subscribers = [subscriber for subscriber in self.subscribers
+                           if group in subscriber.types]
+        for subscriber in subscribers:
+            self.send(subscriber, frame)
+
+    def send(self, subscriber, frame):
+        # Waiting frames are sent together, only the first one needs to
+        # wake the server up.
+        idle = not subscriber.frames
+        if subscriber.push(frame):
+            self.messages.inc()
+            if idle:
+                subscriber.notify()
+        else:
+            self.drop(subscriber)
+            subscriber.notify()
+
+    def drop(self, subscriber):
+        with self.lock:
+            if subscriber not in self.subscribers:
+                return
+            self.subscribers.remove(subscriber)
+            self._update()
+        self.drops.inc()
+        log.warning('Dropped a subscriber that was not keeping up')
+
+    def tick(self):
+        """Send status changes to the ``monitor`` subscribers, if due."""
+        if 'monitor' not in self.wanted or self.status is None:
+            return
+        now = self.clock()
+        with self.lock:
+            if self.last_status is not None and \
+                    now - self.last_status < self.status_interval:
+                return
+            self.last_status = now
+            subscribers = [subscriber for subscriber in self.subscribers
+                           if 'monitor' in subscriber.types]
+        status = self.status()
+        for subscriber in subscribers:
+            changes = {}
+            for detector_id, values in status.items():
+                last = subscriber.status.get(detector_id, {})
+                changed = dict((key, value) for key, value in values.items()
+                               if key not in last or last[key] != value)
+                if changed:
+                    changes[detector_id] = changed
+            if changes:
+                subscriber.status = status
+                self.send(subscriber, encode_frame(json.dumps(
+                    dict(type='monitor', detectors=changes))))
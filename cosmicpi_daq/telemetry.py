@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Downsampling of slowly changing sensor telemetry."""
+
+from __future__ import absolute_import, division, print_function
+
+import copy
+
+from .metrics import monotonic
+from .schema import SENSORS
+
+#: Groups that describe something that happened rather than a state, they
+#: are always published.
+PASS_THROUGH = ('vibration',)
+
+#: Groups sampled at a high rate, published as min/max/mean windows.
+AGGREGATED = ('accelerometer', 'magnetometer')
+
+#: Smallest change of a field, from the last published value, that is
+#: published before the heartbeat. Fields set to None are not compared and
+#: other fields are published on any change.
+DEADBANDS = {
+    'temperature.temperature': 0.1,
+    'temperature.humidity': 0.5,
+    'barometer.temperature': 0.1,
+    'barometer.pressure': 0.1,
+    'barometer.altitude': 1.0,
+    'location.latitude': 0.0001,
+    'location.longitude': 0.0001,
+    'location.altitude': 5.0,
+    'timing.uptime': None,
+    'timing.time_string': None,
+    'status.queue_size': 8,
+}
+
+
+def parse_deadband(text):
+    """Return the field and value of a ``group.field=value`` deadband."""
+    field, _, value = text.partition('=')
+    group, _, name = field.partition('.')
+    if group not in SENSORS or \
+            name not in [name for name, _ in SENSORS[group]]:
+        raise ValueError('unknown sensor field "{0}"'.format(field))
+    if value.lower() in ('', 'none'):
+        return field, None
+    return field, float(value)
+
+
+class Window(object):
+    """Running minimum, maximum and sum of the readings of a group."""
+
+    __slots__ = ('started', 'samples', 'minimum', 'maximum', 'total')
+
+    def __init__(self, started, record):
+        self.started = started
+        self.samples = 1
+        self.minimum = list(record)
+        self.maximum = list(record)
+        self.total = list(record)
+
+    def add(self, record):
+        """Add a reading."""
+        self.samples += 1
+        for index, value in enumerate(record):
+            if value < self.minimum[index]:
+                self.minimum[index] = value
+            elif value > self.maximum[index]:
+                self.maximum[index] = value
+            self.total[index] += value
+
+    def mean(self):
+        """Return the mean of every field."""
+        return [total / self.samples for total in self.total]
+
+    def summary(self, fields):
+        """Return the window as a dictionary of field dictionaries."""
+        return dict(
+            samples=self.samples,
+            min=dict(zip(fields, self.minimum)),
+            max=dict(zip(fields, self.maximum)),
+            mean=dict(zip(fields, self.mean())),
+        )
+
+
+class TelemetryFilter(object):
+    """Select the events worth publishing.
+
+    Cosmic hits and :data:`PASS_THROUGH` groups are always published. Other
+    readings are published when a field moved beyond its deadband since the
+    group was last published, or when ``heartbeat`` seconds elapsed. Readings
+    of the :data:`AGGREGATED` groups are combined over ``window`` seconds and
+    published once per window: the record holds the mean of every field and
+    the event's ``aggregates`` the minimum, maximum and mean.
+
+    Events are not modified, the aggregated ones are copies.
+    """
+
+    def __init__(self, deadbands=None, heartbeat=60.0, window=10.0,
+                 aggregated=AGGREGATED, clock=monotonic):
+        self.heartbeat = heartbeat
+        self.window = window
+        self.aggregated = frozenset(aggregated) if window else frozenset()
+        self.clock = clock
+        bands = dict(DEADBANDS)
+        bands.update(deadbands or {})
+        self.deadbands = dict(
+            (group, tuple(
+                (index, bands.get('{0}.{1}'.format(group, name), 0))
+                for index, (name, _) in enumerate(fields)
+                if bands.get('{0}.{1}'.format(group, name), 0) is not None))
+            for group, fields in SENSORS.items())
+        self.fields = dict(
+            (group, [name for name, _ in fields])
+            for group, fields in SENSORS.items())
+        self.published = {}
+        self.windows = {}
+        self.suppressed = 0
+        self.aggregated_readings = 0
+
+    def filter(self, group, event):
+        """Return the event to publish for a reading of a group, or None."""
+        if group == 'event' or group in PASS_THROUGH:
+            return event
+        now = self.clock()
+        record = getattr(event, group)
+
+        if group in self.aggregated:
+            return self._aggregate(group, event, record, now)
+
+        last = self.published.get(group)
+        if last is not None and now - last[0] < self.heartbeat and \
+                not self._changed(group, last[1], record):
+            self.suppressed += 1
+            return None
+        self.published[group] = (now, record)
+        return event
+
+    def _changed(self, group, last, record):
+        for index, deadband in self.deadbands[group]:
+            if deadband:
+                if abs(record[index] - last[index]) >= deadband:
+                    return True
+            elif record[index] != last[index]:
+                return True
+        return False
+
+    def _aggregate(self, group, event, record, now):
+        window = self.windows.get(group)
+        if window is None:
+            window = self.windows[group] = Window(now, record)
+        else:
+            window.add(record)
+        if now - window.started < self.window:
+            self.aggregated_readings += 1
+            return None
+
+        del self.windows[group]
+        event = copy.copy(event)
+        setattr(event, group, type(record)._make(window.mean()))
+        event.aggregates = dict(event.aggregates or {})
+        event.aggregates[group] = window.summary(self.fields[group])
+        return event
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 CosmicPi.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+"""Event timestamps from the GPS and the counter of the board."""
+
+from __future__ import absolute_import, division, print_function
+
+import calendar
+import math
+import time
+
+from .logging import logger as log
+
+TIME_FORMATS = (
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S',
+    '%d/%m/%Y %H:%M:%S',
+)
+
+
+def parse_time_string(time_string):
+    """Return the UTC seconds since the epoch of a GPS time string.
+
+    Numeric strings are taken as seconds since the epoch.
+    """
+    try:
+        return int(float(time_string))
+    except ValueError:
+        pass
+    for time_format in TIME_FORMATS:
+        try:
+            return calendar.timegm(time.strptime(time_string, time_format))
+        except ValueError:
+            continue
+    raise ValueError('unknown time string "{0}"'.format(time_string))
+
+
+def timestamp_ns(time_string, ticks, counter_frequency):
+    """Return the nanosecond timestamp of a hit.
+
+    The GPS time string gives the second, and the counter ticks since the
+    last PPS pulse give the fraction of second.
+    """
+    nanoseconds = parse_time_string(time_string) * 1000000000
+    if counter_frequency:
+        nanoseconds += ticks * 1000000000 // counter_frequency
+    return nanoseconds
+
+
+#: Second and string of the last formatted date.
+_last_date = (None, None)
+
+
+def format_date(timestamp):
+    """Return the ``asctime`` representation of a nanosecond timestamp.
+
+    The string only changes once per second, so the last one is reused.
+    """
+    global _last_date
+    seconds = timestamp // 1000000000
+    last = _last_date
+    if last[0] != seconds:
+        last = _last_date = (seconds, time.asctime(time.gmtime(seconds)))
+    return last[1]
+
+
+class BoardClock(object):
+    """Convert the counter ticks of a board into UTC nanoseconds.
+
+    Each timing line, sent by the firmware on the GPS PPS pulse, gives the
+    UTC second and the number of counter ticks measured over the previous
+    second. The counter frequency is tracked with an exponentially weighted
+    mean and variance of those measurements; measurements further than
+    ``tolerance`` from the estimate, e.g. after a missed pulse, are
+    rejected. A hit is then stamped with the second of the last pulse plus
+    its ticks converted with the estimated frequency.
+
+    The first measurement seeds the estimate. Should it be wrong, e.g. a
+    glitched first pulse, every later measurement would be rejected: after
+    ``reseed_after`` consecutive rejected measurements that agree with each
+    other, the estimate is seeded again from the last of them.
+
+    Until the GPS time and counter frequency are known, readings are stamped
+    with ``host_clock`` instead.
+    """
+
+    def __init__(self, smoothing=0.1, tolerance=0.001, host_clock=time.time,
+                 reseed_after=5):
+        self.smoothing = smoothing
+        self.tolerance = tolerance
+        self.host_clock = host_clock
+        self.reseed_after = reseed_after
+        #: Last rejected measurement and the number of consecutive rejected
+        #: measurements agreeing with it.
+        self.candidate = None
+        self.candidates = 0
+        self.timing = None
+        self.second = None
+        self.frequency = 0.0
+        self.variance = 0.0
+        #: Host clock minus GPS time at the last pulse, in seconds.
+        self.offset = 0.0
+        self.pulses = 0
+        self.missed_pulses = 0
+        self.rejected = 0
+
+    @property
+    def synchronised(self):
+        """Return True if readings are stamped from the GPS."""
+        return self.second is not None and self.frequency > 0
+
+    @property
+    def frequency_error(self):
+        """Return the standard deviation of the frequency measurements."""
+        return math.sqrt(self.variance)
+
+    @property
+    def jitter_ns(self):
+        """Return the timing error accumulated over a second, in ns."""
+        if not self.frequency:
+            return 0.0
+        return self.frequency_error * 1e9 / self.frequency
+
+    def pulse(self, timing):
+        """Update the model with a timing record."""
+        self.timing = timing
+        try:
+            second = parse_time_string(timing.time_string)
+        except ValueError:
+            self.second = None
+            return
+        if self.second is not None and second > self.second + 1:
+            self.missed_pulses += second - self.second - 1
+        self.second = second
+        self.pulses += 1
+        self.offset = self.host_clock() - second
+
+        measured = timing.counter_frequency
+        if not measured:
+            return
+        if not self.frequency:
+            self.frequency = float(measured)
+            return
+        residual = measured - self.frequency
+        if abs(residual) > self.tolerance * self.frequency:
+            self.rejected += 1
+            self._reject(float(measured))
+            return
+        self.candidate = None
+        self.candidates = 0
+        self.frequency += self.smoothing * residual
+        self.variance = (1 - self.smoothing) * (
+            self.variance + self.smoothing * residual * residual)
+
+    def _reject(self, measured):
+        candidate = self.candidate
+        if candidate is not None and \
+                abs(measured - candidate) <= self.tolerance * candidate:
+            self.candidates += 1
+        else:
+            self.candidates = 1
+        self.candidate = measured
+        if self.candidates >= self.reseed_after:
+            log.warning('Counter frequency reseeded from {0:.0f} to '
+                        '{1:.0f} Hz'.format(self.frequency, measured))
+            self.frequency = measured
+            self.variance = 0.0
+            self.candidate = None
+            self.candidates = 0
+
+    def stamp(self, sensors):
+        """Return the timestamp of the current readings of a board, in
+        nanoseconds, and whether it is based on the GPS."""
+        if sensors.timing is not self.timing:
+            self.pulse(sensors.timing)
+        if not self.synchronised:
+            return int(self.host_clock() * 1e9), False
+        timestamp = self.second * 1000000000
+        if sensors.event is not None:
+            timestamp += int(sensors.event.ticks * 1e9 / self.frequency)
+        return timestamp, True
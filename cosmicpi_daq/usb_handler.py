@@ -22,34 +22,205 @@
 
 from __future__ import absolute_import, print_function
 
+import os
 import termios
 import time
 
 import serial
 
+from .event_publisher import OUTAGE_BUCKETS, Backoff
 from .logging import logger as log
+from .metrics import REGISTRY, monotonic
+
+
+def list_usb_ports():
+    """Return the USB serial number of every serial port, by device path."""
+    from serial.tools import list_ports
+    return dict(
+        (os.path.realpath(port.device), port.serial_number)
+        for port in list_ports.comports() if port.serial_number)
 
 
 class UsbHandler(object):
+    """Read lines from the serial port of a detector.
+
+    Data is read in bulk, everything waiting in the driver at once, into a
+    reusable buffer from which lines are framed without copying the
+    remaining data. A read that times out returns an empty line but keeps
+    the port open and any partial line buffered; the port is only closed,
+    to be reopened by the next read, after an error.
+
+    Lines longer than ``max_line`` are discarded and counted in
+    ``overlong``.
+
+    While the port is closed, reads wait for the device to appear, polling
+    every ``poll_interval`` seconds, and reopen it as soon as it does.
+    Failed attempts are spaced by ``backoff``. The USB serial number of the
+    board, as given by ``ports`` (see :func:`list_usb_ports`), is noted when
+    the port is first opened; with ``follow``, a board that comes back
+    under another path, e.g. after the USB bus re-enumerated, is found by
+    its serial number. The time the port was unavailable after an error is
+    reported when it is reopened.
+    """
 
-    def __init__(self, usbdev, baudrate, timeout):
+    def __init__(self, usbdev, baudrate, timeout, read_size=4096,
+                 max_line=4096, serial_number=None, follow=True,
+                 backoff=None, poll_interval=0.2, ports=list_usb_ports):
         self.usbdev = usbdev
+        self.path = usbdev
         self.baudrate = baudrate
         self.timeout = timeout
+        self.read_size = read_size
+        self.max_line = max_line
+        self.serial_number = serial_number
+        self.follow = follow
+        self.backoff = backoff or Backoff(initial=0.5, maximum=30)
+        self.poll_interval = poll_interval
+        self.ports = ports
+        self.next_attempt = 0
+        self.down_since = None
+        self.missing = False
         self.is_open = False
         self.enabled = True
+        self.buffer = bytearray(read_size + max_line)
+        self.view = memoryview(self.buffer)
+        self.start = self.end = 0
+        self.overlong = 0
+        self.lines_read = REGISTRY.counter(
+            'cosmicpi_usb_lines_read_total',
+            'Lines read from the serial port.', device=usbdev)
+        self.bytes_read = REGISTRY.counter(
+            'cosmicpi_usb_bytes_read_total',
+            'Bytes read from the serial port.', device=usbdev)
+        self.opens = REGISTRY.counter(
+            'cosmicpi_usb_opens_total',
+            'Times the serial port was opened.', device=usbdev)
+        self.errors = REGISTRY.counter(
+            'cosmicpi_usb_errors_total',
+            'Errors opening or reading the serial port.', device=usbdev)
+        self.downtime = REGISTRY.counter(
+            'cosmicpi_usb_downtime_seconds_total',
+            'Time the serial port was unavailable after errors.',
+            device=usbdev)
+        self.outages = REGISTRY.histogram(
+            'cosmicpi_usb_outage_seconds',
+            'Duration of serial port outages.', buckets=OUTAGE_BUCKETS,
+            device=usbdev)
+        REGISTRY.callback(
+            'cosmicpi_usb_connected', 'Whether the serial port is open.',
+            lambda: int(self.is_open), device=usbdev)
 
     def open(self):
         self.usb = serial.Serial(
-            port=self.usbdev,
+            port=self.path,
             baudrate=self.baudrate,
             timeout=self.timeout)
         self.attr = termios.tcgetattr(self.usb)
         # Clear HUPCL in control reg (2)
         self.attr[2] = self.attr[2] & ~termios.HUPCL
         termios.tcsetattr(self.usb, termios.TCSANOW, self.attr)  # and write
-        log.info("Serial port %s opened" % self.usbdev)
+        log.info("Serial port %s opened" % self.path)
         self.is_open = True
+        self.start = self.end = 0
+        self.opens.inc()
+        if self.serial_number is None:
+            self.serial_number = self.list_ports().get(
+                os.path.realpath(self.path))
+
+    def list_ports(self):
+        """Return the serial numbers of the serial ports, by path."""
+        try:
+            return self.ports()
+        except Exception as e:
+            log.debug("Couldn't list serial ports: %s", e)
+            return {}
+
+    def locate(self):
+        """Return the path of the board, or None if it is not plugged in.
+
+        A path that now belongs to another board is not used.
+        """
+        ports = None
+        if os.path.exists(self.usbdev):
+            if self.serial_number is None or not self.follow:
+                return self.usbdev
+            ports = self.list_ports()
+            if ports.get(os.path.realpath(self.usbdev)) in \
+                    (None, self.serial_number):
+                return self.usbdev
+        if self.serial_number is not None and self.follow:
+            for path, number in (ports or self.list_ports()).items():
+                if number == self.serial_number:
+                    return path
+        return None
+
+    def wait_for_device(self, timeout):
+        """Wait up to ``timeout`` seconds for the board to be plugged in.
+
+        Return its path, or None.
+        """
+        deadline = monotonic() + timeout
+        while True:
+            path = self.locate()
+            if path is not None:
+                return path
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(self.poll_interval, remaining))
+
+    def reconnect(self, wait=True):
+        """Try to reopen the port, waiting up to the timeout for the board
+        unless ``wait`` is false. Return True if the port is open."""
+        if self.is_open:
+            return True
+        now = monotonic()
+        if now < self.next_attempt:
+            if not wait:
+                return False
+            time.sleep(min(self.next_attempt - now, self.timeout))
+            return False
+
+        path = self.wait_for_device(self.timeout if wait else 0)
+        if path is None:
+            if not self.missing:
+                self.missing = True
+                log.warning("Waiting for serial port %s", self.usbdev)
+            return False
+        self.missing = False
+        if path != self.path:
+            log.info("Board %s found at %s", self.serial_number, path)
+            self.path = path
+        try:
+            self.open()
+        except Exception as e:
+            delay = self.backoff.next()
+            self.next_attempt = monotonic() + delay
+            self.errors.inc()
+            log.warning("Couldn't open serial port %s, retrying in %.1f s: "
+                        "%s", self.path, delay, e)
+            return False
+
+        self.backoff.reset()
+        if self.down_since is not None:
+            downtime = monotonic() - self.down_since
+            self.down_since = None
+            self.downtime.inc(downtime)
+            self.outages.observe(downtime)
+            log.info("Serial port %s back after %.1f s", self.path, downtime)
+        return True
+
+    def lost(self, error=None):
+        """Close the port after an error, it is reopened by the next read."""
+        if not self.enabled:
+            self.close()
+            return
+        if error is not None:
+            log.warning("Error reading from serial port: %s" % error)
+        self.errors.inc()
+        self.close()
+        if self.down_since is None:
+            self.down_since = monotonic()
 
     def close(self):
         try:
@@ -68,29 +239,99 @@ class UsbHandler(object):
         self.close()
 
     def readline(self):
+        """Return the next line, or an empty string if none arrived within
+        the timeout."""
         if not self.enabled:
             time.sleep(1)
             return ''
 
-        if not self.is_open:
-            try:
-                self.open()
-            except Exception as e:
-                log.warn("Couldn't open serial port: %s" % e)
-                time.sleep(1)
+        line = self.frame()
+        if line is not None:
+            return line
 
-        try:
-            line = self.usb.readline()
-            if len(line) == 0:
-                log.warn("Serial input buffer empty")
-                self.close()
+        if not self.reconnect():
+            return ''
 
+        try:
+            while self.fill():
+                line = self.frame()
+                if line is not None:
+                    return line
         except Exception as e:
-            log.warn("Error reading from serial port: %s" % e)
-            self.close()
-            line = ''
+            self.lost(e)
+        return ''
 
+    def frame(self):
+        """Return the next complete line in the buffer, or None."""
+        end = self.buffer.find(b'\n', self.start, self.end)
+        if end < 0:
+            return None
+        line = self.view[self.start:end + 1].tobytes()
+        self.start = end + 1
+        self.lines_read.inc()
         return line
 
+    def fill(self):
+        """Append everything waiting in the driver to the buffer.
+
+        Wait up to the timeout for the first byte if nothing is waiting.
+        Return the number of bytes read.
+        """
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end + self.read_size > len(self.buffer):
+            # Move the partial line to the front to make room.
+            pending = self.end - self.start
+            if pending > self.max_line:
+                self.overlong += 1
+                log.warning("Discarding %d bytes without end of line", pending)
+                pending = 0
+            else:
+                self.view[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+
+        size = min(self.usb.in_waiting, self.read_size) or 1
+        data = self.usb.read(size)
+        size = len(data)
+        self.view[self.end:self.end + size] = data
+        self.end += size
+        self.bytes_read.inc(size)
+        return size
+
+    def fileno(self):
+        return self.usb.fileno()
+
+    def read_available(self):
+        """Return the bytes waiting in the input buffer without blocking."""
+        data = self.usb.read(self.usb.in_waiting)
+        self.lines_read.inc(data.count(b'\n'))
+        self.bytes_read.inc(len(data))
+        return data
+
     def write(self, arg):
         self.usb.write(arg)
+
+
+class UsbReader(object):
+    """Drain a USB handler into a buffer on a dedicated thread.
+
+    Keeping the reader free of any parsing or publishing work means a slow
+    broker can no longer delay serial reads.
+    """
+
+    def __init__(self, usb_handler, buffer):
+        self.usb_handler = usb_handler
+        self.buffer = buffer
+        self.stopping = False
+
+    def __call__(self):
+        """Read lines until stopped."""
+        while not self.stopping:
+            line = self.usb_handler.readline()
+            if line:
+                self.buffer.put(line)
+
+    def stop(self):
+        log.info("Stopping USB reader thread")
+        self.stopping = True
+        self.buffer.close()
@@ -42,6 +42,9 @@ extras_require = {
     'docs': [
         'Sphinx>=1.4.2',
     ],
+    'store': [
+        'numpy>=1.8',
+    ],
     'tests': tests_require,
 }
 
@@ -60,6 +63,7 @@ install_requires = [
     'netifaces>=0.10.4',
     'pika>=0.10.0',
     'pyserial>=3.1.1',
+    'selectors2>=2.0.0; python_version < "3.4"',
 ]
 
 packages = find_packages()
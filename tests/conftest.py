@@ -23,8 +23,14 @@
 
 from __future__ import absolute_import, print_function
 
+import sys
+
 import pytest
 
+# The asyncio engine and its tests need Python 3.5 or later.
+if sys.version_info < (3, 5):
+    collect_ignore = ['test_engine.py']
+
 # @pytest.fixture()
 # def foo():
 #     """Foo fixture."""
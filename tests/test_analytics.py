@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+
+"""Analytics tests."""
+
+from __future__ import absolute_import, division, print_function
+
+import pytest
+from click.testing import CliRunner
+
+from cosmicpi_daq.analytics import RollingRate
+from cosmicpi_daq.cosmicpi import cli
+from cosmicpi_daq.detector import Sensors
+from cosmicpi_daq.event import Event
+
+np = pytest.importorskip('numpy')
+analytics = pytest.importorskip('cosmicpi_daq.analytics')
+store = pytest.importorskip('cosmicpi_daq.store')
+
+SECOND = 1000000000
+
+
+def test_binned_rates():
+    starts, counts, rates = analytics.binned_rates(
+        [0, 1, 2 * SECOND, 5 * SECOND], 2, start_ns=0, end_ns=6 * SECOND)
+    assert starts.tolist() == [0, 2 * SECOND, 4 * SECOND]
+    assert counts.tolist() == [2, 1, 1]
+    assert rates.tolist() == [1, 0.5, 0.5]
+
+
+def test_binned_means():
+    means = analytics.binned_means(
+        [0, SECOND, 4 * SECOND], [1, 3, 5], 2, 0, 3)
+    assert means[0] == 2
+    assert np.isnan(means[1])
+    assert means[2] == 5
+
+
+def test_moving_average():
+    assert analytics.moving_average([1, 2, 3, 4], 2).tolist() == [
+        1.5, 2.5, 3.5]
+    assert len(analytics.moving_average([1], 2)) == 0
+
+
+def test_fit_recovers_barometric_coefficient():
+    random = np.random.RandomState(42)
+    pressure = random.uniform(990, 1030, 2000)
+    temperature = random.uniform(10, 30, 2000)
+    expected = 10000 * np.exp(-0.002 * (pressure - 1010) +
+                              0.001 * (temperature - 20))
+    result = analytics.fit_environment(
+        random.poisson(expected), pressure, temperature,
+        reference_pressure=1010, reference_temperature=20)
+
+    assert abs(result['beta'] + 0.002) < 3 * result['beta_error']
+    assert abs(result['alpha'] - 0.001) < 3 * result['alpha_error']
+    assert abs(result['n0'] / 10000 - 1) < 0.01
+
+
+def test_fit_needs_enough_bins():
+    with pytest.raises(ValueError):
+        analytics.fit_environment([1, 2], [1000, 1001])
+
+
+def test_rolling_rate():
+    now = [0.0]
+    rates = RollingRate(bin_seconds=10, bins=2, clock=lambda: now[0])
+    sensors = Sensors()
+    sensors.update(b"{'barometer': {'pressure': 1000}}")
+    reading = Event('det', sensors)
+    sensors.update(b"{'event': {'sequence': 1}}")
+    hit = Event('det', sensors)
+
+    assert rates.summary()['rate'] is None
+    for now[0] in (1, 2, 11, 25):
+        rates.add(hit)
+    rates.add(reading)
+    now[0] = 30
+    summary = rates.summary()
+    assert summary['duration'] == 20
+    assert summary['hits'] == 2
+    assert summary['rate'] == 0.1
+    assert summary['pressure'] == 1000
+
+
+def test_rates_command(tmpdir):
+    directory = tmpdir.join('det', '2016060110')
+    directory.ensure(dir=True)
+    timestamps = 1464775200 * SECOND + np.arange(0, 20 * SECOND, SECOND // 2)
+    columns = dict((name, np.zeros(len(timestamps), dtype=dtype))
+                   for name, dtype in store.COLUMNS)
+    columns['timestamp_ns'] = timestamps
+    columns['hit'][::2] = True
+    columns['barometer.pressure'][:] = 1000
+    store.write_index(str(directory), [
+        store.save_chunk(str(directory), 0, columns)])
+
+    result = CliRunner().invoke(cli, [
+        'rates', str(tmpdir), '--bin-seconds', '10', '--moving-average', '2'])
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == [
+        'start,hits,rate,pressure,temperature,moving_average',
+        '1464775200,10,1.000000,1000.00,0.00,',
+        '1464775210,10,1.000000,1000.00,0.00,1.000000',
+    ]
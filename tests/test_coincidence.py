@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+
+"""Coincidence detection tests."""
+
+from __future__ import absolute_import, print_function
+
+from cosmicpi_daq.coincidence import (CoincidenceFinder, event_timestamp,
+                                      find_coincidences)
+
+
+def event(detector_id, second, ticks):
+    return dict(
+        detector_id=detector_id,
+        timing=dict(time_string=str(second), counter_frequency=1000),
+        event=dict(sequence=0, ticks=ticks),
+    )
+
+
+def test_event_timestamp():
+    assert event_timestamp(event('a', 10, 250)) == 10250000000
+    assert event_timestamp(dict(
+        timing=dict(time_string='2016-06-21 12:00:00', counter_frequency=0),
+    )) == 1466510400000000000
+
+
+def test_groups_need_distinct_detectors():
+    finder = CoincidenceFinder(window_ns=100)
+    assert finder.add(1000, 'a') == []
+    assert finder.add(1050, 'a') == []
+    groups = finder.add(5000, 'b')
+    assert groups == []
+    assert finder.add(5080, 'c') == []
+    groups = finder.flush()
+    assert len(groups) == 1
+    assert groups[0]['detectors'] == ['b', 'c']
+    assert (groups[0]['start'], groups[0]['end']) == (5000, 5080)
+
+
+def test_out_of_order_hits():
+    finder = CoincidenceFinder(window_ns=100, max_delay_ns=1000)
+    groups = []
+    for timestamp, detector_id in ((1050, 'b'), (1000, 'a'), (9000, 'a'),
+                                   (20000, 'a')):
+        groups.extend(finder.add(timestamp, detector_id))
+    assert [group['detectors'] for group in groups] == [['a', 'b']]
+
+
+def test_find_coincidences_across_streams():
+    streams = [
+        [event('a', 10, 1), event('a', 11, 500)],
+        [event('b', 10, 1), event('b', 12, 0)],
+    ]
+    groups = list(find_coincidences(streams, window_ns=1000))
+    assert len(groups) == 1
+    assert groups[0]['start'] == 10001000000
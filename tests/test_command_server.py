@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+
+"""Command server tests."""
+
+from __future__ import absolute_import, print_function
+
+import socket
+import threading
+
+import pytest
+
+from cosmicpi_daq.command_server import (HEADER, MAX_REQUEST, CommandServer,
+                                         encode_frame, recv_frame)
+
+
+def handle(command):
+    if command.startswith('big'):
+        return 'x' * int(command.split()[1])
+    return command.upper()
+
+
+@pytest.fixture()
+def server(tmpdir):
+    server = CommandServer(str(tmpdir.join('commands.sock')), handle,
+                           idle_timeout=0.3)
+    server.start()
+    thread = threading.Thread(target=server.serve, args=(0.05,))
+    thread.start()
+    yield server
+    server.stop()
+    thread.join()
+
+
+def connect(server):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(5)
+    sock.connect(server.path)
+    return sock
+
+
+def test_persistent_connection(server):
+    sock = connect(server)
+    sock.sendall(encode_frame('s') + encode_frame('metrics'))
+    assert recv_frame(sock) == 'S'
+    assert recv_frame(sock) == 'METRICS'
+    sock.sendall(encode_frame('rates'))
+    assert recv_frame(sock) == 'RATES'
+    sock.close()
+
+
+def test_clients_are_served_concurrently(server):
+    idle = connect(server)
+    # A partial request must not hold up other clients.
+    idle.sendall(encode_frame('detectors')[:3])
+    sock = connect(server)
+    sock.sendall(encode_frame('s'))
+    assert recv_frame(sock) == 'S'
+    idle.sendall(encode_frame('detectors')[3:])
+    assert recv_frame(idle) == 'DETECTORS'
+
+
+def test_large_responses_are_streamed(server):
+    slow = connect(server)
+    slow.sendall(encode_frame('big 4000000'))
+    sock = connect(server)
+    sock.sendall(encode_frame('s'))
+    assert recv_frame(sock) == 'S'
+    assert recv_frame(slow) == 'x' * 4000000
+
+
+def test_unframed_command(server):
+    sock = connect(server)
+    sock.sendall(b'status')
+    chunks = []
+    while True:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    assert b''.join(chunks) == b'STATUS'
+
+
+def test_idle_clients_are_disconnected(server):
+    sock = connect(server)
+    timeouts = server.timeouts.value
+    assert sock.recv(1) == b''
+    assert server.timeouts.value == timeouts + 1
+
+
+def test_oversized_requests_are_refused(server):
+    sock = connect(server)
+    sock.sendall(HEADER.pack(MAX_REQUEST + 1))
+    assert sock.recv(1) == b''
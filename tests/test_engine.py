@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+
+"""Asyncio engine tests."""
+
+from __future__ import absolute_import, print_function
+
+import pytest
+
+from cosmicpi_daq.command_server import HEADER, encode_frame
+from cosmicpi_daq.subscriptions import Subscriptions
+
+asyncio = pytest.importorskip('asyncio')
+
+from cosmicpi_daq.engine import AsyncEngine  # noqa
+
+
+class FakeUsbHandler(object):
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def read_available(self):
+        return self.chunks.pop(0)
+
+
+class FakeDetector(object):
+
+    def process_line(self, line):
+        return line
+
+
+def test_lines_are_framed_and_queued():
+    engine = AsyncEngine(
+        FakeUsbHandler([b"{'a': 1}\n{'b'", b": 2}\n{'c': 3}\n", b'']),
+        FakeDetector(), None, queue_size=2)
+
+    async def read():
+        engine.queue = asyncio.Queue(engine.queue_size)
+        closed = asyncio.get_event_loop().create_future()
+        engine.on_readable(closed)
+        engine.on_readable(closed)
+        assert not closed.done()
+        engine.on_readable(closed)
+        assert closed.done()
+        return [engine.queue.get_nowait() for _ in range(2)]
+
+    assert asyncio.new_event_loop().run_until_complete(read()) == [
+        b"{'b': 2}\n", b"{'c': 3}\n"]
+    assert engine.dropped == 1
+
+
+class FakeCommandHandler(object):
+
+    def __init__(self, subscriptions=None):
+        self.subscriptions = subscriptions
+
+    def handle_command(self, command):
+        return command.upper()
+
+
+def test_command_clients(tmpdir):
+    path = str(tmpdir.join('commands.sock'))
+    engine = AsyncEngine(None, FakeDetector(), FakeCommandHandler())
+
+    async def run():
+        server = await asyncio.start_unix_server(engine.handle_client, path)
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(encode_frame('s') + encode_frame('rates'))
+        responses = []
+        for _ in range(2):
+            size, = HEADER.unpack(await reader.readexactly(HEADER.size))
+            responses.append(await reader.readexactly(size))
+        writer.close()
+
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(b'metrics')
+        responses.append(await reader.read())
+        writer.close()
+        server.close()
+        return responses
+
+    assert asyncio.new_event_loop().run_until_complete(run()) == [
+        b'S', b'RATES', b'METRICS']
+
+
+def test_subscribers_receive_status(tmpdir):
+    path = str(tmpdir.join('commands.sock'))
+    subscriptions = Subscriptions(
+        status=lambda: {'det': dict(published=3)}, status_interval=0.05)
+    engine = AsyncEngine(None, FakeDetector(),
+                         FakeCommandHandler(subscriptions))
+
+    async def receive(reader):
+        size, = HEADER.unpack(await reader.readexactly(HEADER.size))
+        return await reader.readexactly(size)
+
+    async def run():
+        server = await asyncio.start_unix_server(engine.handle_client, path)
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(encode_frame('subscribe monitor'))
+        responses = [await receive(reader), await receive(reader)]
+        writer.close()
+        for _ in range(100):
+            if not subscriptions.subscribers:
+                break
+            await asyncio.sleep(0.01)
+        server.close()
+        return responses, subscriptions.subscribers
+
+    responses, subscribers = asyncio.new_event_loop().run_until_complete(
+        run())
+    assert responses == [
+        b'Subscribed to monitor\n',
+        b'{"type": "monitor", "detectors": {"det": {"published": 3}}}']
+    assert subscribers == []
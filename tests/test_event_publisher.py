@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+
+"""Event publisher tests."""
+
+from __future__ import absolute_import, print_function
+
+import json
+
+import pika
+import pytest
+
+from cosmicpi_daq.event_publisher import (Backoff, EventPublisher,
+                                          PublisherPool)
+from cosmicpi_daq.metrics import REGISTRY
+
+
+class FakeChannel(object):
+
+    def __init__(self):
+        self.published = []
+        self.confirming = False
+        self.is_open = True
+        self.nack = False
+
+    def exchange_declare(self, **kwargs):
+        pass
+
+    def confirm_delivery(self):
+        self.confirming = True
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        # Like pika 0.x, confirmed publishes return whether they were acked.
+        if self.nack:
+            return False
+        self.published.append((body, properties))
+        return True if self.confirming else None
+
+
+class FakeConnection(object):
+
+    def __init__(self, parameters):
+        self._channel = FakeChannel()
+        self.is_open = True
+
+    def channel(self):
+        return self._channel
+
+    def process_data_events(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+@pytest.fixture()
+def fake_pika(monkeypatch):
+    """Replace the blocking AMQP connection with an in-memory one."""
+    monkeypatch.setattr(pika, 'BlockingConnection', FakeConnection)
+
+
+def test_unbatched_publish(fake_pika):
+    publisher = EventPublisher('amqp://localhost')
+    publisher.send_event_pkt(b'{}')
+    assert len(publisher.channel.published) == 1
+    assert not publisher.channel.confirming
+    body, properties = publisher.channel.published[0]
+    assert body == b'{}'
+    assert properties.content_type == 'application/json'
+
+
+def test_publishers_have_their_own_metrics(fake_pika):
+    main = EventPublisher('amqp://localhost', connection_id=7)
+    sink = EventPublisher('amqp://other', labels=dict(sink='amqp-test'))
+    assert sink.messages is not main.messages
+    assert sink.latency is not main.latency
+    sink.send_event_pkt(b'{}')
+    assert 'cosmicpi_publisher_messages_total{sink="amqp-test"} 1' in \
+        REGISTRY.render()
+    REGISTRY.remove(connection=7)
+    REGISTRY.remove(sink='amqp-test')
+
+
+def test_batch_flushes_when_full(fake_pika):
+    publisher = EventPublisher('amqp://localhost', batch_size=3)
+    assert publisher.channel.confirming
+
+    for pkt in (b'1', b'2', b'3', b'4'):
+        publisher.send_event_pkt(pkt)
+
+    assert len(publisher.channel.published) == 1
+    body, properties = publisher.channel.published[0]
+    assert json.loads(body.decode('utf-8')) == [1, 2, 3]
+    assert properties.headers == {'batch_size': 3}
+
+    channel, connection = publisher.channel, publisher.connection
+    publisher.close()
+    assert json.loads(channel.published[1][0].decode('utf-8')) == [4]
+    assert not connection.is_open
+
+
+def test_batch_flushes_after_interval(fake_pika):
+    publisher = EventPublisher(
+        'amqp://localhost', batch_size=100, flush_interval_ms=0)
+    publisher.send_event_pkt(b'1')
+    assert len(publisher.channel.published) == 1
+
+
+def test_failed_batch_is_retried(fake_pika):
+    publisher = EventPublisher('amqp://localhost', batch_size=2)
+
+    def nack(*args, **kwargs):
+        raise RuntimeError('nacked')
+
+    publisher.channel.basic_publish = nack
+    publisher.send_event_pkt(b'1')
+    with pytest.raises(RuntimeError):
+        publisher.send_event_pkt(b'2')
+    assert publisher.batch == [b'1', b'2']
+
+
+def test_nacked_batch_is_kept(fake_pika):
+    publisher = EventPublisher('amqp://localhost', batch_size=2)
+    messages = publisher.messages.value
+    publisher.channel.nack = True
+    publisher.send_event_pkt(b'1')
+    with pytest.raises(IOError):
+        publisher.send_event_pkt(b'2')
+    assert publisher.batch == [b'1', b'2']
+    assert publisher.messages.value == messages
+
+    publisher.channel.nack = False
+    publisher.flush()
+    assert json.loads(
+        publisher.channel.published[0][0].decode('utf-8')) == [1, 2]
+    assert publisher.messages.value == messages + 1
+
+
+def test_failed_event_is_published_after_reconnecting(fake_pika):
+    publisher = EventPublisher('amqp://localhost', backoff=Backoff(jitter=0))
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('connection lost')
+
+    publisher.channel.basic_publish = fail
+    with pytest.raises(RuntimeError):
+        publisher.send_event_pkt(b'1')
+    publisher.disconnect()
+    assert not publisher.connected
+    assert list(publisher.backlog) == [b'1']
+
+    reconnects = publisher.reconnects.value
+    assert publisher.service()
+    assert publisher.reconnects.value == reconnects + 1
+    assert [body for body, _ in publisher.channel.published] == [b'1']
+    assert not publisher.backlog
+
+
+def test_full_backlog_drops_are_counted(fake_pika):
+    publisher = EventPublisher('amqp://localhost', backlog_size=2)
+    publisher.channel.nack = True
+    for pkt in (b'1', b'2', b'3'):
+        with pytest.raises(IOError):
+            publisher.send_event_pkt(pkt)
+    assert list(publisher.backlog) == [b'2', b'3']
+    assert publisher.backlog_dropped == 1
+
+
+def test_reconnect_backs_off(fake_pika, monkeypatch):
+    publisher = EventPublisher(
+        'amqp://localhost', connect=False, backoff=Backoff(jitter=0))
+    attempts = []
+
+    def refuse():
+        attempts.append(publisher.next_attempt)
+        raise RuntimeError('connection refused')
+
+    monkeypatch.setattr(publisher, 'open_connection', refuse)
+    assert not publisher.service()
+    assert not publisher.service()
+    assert len(attempts) == 1
+
+    publisher.next_attempt = 0
+    assert not publisher.service()
+    assert len(attempts) == 2
+    assert publisher.backoff.attempts == 2
+    assert publisher.outage_started is not None
+
+
+def test_backoff():
+    backoff = Backoff(initial=1, maximum=5, jitter=0)
+    assert [backoff.next() for _ in range(5)] == [1, 2, 4, 5, 5]
+    backoff.reset()
+    assert backoff.next() == 1
+
+    backoff = Backoff(initial=10, jitter=0.5)
+    assert 5 <= backoff.next() <= 10
+
+
+def test_pool_hands_out_publishers_in_turn():
+    pool = PublisherPool(lambda connection_id: connection_id, size=2)
+    assert [pool.get() for _ in range(5)] == [0, 1, 0, 1, 0]
+    assert pool.publishers == [0, 1]
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+
+"""Logging handler tests."""
+
+from __future__ import absolute_import, print_function
+
+import logging
+import threading
+
+from cosmicpi_daq.log_handlers import AsyncHandler, EventLogFilter
+
+
+class Formatted(object):
+    """Record the threads on which the object is formatted."""
+
+    def __init__(self):
+        self.threads = []
+
+    def __str__(self):
+        self.threads.append(threading.current_thread().name)
+        return 'formatted'
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+
+def make_logger(name, handler):
+    log = logging.getLogger('cosmicpi.daq.test.' + name)
+    log.propagate = False
+    log.setLevel(logging.INFO)
+    log.addHandler(handler)
+    return log
+
+
+def test_formatting_is_deferred_to_the_writer_thread():
+    target = ListHandler()
+    handler = AsyncHandler(target)
+    log = make_logger('async', handler)
+    value = Formatted()
+
+    log.debug('Value: %s', value)
+    log.info('Value: %s', value)
+    handler.close()
+
+    assert target.messages == ['Value: formatted']
+    assert value.threads == ['log-writer']
+
+
+def test_full_queue_drops_records():
+    release = threading.Event()
+
+    class SlowHandler(ListHandler):
+
+        def emit(self, record):
+            release.wait()
+            ListHandler.emit(self, record)
+
+    target = SlowHandler()
+    handler = AsyncHandler(target, capacity=1)
+    log = make_logger('full', handler)
+    for index in range(5):
+        log.info('Record %d', index)
+    release.set()
+    handler.close()
+
+    assert handler.dropped >= 3
+    assert len(target.messages) == 5 - handler.dropped
+
+
+def test_sampling():
+    log_filter = EventLogFilter(rate=0, sample_every=3)
+    record = logging.makeLogRecord({})
+    assert [log_filter.filter(record) for _ in range(6)] == [
+        False, False, True, False, False, True]
+    assert log_filter.suppressed == 4
+
+
+def test_rate_limit():
+    log_filter = EventLogFilter(rate=0.001, burst=2)
+    record = logging.makeLogRecord({})
+    assert [log_filter.filter(record) for _ in range(4)] == [
+        True, True, False, False]
+    assert log_filter.suppressed == 2
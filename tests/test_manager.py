@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+
+"""Detector manager tests."""
+
+from __future__ import absolute_import, print_function
+
+import pytest
+
+from cosmicpi_daq.manager import DetectorManager
+
+
+class FakePipeline(object):
+
+    def __init__(self, device, detector_id):
+        self.device = device
+        self.detector_id = detector_id
+        self.running = False
+
+    def start(self):
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+
+def test_hotplug(tmpdir):
+    tmpdir.join('ttyACM0').write('')
+    manager = DetectorManager([str(tmpdir.join('ttyACM*'))], FakePipeline)
+    assert manager.multiple
+
+    manager.scan()
+    first = manager.primary
+    assert first.running
+    assert first.detector_id.endswith('-ttyACM0')
+
+    tmpdir.join('ttyACM1').write('')
+    manager.scan()
+    assert len(manager.pipelines) == 2
+
+    tmpdir.join('ttyACM0').remove()
+    manager.scan()
+    assert not first.running
+    assert list(manager.pipelines) == [str(tmpdir.join('ttyACM1'))]
+
+    manager.stop()
+    assert not manager.pipelines
+
+
+def test_single_device_uses_host_id():
+    manager = DetectorManager(['/dev/ttyACM0'], FakePipeline)
+    assert not manager.multiple
+    manager.scan()
+    assert manager.primary.detector_id == manager.host_id
+
+
+def test_boards_are_identified_by_serial_number(tmpdir):
+    tmpdir.join('ttyACM1').write('')
+    manager = DetectorManager(
+        [str(tmpdir.join('ttyACM*'))], FakePipeline,
+        ports=lambda: {str(tmpdir.join('ttyACM1')): '7543931383335'})
+    manager.scan()
+    assert manager.primary.detector_id == \
+        manager.host_id + '-7543931383335'
+
+
+def test_failing_pipelines_are_retried(tmpdir):
+    tmpdir.join('ttyACM0').write('')
+    failures = [OSError('permission denied')]
+
+    def factory(device, detector_id):
+        if failures:
+            raise failures.pop()
+        return FakePipeline(device, detector_id)
+
+    manager = DetectorManager([str(tmpdir.join('ttyACM*'))], factory)
+    manager.scan()
+    assert not manager.pipelines
+    manager.scan()
+    assert manager.primary.running
+
+    failures.append(OSError('permission denied'))
+    tmpdir.join('ttyACM1').write('')
+    with pytest.raises(OSError):
+        manager.scan(strict=True)
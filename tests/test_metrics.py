@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+
+"""Metrics tests."""
+
+from __future__ import absolute_import, print_function
+
+from contextlib import closing
+
+try:
+    from urllib.request import urlopen
+except ImportError:  # Python 2
+    from urllib2 import urlopen
+
+from cosmicpi_daq.command_handler import CommandHandler
+from cosmicpi_daq.detector import Detector
+from cosmicpi_daq.metrics import REGISTRY, MetricsServer, Registry
+from cosmicpi_daq.spool import MemorySpool
+
+
+def test_render():
+    registry = Registry()
+    registry.counter('lines_total', 'Lines read.', device='a').inc(3)
+    registry.gauge('depth', 'Queue depth.').set(2)
+    registry.callback('missed', 'Missed events.', lambda: 7, device='a')
+
+    assert registry.render().splitlines() == [
+        '# HELP depth Queue depth.',
+        '# TYPE depth gauge',
+        'depth 2',
+        '# HELP lines_total Lines read.',
+        '# TYPE lines_total counter',
+        'lines_total{device="a"} 3',
+        '# HELP missed Missed events.',
+        '# TYPE missed gauge',
+        'missed{device="a"} 7',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram('latency', 'Latency.', buckets=(1, 2))
+    for value in (0.5, 1, 1.5, 3):
+        histogram.observe(value)
+
+    lines = registry.render().splitlines()[2:]
+    assert lines == [
+        'latency_bucket{le="1"} 2',
+        'latency_bucket{le="2"} 3',
+        'latency_bucket{le="+Inf"} 4',
+        'latency_sum 6.0',
+        'latency_count 4',
+    ]
+
+
+def test_remove_by_label():
+    registry = Registry()
+    registry.counter('lines_total', 'Lines read.', device='a').inc()
+    registry.counter('lines_total', 'Lines read.', device='b').inc()
+    registry.remove(device='a')
+    assert 'device="a"' not in registry.render()
+    assert 'device="b"' in registry.render()
+
+
+def test_http_endpoint():
+    registry = Registry()
+    registry.counter('lines_total', 'Lines read.').inc()
+    server = MetricsServer(0, registry=registry)
+    server.start()
+    try:
+        url = 'http://127.0.0.1:{0}/metrics'.format(server.port)
+        with closing(urlopen(url)) as response:
+            assert b'lines_total 1' in response.read()
+    finally:
+        server.stop()
+
+
+def test_detector_metrics_on_command_socket():
+    detector = Detector(None, None, False, detector_id='metrics-test')
+    detector.process_line(b"{'status': {'missed_events': 4}}")
+    detector.process_line(b'garbage')
+
+    handler = CommandHandler(detector, None, None)
+    response = handler.handle_command('metrics')
+    assert 'cosmicpi_events_total{detector="metrics-test"} 1' in response
+    assert 'cosmicpi_parse_failures_total{detector="metrics-test"} 1' \
+        in response
+    assert 'cosmicpi_arduino_missed_events{detector="metrics-test"} 4' \
+        in response
+    REGISTRY.remove(detector='metrics-test')
+
+
+def test_failing_lines_are_skipped():
+    class BrokenSerializer(object):
+        def dumps(self, event):
+            raise RuntimeError('broken')
+
+    detector = Detector(None, None, False, detector_id='errors-test',
+                        serializer=BrokenSerializer())
+    detector.handle_line(b"{'vibration': {'count': 1}}")
+    detector.handle_line(b"{'vibration': {'count': 2}}")
+    assert detector.events_total.value == 2
+    assert detector.line_errors.value == 2
+    REGISTRY.remove(detector='errors-test')
+
+
+def test_failed_publishes_are_not_counted():
+    class FailingPublisher(object):
+        connected = True
+
+        def send_event_pkt(self, data):
+            raise IOError('rejected')
+
+        def disconnect(self):
+            pass
+
+    detector = Detector(None, FailingPublisher(), False,
+                        detector_id='unpublished-test', spool=MemorySpool(1))
+    detector.publish(b'1')
+    detector.spool.append(b'2')
+    detector.spool.append(b'3')
+    assert detector.published.value == 0
+    assert 'cosmicpi_spool_dropped_total{detector="unpublished-test"} 1' \
+        in REGISTRY.render()
+    REGISTRY.remove(detector='unpublished-test')
+
+
+def test_status_command():
+    class FakeUsbHandler(object):
+        usbdev = '/dev/ttyACM0'
+
+    detector = Detector(None, None, False, detector_id='status-test')
+    response = CommandHandler(
+        detector, FakeUsbHandler(), None).handle_command('s')
+    assert 'usb_handler device....: /dev/ttyACM0' in response
+    assert 'Events........: Sent:0 Spooled:0' in response
+    REGISTRY.remove(detector='status-test')
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+
+"""Line parser tests."""
+
+from __future__ import absolute_import, print_function
+
+from cosmicpi_daq.detector import Sensors
+
+
+def test_parse_typed_values():
+    sensors = Sensors()
+    group = sensors.update(
+        b"{'barometer': {'temperature': '21.5', 'pressure': 1013.25, "
+        b"'altitude': '120.0'}}\n")
+    assert group == 'barometer'
+    assert sensors.barometer == (21.5, 1013.25, 120.0)
+    assert isinstance(sensors.barometer.pressure, float)
+
+
+def test_parse_strings_and_ints():
+    sensors = Sensors()
+    sensors.update(b"{'timing': {'uptime': '42', 'counter_frequency': "
+                   b"'42000000', 'time_string': '12:34:56'}}")
+    assert sensors.timing == (42, 42000000, '12:34:56')
+
+
+def test_event_line():
+    sensors = Sensors()
+    assert sensors.update(b"{'event': {'sequence': 7, 'ticks': 1234}}") == \
+        'event'
+    assert sensors.event.sequence == 7
+    assert sensors.event.ticks == 1234
+
+    sensors.update(b"{'vibration': {'count': 3}}")
+    assert sensors.event is None
+
+
+def test_malformed_lines_are_counted():
+    sensors = Sensors()
+    for line in (b'', b'garbage', b"{'nope': {'x': 1}}",
+                 b"{'vibration': {'count': 'abc'}}",
+                 b"{'vibration': {'count': 1}"):
+        assert sensors.update(line) is None
+    assert sensors.parser.malformed == 5
+    assert sensors.vibration == (0, 0)
+
+
+def test_out_of_range_values_are_malformed():
+    sensors = Sensors()
+    for line in (b"{'status': {'queue_size': -1}}",
+                 b"{'status': {'queue_size': 4294967296}}",
+                 b"{'vibration': {'direction': 2147483648}}",
+                 b"{'event': {'ticks': 'inf'}}",
+                 b"{'barometer': {'pressure': 1e39}}"):
+        assert sensors.update(line) is None
+    assert sensors.parser.malformed == 5
+    assert sensors.update(b"{'status': {'queue_size': 4294967295}}")
+    assert sensors.update(b"{'vibration': {'direction': -2147483648}}")
+
+
+def test_unknown_fields_are_ignored():
+    sensors = Sensors()
+    assert sensors.update(b"{'vibration': {'count': 3, 'foo': 1}}")
+    assert sensors.vibration.count == 3
+    assert sensors.parser.unknown_fields == 1
+
+
+def test_unchanged_records_are_shared():
+    sensors = Sensors()
+    before = sensors.barometer, sensors.vibration
+    sensors.update(b"{'vibration': {'count': 3}}")
+    assert sensors.barometer is before[0]
+    assert sensors.vibration is not before[1]
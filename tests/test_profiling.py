@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+
+"""Profiling tests."""
+
+from __future__ import absolute_import, print_function
+
+import json
+
+from cosmicpi_daq.detector import Detector
+from cosmicpi_daq.metrics import REGISTRY
+from cosmicpi_daq.profiling import Profiler
+
+
+def test_traces_are_sampled(tmpdir):
+    path = str(tmpdir.join('trace.json'))
+    profiler = Profiler(path, sample_every=2)
+    inner = profiler.wrap('inner', lambda value: value * 2, test='trace')
+    outer = profiler.wrap('outer', lambda value: inner(value) + 1,
+                          root=True, test='trace')
+
+    assert [outer(value) for value in range(4)] == [1, 3, 5, 7]
+    profiler.close()
+
+    events = json.load(open(path))
+    assert [event['ph'] for event in events] == ['M', 'X', 'X', 'X', 'X']
+    spans = [event for event in events if event['ph'] == 'X']
+    assert [span['name'] for span in spans] == [
+        'inner', 'outer', 'inner', 'outer']
+    assert spans[1]['ts'] <= spans[0]['ts']
+    assert spans[1]['dur'] >= spans[0]['dur']
+    assert set(profiler.summary()) == {'inner', 'outer'}
+    REGISTRY.remove(test='trace')
+
+
+def test_detector_stages():
+    profiler = Profiler()
+    detector = Detector(None, None, False, detector_id='profile-test',
+                        profiler=profiler)
+    detector.handle_line(b"{'vibration': {'direction': 1, 'count': 2}}")
+    detector.handle_line(b'garbage')
+
+    counts = dict((key[0], histogram.count)
+                  for key, histogram in profiler.histograms.items())
+    assert counts == dict(line=2, parse=2, event=1, log=1, serialize=1,
+                          publish=1)
+    REGISTRY.remove(detector='profile-test')
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+
+"""Serial recording and replay tests."""
+
+from __future__ import absolute_import, print_function
+
+from cosmicpi_daq.recording import (RecordingUsbHandler, ReplayUsbHandler,
+                                    read_recording)
+
+
+class FakeUsbHandler(object):
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+        self.enabled = True
+
+    def readline(self):
+        return self.lines.pop(0) if self.lines else b''
+
+    def close(self):
+        pass
+
+
+def test_record_and_replay(tmpdir):
+    path = str(tmpdir.join('run.rec'))
+    lines = [b"{'vibration': {'count': %d}}\n" % i for i in range(5)]
+
+    handler = RecordingUsbHandler(FakeUsbHandler(lines), path)
+    assert handler.enabled
+    assert [handler.readline() for _ in range(6)] == lines + [b'']
+    handler.close()
+
+    records = list(read_recording(path))
+    assert [line for _, line in records] == lines
+    assert [t for t, _ in records] == sorted(t for t, _ in records)
+
+    replay = ReplayUsbHandler(path, speed=0)
+    assert [replay.readline() for _ in range(5)] == lines
+    assert not replay.finished
+    assert replay.readline() == b''
+    assert replay.finished
+
+
+def test_recordings_are_appended(tmpdir):
+    path = str(tmpdir.join('run.rec'))
+    first = [b"{'vibration': {'count': 1}}\n"]
+    second = [b"{'vibration': {'count': 2}}\n"]
+
+    for lines in (first, second):
+        handler = RecordingUsbHandler(FakeUsbHandler(lines), path)
+        handler.readline()
+        handler.close()
+
+    records = list(read_recording(path))
+    assert [line for _, line in records] == first + second
+    assert records[0][0] <= records[1][0]
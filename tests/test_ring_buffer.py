@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+
+"""Ring buffer tests."""
+
+from __future__ import absolute_import, print_function
+
+import pytest
+
+from cosmicpi_daq.ring_buffer import RingBuffer, SpillFile
+
+
+def test_drop_oldest():
+    buffer = RingBuffer(2)
+    for item in (b'a', b'b', b'c'):
+        assert buffer.put(item)
+
+    assert buffer.get() == b'b'
+    assert buffer.get() == b'c'
+    assert buffer.get(timeout=0) is None
+    assert buffer.stats()['dropped'] == 1
+    assert buffer.stats()['high_water_mark'] == 2
+
+
+def test_block_times_out():
+    buffer = RingBuffer(1, overflow='block')
+    assert buffer.put(b'a')
+    assert not buffer.put(b'b', timeout=0.01)
+    assert buffer.dropped == 1
+
+
+def test_spill_preserves_order(tmpdir):
+    spill = SpillFile(str(tmpdir.join('spill')))
+    buffer = RingBuffer(2, overflow='spill', spill=spill)
+    for item in (b'a', b'b', b'c', b'd'):
+        buffer.put(item)
+
+    assert buffer.get() == b'a'
+    buffer.put(b'e')
+    assert [buffer.get() for _ in range(4)] == [b'b', b'c', b'd', b'e']
+    assert buffer.spilled == 3
+    assert not len(buffer)
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        RingBuffer(1, overflow='spill')
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+
+"""Serializer tests."""
+
+from __future__ import absolute_import, print_function
+
+import json
+
+import pytest
+
+from cosmicpi_daq.detector import Sensors
+from cosmicpi_daq.event import Event
+from cosmicpi_daq.schema import SENSORS
+from cosmicpi_daq.serializers import DeltaDecoder, get_serializer
+
+
+@pytest.fixture()
+def event():
+    sensors = Sensors()
+    sensors.update(b"{'barometer': {'pressure': '1013.5'}}")
+    sensors.update(b"{'timing': {'time_string': '12:34:56'}}")
+    return Event('b8:27:eb:00:00:01', sensors)
+
+
+@pytest.mark.parametrize('name', ['json', 'binary', 'delta'])
+def test_round_trip(name, event):
+    serializer = get_serializer(name)
+    decoded = serializer.loads(serializer.dumps(event))
+    assert decoded['detector_id'] == 'b8:27:eb:00:00:01'
+    assert decoded['barometer']['pressure'] == 1013.5
+    assert decoded['timing']['time_string'] == '12:34:56'
+
+
+@pytest.mark.parametrize('name', ['json', 'binary', 'delta'])
+def test_batch_round_trip(name, event):
+    serializer = get_serializer(name)
+    payload = serializer.dumps(event)
+    events = serializer.loads_batch(serializer.dumps_batch([payload] * 3))
+    assert len(events) == 3
+
+
+def test_binary_is_compact(event):
+    json_size = len(get_serializer('json').dumps(event))
+    binary_size = len(get_serializer('binary').dumps(event))
+    assert binary_size * 3 < json_size
+
+
+def test_timestamps_round_trip(event):
+    for name in ('json', 'binary', 'delta'):
+        serializer = get_serializer(name)
+        decoded = serializer.loads(serializer.dumps(event))
+        assert decoded['timestamp_ns'] == event.timestamp_ns
+        assert decoded['gps'] is False
+        assert decoded['date'] == event.date
+
+
+def test_binary_decodes_version_1(event):
+    serializer = get_serializer('binary')
+    payload = serializer.dumps(event)
+    offset = 2 + len(event.detector_id)
+    date = b'Tue Jun 21 12:00:00 2016'
+    decoded = serializer.loads(
+        b'\x01' + payload[1:offset] + bytearray([len(date)]) + date +
+        payload[offset + serializer.timestamp.size:])
+    assert decoded['date'] == {'date': date.decode('ascii')}
+    assert decoded['barometer']['pressure'] == 1013.5
+
+
+def test_binary_rejects_unknown_version(event):
+    serializer = get_serializer('binary')
+    payload = serializer.dumps(event)
+    with pytest.raises(ValueError):
+        serializer.loads(b'\xff' + payload[1:])
+
+
+def test_binary_event_record():
+    sensors = Sensors()
+    sensors.update(b"{'event': {'sequence': 3, 'ticks': 99}}")
+    serializer = get_serializer('binary')
+    decoded = serializer.loads(serializer.dumps(Event('id', sensors)))
+    assert decoded['event'] == {'sequence': 3, 'ticks': 99}
+
+
+def test_delta_sends_changed_fields():
+    sensors = Sensors()
+    serializer = get_serializer('delta')
+    json_serializer = get_serializer('json')
+    lines = [
+        b"{'barometer': {'pressure': '1013.5', 'temperature': 20}}",
+        b"{'event': {'sequence': 1, 'ticks': 5}}",
+        b"{'barometer': {'pressure': '1013.7', 'temperature': 20}}",
+    ]
+    payloads = []
+    for line in lines:
+        sensors.update(line)
+        event = Event('id', sensors)
+        payloads.append(serializer.dumps(event))
+        # The decoder rebuilds the complete state.
+        assert serializer.loads(payloads[-1]) == \
+            json_serializer.loads(json_serializer.dumps(event))
+
+    keyframe, hit, change = [json.loads(payload.decode('utf-8'))
+                             for payload in payloads]
+    assert keyframe['keyframe'] and keyframe['sequence'] == 0
+    assert len(keyframe['changes']) == len(SENSORS)
+    assert hit['sequence'] == 1 and hit['changes'] == {}
+    assert hit['event'] == {'sequence': 1, 'ticks': 5}
+    assert change['changes'] == {'barometer': {'pressure': 1013.7}}
+    assert len(payloads[2]) * 4 < len(json_serializer.dumps(event))
+    assert serializer.decoder.gaps == 0
+
+
+def test_delta_keyframes_recover_from_gaps():
+    sensors = Sensors()
+    serializer = get_serializer('delta', keyframe_interval=4)
+    decoder = DeltaDecoder()
+    payloads = []
+    for index in range(8):
+        line = "{{'vibration': {{'count': {0}}}}}".format(index)
+        sensors.update(line.encode('ascii'))
+        payloads.append(json.loads(
+            serializer.dumps(Event('id', sensors)).decode('utf-8')))
+    assert [bool(message.get('keyframe')) for message in payloads] == \
+        [True, False, False, False, True, False, False, False]
+
+    del payloads[2]
+    decoded = [decoder.decode(message) for message in payloads]
+    assert [event and event['vibration']['count'] for event in decoded] == \
+        [0, 1, None, 4, 5, 6, 7]
+    assert decoder.gaps == 1
+
+    assert decoder.decode(payloads[-1]) is None
+    assert decoder.duplicates == 1
+
+    serializer.dumps(Event('id', sensors))
+    with pytest.raises(ValueError):
+        get_serializer('delta').loads(
+            serializer.dumps(Event('id', sensors)))
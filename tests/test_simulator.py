@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+
+"""Simulator tests."""
+
+from __future__ import absolute_import, print_function
+
+import pytest
+
+from cosmicpi_daq.detector import Sensors
+from cosmicpi_daq.recording import read_recording
+from cosmicpi_daq.simulator import LineGenerator, parse_mix, write_recording
+
+
+def test_generated_lines_parse():
+    sensors = Sensors()
+    lines = LineGenerator(seed=1).lines(500)
+    groups = set(sensors.update(line) for line in lines)
+    assert sensors.parser.malformed == 0
+    assert 'event' in groups and 'status' in groups
+
+
+def test_mix():
+    lines = LineGenerator(parse_mix('cosmic=1')).lines(10)
+    assert all(line.startswith(b"{'event'") for line in lines)
+    with pytest.raises(ValueError):
+        parse_mix('nope=1')
+
+
+def test_write_recording(tmpdir):
+    path = str(tmpdir.join('sim.rec'))
+    write_recording(path, [b'a\n', b'b\n'], rate=10)
+    assert list(read_recording(path)) == [(0, b'a\n'), (100000000, b'b\n')]
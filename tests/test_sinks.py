@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+
+"""Output sink tests."""
+
+from __future__ import absolute_import, print_function
+
+import gzip
+import socket
+import threading
+
+import pytest
+
+from cosmicpi_daq.serializers import BinarySerializer, JsonSerializer
+from cosmicpi_daq.sinks import (FRAME, FileSink, QueuedSink, Sink, UdpSink,
+                                UnixSocketSink, create_sink)
+
+
+class ListSink(Sink):
+
+    name = 'list'
+
+    def __init__(self, release=None):
+        self.sent = []
+        self.release = release
+
+    def send(self, data):
+        if self.release is not None:
+            self.release.wait()
+        self.sent.append(data)
+
+
+def test_file_sink_rotates(tmpdir):
+    sink = FileSink(str(tmpdir), JsonSerializer(), max_bytes=4)
+    for data in (b'{"a": 1}', b'{"b": 2}'):
+        sink.send(data)
+    sink.close()
+
+    paths = sorted(tmpdir.listdir())
+    assert [path.basename[-14:] for path in paths] == [
+        '-0000.jsonl.gz', '-0001.jsonl.gz']
+    with gzip.open(str(paths[1])) as f:
+        assert f.read() == b'{"b": 2}\n'
+
+
+def test_binary_file_sink_frames_events(tmpdir):
+    sink = FileSink(str(tmpdir), BinarySerializer())
+    sink.send(b'\x01\x02')
+    sink.close()
+    assert sink.path.endswith('.bin.gz')
+    with gzip.open(sink.path) as f:
+        assert f.read() == FRAME.pack(2) + b'\x01\x02'
+
+
+def test_udp_sink():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.settimeout(1)
+    sink = create_sink(
+        'udp://127.0.0.1:{0}'.format(receiver.getsockname()[1]), None)
+    assert isinstance(sink, UdpSink)
+    sink.send(b'event')
+    assert receiver.recv(100) == b'event'
+    sink.close()
+    receiver.close()
+
+
+def test_unix_socket_sink(tmpdir):
+    path = str(tmpdir.join('events.sock'))
+    sink = UnixSocketSink(path)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(path)
+    client.settimeout(1)
+    sink.send(b'event')
+    assert client.recv(100) == FRAME.pack(5) + b'event'
+    assert 'clients:1' in sink.status()
+
+    client.close()
+    sink.close()
+
+
+def test_slow_sink_does_not_stall_others():
+    release = threading.Event()
+    slow = QueuedSink(ListSink(release), capacity=2, label='slow')
+    fast = QueuedSink(ListSink(), capacity=2, label='fast')
+    for sink in (slow, fast):
+        sink.start()
+
+    for index in range(5):
+        data = str(index).encode('ascii')
+        slow.put(data)
+        fast.put(data)
+        while len(fast.buffer):
+            pass
+    fast.stop()
+    release.set()
+    slow.stop()
+
+    assert fast.sink.sent == [b'0', b'1', b'2', b'3', b'4']
+    assert slow.buffer.dropped >= 1
+    assert slow.sink.sent[-2:] == [b'3', b'4']
+
+
+def test_unsupported_sink():
+    with pytest.raises(ValueError):
+        create_sink('mqtt://localhost', None)
+
+
+def test_sink_paths_must_be_absolute():
+    for uri in ('file://events', 'unix://sock', 'file://', 'unix:'):
+        with pytest.raises(ValueError):
+            create_sink(uri, None)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+
+"""Spool tests."""
+
+from __future__ import absolute_import, print_function
+
+import os
+
+import pytest
+
+from cosmicpi_daq.spool import MemorySpool, Spool
+
+
+def test_fifo_across_segments(tmpdir):
+    spool = Spool(str(tmpdir), segment_size=64, max_size=1024)
+    payloads = [('event %d' % i).encode('utf-8') for i in range(20)]
+    for payload in payloads:
+        spool.append(payload)
+
+    assert len(spool) == 20
+    assert len(os.listdir(str(tmpdir))) > 1
+    assert spool.peek() == payloads[0]
+    assert [spool.pop() for _ in range(20)] == payloads
+    assert len(os.listdir(str(tmpdir))) == 1
+
+
+def test_reopen_resumes(tmpdir):
+    spool = Spool(str(tmpdir), segment_size=64)
+    for payload in (b'a', b'b', b'c'):
+        spool.append(payload)
+    spool.pop()
+    spool.close()
+
+    spool = Spool(str(tmpdir), segment_size=64)
+    assert len(spool) == 2
+    assert spool.pop() == b'b'
+
+
+def test_max_size_drops_oldest(tmpdir):
+    spool = Spool(str(tmpdir), segment_size=64, max_size=128)
+    for i in range(30):
+        spool.append(b'0123456789')
+
+    assert len(os.listdir(str(tmpdir))) == 2
+    assert spool.dropped
+    assert len(spool) + spool.dropped == 30
+
+
+def test_memory_spool_drops_oldest():
+    spool = MemorySpool(capacity=2)
+    for payload in (b'a', b'b', b'c'):
+        spool.append(payload)
+
+    assert len(spool) == 2
+    assert spool.dropped == 1
+    assert spool.peek() == b'b'
+    assert [spool.pop(), spool.pop()] == [b'b', b'c']
+    with pytest.raises(IndexError):
+        spool.pop()
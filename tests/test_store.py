@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+
+"""Event store tests."""
+
+from __future__ import absolute_import, print_function
+
+import pytest
+from click.testing import CliRunner
+
+from cosmicpi_daq.cosmicpi import cli
+from cosmicpi_daq.detector import Sensors
+from cosmicpi_daq.event import Event
+from cosmicpi_daq.timing import BoardClock
+
+np = pytest.importorskip('numpy')
+store = pytest.importorskip('cosmicpi_daq.store')
+
+#: 2016-06-01T10:59:59 UTC.
+T0 = 1464778799
+
+
+def make_events():
+    """Return events around an hour boundary, with a pressure ramp."""
+    sensors = Sensors()
+    clock = BoardClock()
+    sensors.update(b"{'timing': {'counter_frequency': 1000}}")
+    events = []
+    for index in range(6):
+        sensors.update("{{'timing': {{'time_string': '{0}'}}}}".format(
+            T0 + index // 2).encode('ascii'))
+        sensors.update("{{'barometer': {{'pressure': {0}}}}}".format(
+            1000 + index).encode('ascii'))
+        if index % 2:
+            sensors.update("{{'event': {{'sequence': {0}, 'ticks': 500}}}}"
+                           .format(index).encode('ascii'))
+        events.append(Event('det', sensors, *clock.stamp(sensors)))
+    return events
+
+
+def write_store(directory):
+    event_store = store.EventStore(str(directory), 'det', chunk_rows=4)
+    for event in make_events():
+        event_store.append(event)
+    event_store.close()
+
+
+def test_chunks_are_partitioned_by_hour(tmpdir):
+    write_store(tmpdir)
+    hours = sorted(path.basename for path in tmpdir.join('det').listdir())
+    assert hours == ['2016060110', '2016060111']
+    assert len(store.read_index(str(tmpdir.join('det', '2016060111')))) == 2
+
+
+def test_compact(tmpdir):
+    write_store(tmpdir)
+    directory = str(tmpdir.join('det', '2016060111'))
+    store.compact(directory)
+    index = store.read_index(directory)
+    assert [entry['chunk'] for entry in index] == ['chunk-000002.npz']
+    assert index[0]['rows'] == 4
+    assert sorted(path.basename for path in tmpdir.join(
+        'det', '2016060111').listdir()) == ['chunk-000002.npz', 'index.json']
+    assert store.count(str(tmpdir)) == 6
+
+
+def test_query_time_range_and_conditions(tmpdir):
+    write_store(tmpdir)
+    start = (T0 + 1) * 1000000000
+    results = list(store.query(
+        str(tmpdir), start_ns=start, where=['barometer.pressure>=1003'],
+        columns=['timestamp_ns', 'barometer.pressure', 'sequence']))
+
+    assert set(detector_id for detector_id, _ in results) == {'det'}
+    pressures = np.concatenate(
+        [selected['barometer.pressure'] for _, selected in results])
+    assert pressures.tolist() == [1003, 1004, 1005]
+    assert results[0][1]['timestamp_ns'][0] == start + 500000000
+    assert store.count(str(tmpdir), hits_only=True) == 3
+    assert store.count(str(tmpdir), end_ns=start) == 2
+
+
+def test_events_without_gps_time_use_the_host_clock(tmpdir):
+    event_store = store.EventStore(str(tmpdir), 'det')
+    event_store.append(Event('det', Sensors()))
+    event_store.close()
+    selected = list(store.query(str(tmpdir)))[0][1]
+    assert selected['gps'].tolist() == [False]
+
+
+def test_invalid_condition():
+    with pytest.raises(ValueError):
+        store.parse_condition('unknown>1')
+    with pytest.raises(ValueError):
+        store.parse_condition('barometer.pressure ~ 1')
+
+
+def test_query_command(tmpdir):
+    write_store(tmpdir)
+    result = CliRunner().invoke(cli, [
+        'query', str(tmpdir), '--hits', '--columns', 'sequence',
+        '--start', str(T0 + 1)])
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == [
+        'detector_id,sequence', 'det,3', 'det,5']
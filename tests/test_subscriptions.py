@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+"""Subscription tests."""
+
+from __future__ import absolute_import, print_function
+
+import json
+import socket
+import threading
+
+import pytest
+
+from cosmicpi_daq.command_server import (HEADER, CommandServer,
+                                         encode_frame, recv_frame)
+from cosmicpi_daq.detector import Sensors
+from cosmicpi_daq.event import Event
+from cosmicpi_daq.subscriptions import Subscriptions, parse_subscribe
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def publish(subscriptions, sensors, line):
+    group = sensors.update(line)
+    subscriptions.publish(group, Event('det', sensors, 1000, True))
+
+
+def messages(subscriber):
+    data = subscriber.pop_all()
+    frames = []
+    while data:
+        size, = HEADER.unpack(data[:HEADER.size])
+        end = HEADER.size + size
+        frames.append(json.loads(data[HEADER.size:end].decode('utf-8')))
+        data = data[end:]
+    return frames
+
+
+def test_parse_subscribe():
+    assert parse_subscribe('status') is None
+    assert parse_subscribe('subscribe event monitor') == ['event', 'monitor']
+    assert 'barometer' in parse_subscribe('subscribe')
+    with pytest.raises(ValueError):
+        parse_subscribe('subscribe event bogus')
+
+
+def test_messages_are_filtered_by_type():
+    subscriptions = Subscriptions()
+    notified = []
+    barometer = subscriptions.subscribe(
+        ['barometer'], lambda: notified.append(1))
+    sensors = Sensors()
+
+    publish(subscriptions, sensors, b"{'barometer': {'pressure': '1000.5'}}")
+    publish(subscriptions, sensors, b"{'temperature': {'humidity': '40'}}")
+    publish(subscriptions, sensors, b"{'barometer': {'pressure': '1001.0'}}")
+
+    # Only the first of the waiting messages wakes the consumer up.
+    assert notified == [1]
+    received = messages(barometer)
+    assert [message['barometer']['pressure'] for message in received] == \
+        [1000.5, 1001.0]
+    assert received[0]['type'] == 'barometer'
+    assert received[0]['detector_id'] == 'det'
+    assert received[0]['timestamp_ns'] == 1000
+
+    subscriptions.unsubscribe(barometer)
+    assert subscriptions.wanted == frozenset()
+
+
+def test_slow_subscribers_are_dropped():
+    subscriptions = Subscriptions(capacity=2)
+    slow = subscriptions.subscribe(['barometer'], lambda: None)
+    fast = subscriptions.subscribe(['barometer'], lambda: None)
+    sensors = Sensors()
+    drops = subscriptions.drops.value
+
+    for pressure in (b'1', b'2'):
+        publish(subscriptions, sensors,
+                b"{'barometer': {'pressure': '%s'}}" % pressure)
+        messages(fast)
+    publish(subscriptions, sensors, b"{'barometer': {'pressure': '3'}}")
+
+    assert slow.dropped
+    assert not slow.frames
+    assert subscriptions.subscribers == [fast]
+    assert subscriptions.drops.value == drops + 1
+    assert [message['barometer']['pressure']
+            for message in messages(fast)] == [3.0]
+
+
+def test_monitor_sends_changes():
+    clock = Clock()
+    status = {'det': dict(published=0, broker=True)}
+    subscriptions = Subscriptions(status=lambda: status, clock=clock)
+    subscriber = subscriptions.subscribe(['monitor'], lambda: None)
+
+    subscriptions.tick()
+    assert messages(subscriber) == [dict(
+        type='monitor', detectors={'det': dict(published=0, broker=True)})]
+
+    status = {'det': dict(published=5, broker=True)}
+    subscriptions.tick()
+    assert messages(subscriber) == []
+    clock.now = 1.0
+    subscriptions.tick()
+    assert messages(subscriber) == [dict(
+        type='monitor', detectors={'det': dict(published=5)})]
+    clock.now = 2.0
+    subscriptions.tick()
+    assert messages(subscriber) == []
+
+
+def test_server_pushes_to_subscribers(tmpdir):
+    subscriptions = Subscriptions()
+    server = CommandServer(str(tmpdir.join('commands.sock')),
+                           lambda command: command.upper(),
+                           idle_timeout=0.3, subscriptions=subscriptions)
+    server.start()
+    thread = threading.Thread(target=server.serve, args=(0.05,))
+    thread.start()
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(5)
+        sock.connect(server.path)
+        sock.sendall(encode_frame('subscribe bogus') +
+                     encode_frame('subscribe event'))
+        assert recv_frame(sock).startswith('Error: unknown types')
+        assert recv_frame(sock) == 'Subscribed to event\n'
+
+        sensors = Sensors()
+        publish(subscriptions, sensors, b"{'event': {'sequence': '7'}}")
+        message = json.loads(recv_frame(sock))
+        assert message['type'] == 'event'
+        assert message['event']['sequence'] == 7
+
+        # Subscribers outlive the idle timeout, they leave by closing.
+        sock.settimeout(0.5)
+        with pytest.raises(socket.timeout):
+            sock.recv(1)
+        sock.close()
+        for _ in range(100):
+            if not subscriptions.subscribers:
+                break
+            threading.Event().wait(0.05)
+        assert not subscriptions.subscribers
+    finally:
+        server.stop()
+        thread.join()
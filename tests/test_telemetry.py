@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+
+"""Telemetry filter tests."""
+
+from __future__ import absolute_import, print_function
+
+import pytest
+
+from cosmicpi_daq.detector import Detector, Sensors
+from cosmicpi_daq.event import Event
+from cosmicpi_daq.serializers import get_serializer
+from cosmicpi_daq.telemetry import TelemetryFilter, parse_deadband
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture()
+def clock():
+    return Clock()
+
+
+def read(telemetry, sensors, line):
+    group = sensors.update(line)
+    return telemetry.filter(group, Event('det', sensors))
+
+
+def test_deadband_and_heartbeat(clock):
+    telemetry = TelemetryFilter(heartbeat=60, clock=clock)
+    sensors = Sensors()
+    pressure = b"{'barometer': {'pressure': '%s'}}"
+
+    assert read(telemetry, sensors, pressure % b'1000.00') is not None
+    assert read(telemetry, sensors, pressure % b'1000.05') is None
+    # Changes are measured from the last published value.
+    assert read(telemetry, sensors, pressure % b'1000.10') is not None
+    clock.now = 59
+    assert read(telemetry, sensors, pressure % b'1000.10') is None
+    clock.now = 61
+    assert read(telemetry, sensors, pressure % b'1000.10') is not None
+    assert telemetry.suppressed == 2
+
+
+def test_exact_and_ignored_fields(clock):
+    telemetry = TelemetryFilter(clock=clock)
+    sensors = Sensors()
+
+    assert read(telemetry, sensors, b"{'status': {'baro_status': 1}}")
+    assert read(telemetry, sensors, b"{'status': {'baro_status': 2}}")
+    assert read(telemetry, sensors, b"{'timing': {'uptime': 1}}")
+    assert read(telemetry, sensors, b"{'timing': {'uptime': 2}}") is None
+
+
+def test_events_pass_through(clock):
+    telemetry = TelemetryFilter(clock=clock)
+    sensors = Sensors()
+    for _ in range(3):
+        assert read(telemetry, sensors, b"{'event': {'sequence': 1}}")
+        assert read(telemetry, sensors, b"{'vibration': {'count': 1}}")
+
+
+def test_window_aggregation(clock):
+    telemetry = TelemetryFilter(window=10, clock=clock)
+    sensors = Sensors()
+    line = b"{'accelerometer': {'x': %d, 'y': 1, 'z': 0}}"
+
+    for now, x in ((0, 3), (4, 1), (8, 5)):
+        clock.now = now
+        assert read(telemetry, sensors, line % x) is None
+    clock.now = 10
+    sensors.update(line % 7)
+    original = Event('det', sensors)
+    event = telemetry.filter('accelerometer', original)
+
+    assert event.accelerometer.x == 4
+    assert event.aggregates['accelerometer'] == dict(
+        samples=4,
+        min=dict(x=1, y=1, z=0),
+        max=dict(x=7, y=1, z=0),
+        mean=dict(x=4, y=1, z=0),
+    )
+    assert original.accelerometer.x == 7
+    assert original.aggregates is None
+    assert telemetry.aggregated_readings == 3
+
+    clock.now = 11
+    assert read(telemetry, sensors, line % 2) is None
+
+
+@pytest.mark.parametrize('name', ['json', 'binary'])
+def test_aggregates_are_serialized(name, clock):
+    telemetry = TelemetryFilter(window=1, clock=clock)
+    sensors = Sensors()
+    read(telemetry, sensors, b"{'magnetometer': {'x': 1}}")
+    clock.now = 1
+    event = read(telemetry, sensors, b"{'magnetometer': {'x': 3}}")
+
+    serializer = get_serializer(name)
+    decoded = serializer.loads(serializer.dumps(event))
+    assert decoded['magnetometer']['x'] == 2
+    assert decoded['aggregates']['magnetometer']['max']['x'] == 3
+    assert 'aggregates' not in serializer.loads(
+        serializer.dumps(Event('det', sensors)))
+
+
+def test_parse_deadband():
+    assert parse_deadband('barometer.pressure=0.5') == (
+        'barometer.pressure', 0.5)
+    assert parse_deadband('timing.uptime=none') == ('timing.uptime', None)
+    with pytest.raises(ValueError):
+        parse_deadband('barometer.humidity=1')
+
+
+def test_detector_publishes_filtered_events(clock):
+    detector = Detector(None, None, False, detector_id='telemetry-test',
+                        telemetry=TelemetryFilter(clock=clock))
+    line = b"{'temperature': {'temperature': 20, 'humidity': 50}}"
+
+    assert detector.process_line(line) is not None
+    assert detector.process_line(line) is None
+    assert detector.process_line(b"{'event': {'sequence': 1}}") is not None
+    assert detector.events_total.value == 3
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+
+"""Event timing tests."""
+
+from __future__ import absolute_import, print_function
+
+import time
+
+from cosmicpi_daq.detector import Detector, Sensors
+from cosmicpi_daq.timing import BoardClock, format_date
+
+#: 2016-06-21T12:00:00 UTC.
+T0 = 1466510400
+
+
+def pulse(sensors, second, frequency):
+    sensors.update("{{'timing': {{'time_string': '{0}', "
+                   "'counter_frequency': {1}}}}}".format(
+                       second, frequency).encode('ascii'))
+
+
+def test_host_clock_until_synchronised():
+    clock = BoardClock(host_clock=lambda: 1000.5)
+    sensors = Sensors()
+    assert clock.stamp(sensors) == (1000500000000, False)
+    sensors.update(b"{'timing': {'counter_frequency': 1000}}")
+    assert clock.stamp(sensors) == (1000500000000, False)
+    assert not clock.synchronised
+
+
+def test_hits_are_stamped_from_the_counter():
+    clock = BoardClock(host_clock=lambda: T0 + 0.2)
+    sensors = Sensors()
+    pulse(sensors, T0, 84000000)
+    assert clock.stamp(sensors) == (T0 * 1000000000, True)
+    sensors.update(b"{'event': {'sequence': 1, 'ticks': 21000000}}")
+    assert clock.stamp(sensors) == (T0 * 1000000000 + 250000000, True)
+    assert abs(clock.offset - 0.2) < 1e-6
+
+
+def test_frequency_model():
+    clock = BoardClock(smoothing=0.5)
+    sensors = Sensors()
+    for index, frequency in enumerate((1000000, 1000010, 1000010, 2000000)):
+        pulse(sensors, T0 + index, frequency)
+        clock.stamp(sensors)
+    assert 1000000 < clock.frequency < 1000010
+    assert clock.rejected == 1
+    assert clock.jitter_ns > 0
+
+    pulse(sensors, T0 + 6, 1000010)
+    clock.stamp(sensors)
+    assert clock.missed_pulses == 2
+    assert clock.pulses == 5
+
+
+def test_bad_seed_is_replaced():
+    clock = BoardClock(reseed_after=3)
+    sensors = Sensors()
+    pulse(sensors, T0, 42000000)
+    clock.stamp(sensors)
+    for index in range(1, 200):
+        pulse(sensors, T0 + index, 84000000 + index % 2)
+        clock.stamp(sensors)
+    assert abs(clock.frequency - 84000000) < 2
+    assert clock.rejected == 3
+
+    # Isolated glitches do not replace a good estimate.
+    for index, frequency in enumerate((42000000, 84000000, 42000000), 200):
+        pulse(sensors, T0 + index, frequency)
+        clock.stamp(sensors)
+    assert abs(clock.frequency - 84000000) < 2
+    assert clock.rejected == 5
+
+
+def test_format_date():
+    assert format_date(T0 * 1000000000 + 999999999) == \
+        time.asctime(time.gmtime(T0))
+
+
+def test_detector_events_use_gps_time():
+    detector = Detector(None, None, False, detector_id='timing-test')
+    detector.process_line(
+        "{{'timing': {{'time_string': '{0}', 'counter_frequency': 1000}}}}"
+        .format(T0).encode('ascii'))
+    detector.process_line(b"{'event': {'sequence': 1, 'ticks': 500}}")
+    event = detector.make_event()
+    assert event.gps
+    assert event.timestamp_ns == T0 * 1000000000 + 500000000
+    assert event.date == {'date': 'Tue Jun 21 12:00:00 2016'}
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of CosmicPi-DAQ.
+# Copyright (C) 2016 Justin Lewis Salmon.
+#
+# CosmicPi-DAQ is free software; you can redistribute it
+# and/or modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# CosmicPi-DAQ is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CosmicPi-DAQ; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+# MA 02111-1307, USA.
+
+
+"""Serial reader tests, using a pseudo terminal as the serial port."""
+
+from __future__ import absolute_import, print_function
+
+import os
+import pty
+import tty
+
+import pytest
+
+from cosmicpi_daq.event_publisher import Backoff
+from cosmicpi_daq.simulator import VirtualPorts
+from cosmicpi_daq.usb_handler import UsbHandler
+
+
+@pytest.fixture()
+def port():
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    yield master, os.ttyname(slave)
+    for fd in (master, slave):
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+
+@pytest.fixture()
+def ports(tmpdir):
+    ports = VirtualPorts(str(tmpdir))
+    yield ports
+    ports.close()
+
+
+def virtual_handler(ports, path, **kwargs):
+    return UsbHandler(path, 9600, 0.2, poll_interval=0.01, ports=ports,
+                      **kwargs)
+
+
+def read_line(handler, attempts=20):
+    for _ in range(attempts):
+        line = handler.readline()
+        if line:
+            return line
+    return line
+
+
+def test_burst_and_partial_lines(port):
+    master, name = port
+    handler = UsbHandler(name, 115200, 0.1, read_size=64)
+    opens, lines_read = handler.opens.value, handler.lines_read.value
+    handler.open()
+    lines = [b"{'event': {'sequence': %d}}\n" % index for index in range(32)]
+    os.write(master, b''.join(lines) + b"{'status': ")
+
+    assert [handler.readline() for _ in lines] == lines
+    assert handler.readline() == ''
+    os.write(master, b"{'queue_size': 0}}\n")
+    assert handler.readline() == b"{'status': {'queue_size': 0}}\n"
+    assert handler.opens.value == opens + 1
+    assert handler.lines_read.value == lines_read + 33
+
+
+def test_timeout_keeps_port_open(port):
+    master, name = port
+    handler = UsbHandler(name, 9600, 0.05)
+    opens = handler.opens.value
+    assert handler.readline() == ''
+    assert handler.is_open
+    os.write(master, b'line\n')
+    assert handler.readline() == b'line\n'
+    assert handler.opens.value == opens + 1
+
+
+def test_overlong_lines_are_discarded(port):
+    master, name = port
+    handler = UsbHandler(name, 9600, 0.05, read_size=16, max_line=32)
+    handler.open()
+    os.write(master, b'x' * 100 + b'\nshort\n')
+    lines = [handler.readline() for _ in range(10)]
+    assert b'short\n' in lines
+    assert handler.overlong >= 1
+
+
+def test_error_closes_port(port):
+    master, name = port
+    handler = UsbHandler(name, 9600, 0.05)
+    errors = handler.errors.value
+    assert handler.readline() == ''
+    os.close(master)
+    assert handler.readline() == ''
+    assert not handler.is_open
+    assert handler.errors.value == errors + 1
+
+
+def test_reopens_after_unplug(ports):
+    handler = virtual_handler(ports, ports.plug('ttyACM0', 'A1'))
+    outages = handler.outages.count
+    handler.open()
+    ports.write('ttyACM0', b'first\n')
+    assert read_line(handler) == b'first\n'
+
+    ports.unplug('ttyACM0')
+    assert handler.readline() == ''
+    assert not handler.is_open
+    assert handler.readline() == ''
+
+    ports.plug('ttyACM0', 'A1')
+    assert handler.reconnect()
+    ports.write('ttyACM0', b'second\n')
+    assert read_line(handler) == b'second\n'
+    assert handler.outages.count == outages + 1
+
+
+def test_board_is_found_by_serial_number(ports):
+    handler = virtual_handler(ports, ports.plug('ttyACM0', 'A1'))
+    handler.open()
+    assert handler.serial_number == 'A1'
+
+    ports.unplug('ttyACM0')
+    handler.readline()
+    ports.plug('ttyACM0', 'B2')
+    ports.plug('ttyACM1', 'A1')
+    assert handler.reconnect()
+    assert handler.path == os.path.realpath(ports.path('ttyACM1'))
+    ports.write('ttyACM1', b'moved\n')
+    assert read_line(handler) == b'moved\n'
+
+
+def test_board_is_not_followed(ports):
+    handler = virtual_handler(ports, ports.plug('ttyACM0', 'A1'),
+                              follow=False)
+    handler.open()
+    ports.unplug('ttyACM0')
+    handler.readline()
+    ports.plug('ttyACM1', 'A1')
+    assert not handler.reconnect()
+
+
+def test_failed_opens_back_off(tmpdir):
+    handler = UsbHandler(str(tmpdir), 9600, 0.05, ports=dict,
+                         backoff=Backoff(initial=10, jitter=0))
+    opens, errors = handler.opens.value, handler.errors.value
+    assert not handler.reconnect()
+    assert not handler.reconnect()
+    assert handler.errors.value == errors + 1
+    assert handler.opens.value == opens